@@ -0,0 +1,94 @@
+# search.py
+# Benchmark /api/search: latency query FTS5 (search_messages) di database dengan
+# banyak pesan, dibandingkan dengan LIKE '%kata%' (full table scan) sebagai baseline.
+# Database dibuat lewat migration master (trigger FTS ikut mengisi index).
+#
+#   python benchmarks/search.py [jumlah_pesan]   (default 1000000)
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'master'))
+import app  # noqa: E402  (schema + search_messages sama di master dan slave)
+
+WORDS = ('halo semua gimana kabar tugas sister sinkronisasi master slave database '
+         'replikasi server jaringan offline online pesan diskusi besok kumpul jam '
+         'oke siap sudah belum coba lagi error berhasil').split()
+# Kosakata panjang dengan distribusi Zipf supaya ada kata umum dan kata langka
+VOCABULARY = WORDS + [f"kata{i}" for i in range(20000)]
+CUM_WEIGHTS = list(accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+RARE_WORD = 'deadlinekuis'  # Disisipkan ke 50 pesan saja
+
+QUERIES = [
+    ('rare word', RARE_WORD, None, 0),
+    ('common word', 'halo', None, 0),
+    ('common word, deep page', 'halo', None, 1000),
+    ('two words (AND)', 'tugas besok', None, 0),
+    ('prefix', 'sinkron*', None, 0),
+    ('common word + username', 'halo', 'user7', 0),
+]
+
+def populate(conn, count, batch_size=10000):
+    random.seed(42)
+    usernames = [f"user{i}" for i in range(50)]
+    rare_ids = set(random.sample(range(count), min(50, count)))
+    started = datetime(2024, 1, 1, 8, 0, 0)
+
+    for start in range(0, count, batch_size):
+        rows = []
+        for i in range(start, min(start + batch_size, count)):
+            words = random.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=random.randint(3, 30))
+            if i in rare_ids:
+                words.append(RARE_WORD)
+            rows.append((random.choice(usernames), ' '.join(words),
+                         (started + timedelta(seconds=i * 7)).strftime('%Y-%m-%d %H:%M:%S'),
+                         app.new_uid(), i + 1, 'bench'))
+        conn.executemany('''
+            INSERT INTO messages (username, message, timestamp, uid, hlc, node_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1], result
+
+def run(count, repeat=50):
+    workdir = tempfile.mkdtemp(prefix='search-bench-')
+    app.config.DB_PATH = os.path.join(workdir, 'bench.db')
+    app.init_db()
+    conn = app.get_db()
+
+    started = time.perf_counter()
+    populate(conn, count)
+    build_seconds = time.perf_counter() - started
+    db_mb = app.database_size() / 1024 / 1024
+    print(f"\n{count} messages: insert + FTS index {build_seconds:.1f}s "
+          f"({count / build_seconds:.0f} rows/s), database {db_mb:.0f} MB")
+
+    print(f"{'query':<28} {'matches':>9} {'median ms':>10} {'p95 ms':>8}")
+    for name, text, username, offset in QUERIES:
+        matches = conn.execute('SELECT COUNT(*) FROM messages_fts WHERE messages_fts MATCH ?',
+                               (app.fts_query(text),)).fetchone()[0]
+        median, p95, _ = measure(lambda: app.search_messages(text, username, 20, offset), repeat)
+        print(f"{name:<28} {matches:>9} {median:>10.2f} {p95:>8.2f}")
+
+    # Baseline tanpa index: LIKE harus membaca seluruh tabel
+    median, p95, _ = measure(lambda: conn.execute(
+        'SELECT id FROM messages WHERE message LIKE ? ORDER BY id DESC LIMIT 20',
+        (f'%{RARE_WORD}%',)).fetchall(), 3)
+    print(f"{'rare word via LIKE (scan)':<28} {'':>9} {median:>10.2f} {p95:>8.2f}")
+
+if __name__ == '__main__':
+    for count in [int(arg) for arg in sys.argv[1:]] or [1000000]:
+        run(count)
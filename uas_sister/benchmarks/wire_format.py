@@ -0,0 +1,61 @@
+# wire_format.py
+# Benchmark format wire antar node: ukuran payload (bytes di jaringan) dan waktu
+# encode/decode untuk JSON per pesan, JSON kolumnar, dan msgpack kolumnar
+# (kalau terinstall), masing-masing tanpa dan dengan gzip.
+#
+#   python benchmarks/wire_format.py [jumlah_pesan ...]
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'master'))
+import app  # noqa: E402  (codec sama persis di master dan slave)
+
+WORDS = ('halo semua gimana kabar tugas sister sinkronisasi master slave database '
+         'replikasi server jaringan offline online pesan diskusi besok kumpul jam '
+         'oke siap sudah belum coba lagi error berhasil').split()
+
+def make_messages(count):
+    random.seed(42)
+    usernames = [f"user{i}" for i in range(50)]
+    started = datetime(2024, 1, 1, 8, 0, 0)
+    return [{
+        'id': i + 1,
+        'username': random.choice(usernames),
+        'message': ' '.join(random.choice(WORDS) for _ in range(random.randint(3, 30))),
+        'timestamp': (started + timedelta(seconds=i * 7)).strftime('%Y-%m-%d %H:%M:%S')
+    } for i in range(count)]
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def run(count, repeat=5):
+    messages = make_messages(count)
+    baseline = None
+    print(f"\n{count} messages")
+    print(f"{'format':<45} {'gzip':<5} {'bytes':>10} {'ratio':>7} {'encode ms':>10} {'decode ms':>10}")
+    
+    for content_type in reversed(app.wire_formats()):
+        for use_gzip in (False, True):
+            body, content_encoding = app.encode_wire_body(messages, content_type, use_gzip)
+            encode_ms = best_of(lambda: app.encode_wire_body(messages, content_type, use_gzip), repeat)
+            decode_ms = best_of(lambda: app.decode_wire(body, content_type, content_encoding), repeat)
+            assert app.decode_wire(body, content_type, content_encoding) == messages
+            
+            if baseline is None:
+                baseline = len(body)
+            print(f"{content_type:<45} {'yes' if content_encoding else 'no':<5} {len(body):>10} "
+                  f"{len(body) / baseline:>7.2f} {encode_ms:>10.2f} {decode_ms:>10.2f}")
+
+if __name__ == '__main__':
+    if app.msgpack is None:
+        print("msgpack not installed, skipping MessagePack (pip install msgpack)")
+    for count in [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]:
+        run(count)
@@ -1,13 +1,27 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
 import threading
 import time
 import json
-from datetime import datetime
+import re
+import gzip
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from itertools import islice
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlsplit
 import logging
+import os
+import tempfile
 import config
-from queue import Queue
+from queue import Queue, Empty
+from concurrent.futures import Future
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -15,16 +29,763 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
+STARTED_AT = time.time()
 
 # Message queue untuk offline messages
 message_queue = Queue()
 failed_sync_queue = {}  # {slave_url: [messages]}
 
-# Database initialization dengan tabel tambahan untuk tracking sync
-def init_db():
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
+# Hub untuk push pesan baru ke browser (Server-Sent Events)
+class MessageHub:
+    """Fan-out pesan baru ke semua subscriber /api/stream.
+
+    Event disimpan di satu ring buffer bersama. Subscriber hanya mengingat
+    seq terakhir yang sudah dikirim, jadi tidak ada queue per client dan
+    menyimpan event O(1) berapapun jumlah subscriber.
+
+    Biaya membangunkan subscriber tergantung serving mode. Di mode 'flask'
+    setiap stream memegang satu thread Werkzeug yang menunggu di Condition,
+    jadi notify_all() membangunkan O(subscriber) thread. Di mode 'asgi'
+    (default, asgi.py) satu-satunya waker adalah StreamNotifier: publish
+    me-resolve satu future bersama dan subscriber berupa coroutine, tanpa
+    thread per client.
+    """
+
+    def __init__(self, buffer_size):
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._wakers = []
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def add_waker(self, callback):
+        """callback() dipanggil setiap publish, untuk subscriber di luar Condition (event loop ASGI)"""
+        self._wakers.append(callback)
+
+    def publish(self, message):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, message))
+            self._cond.notify_all()
+            seq = self._seq
+        
+        for callback in self._wakers:
+            callback()
+        return seq
+
+    def wait_for_events(self, last_seq, timeout):
+        """Tunggu event dengan seq > last_seq.
+
+        Return (events, last_seq, missed). missed=True berarti sebagian event
+        sudah keluar dari buffer (atau server restart), client harus re-fetch
+        lewat /api/messages?since_id=.
+        """
+        with self._cond:
+            if last_seq > self._seq:
+                return [], self._seq, True
+            if last_seq == self._seq:
+                self._cond.wait(timeout)
+            if not self._events or last_seq >= self._seq:
+                return [], self._seq, False
+
+            oldest = self._events[0][0]
+            missed = last_seq + 1 < oldest
+            start = max(0, last_seq + 1 - oldest)
+            events = list(islice(self._events, start, None))
+            return events, self._seq, missed
+
+message_hub = MessageHub(config.STREAM_BUFFER_SIZE)
+
+# Metrics in-memory untuk /metrics (format text Prometheus)
+class Metrics:
+    """Counter, gauge dan histogram yang di-update langsung di hot path.
+
+    Semua nilai disimpan di memori per (nama, label), jadi scrape /metrics
+    hanya memformat angka yang sudah ada dan tidak pernah query SQLite.
+    Gauge yang nilainya sudah dipegang objek lain (acked_seq replicator,
+    ukuran queue) dibaca lewat callback saat scrape.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # nama -> (type, help)
+        self._values = {}  # nama -> {labels: value}
+        self._histograms = {}  # nama -> {labels: [bucket counts, sum, count]}
+        self._callbacks = {}  # nama -> (label, fn)
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def gauge_callback(self, name, help_text, fn, label=None):
+        """Gauge yang dibaca saat scrape: fn() -> angka, atau {nilai label: angka} kalau label diisi"""
+        self.describe(name, 'gauge', help_text)
+        self._callbacks[name] = (label, fn)
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def set_max(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = max(series.get(key, value), value)
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+            entry[0][bisect_left(self.BUCKETS, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def timed(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _format_labels(key):
+        if not key:
+            return ''
+        pairs = []
+        for label, value in key:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{label}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self):
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+            histograms = {name: {key: (list(entry[0]), entry[1], entry[2]) for key, entry in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, (label, fn) in list(self._callbacks.items()):
+            try:
+                result = fn()
+            except Exception as e:
+                logger.error(f"Metric {name} failed: {str(e)}")
+                continue
+            if label is None:
+                values[name] = {(): result}
+            else:
+                values[name] = {((label, label_value),): value for label_value, value in result.items()}
+        
+        lines = []
+        for name in sorted(set(values) | set(histograms)):
+            kind, help_text = self._meta.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(values.get(name, {}).items()):
+                lines.append(f'{name}{self._format_labels(key)} {value}')
+            for key, (buckets, total, count) in sorted(histograms.get(name, {}).items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.BUCKETS + ('+Inf',), buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{self._format_labels(key + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{self._format_labels(key)} {total}')
+                lines.append(f'{name}_count{self._format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def timed_query(name):
+    """Decorator: latency fungsi database dicatat di chat_db_query_seconds{query=name}"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.timed('chat_db_query_seconds', query=name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+metrics.describe('chat_messages_inserted_total', 'counter', 'Pesan yang disimpan, per asal pesan')
+metrics.describe('chat_messages_stored', 'gauge', 'Jumlah pesan di database node ini (counter, bukan COUNT(*))')
+metrics.describe('chat_last_seq', 'gauge', 'messages.id tertinggi (posisi replication log)')
+metrics.describe('chat_peer_request_seconds', 'histogram', 'Latency HTTP ke node lain per peer dan endpoint')
+metrics.describe('chat_peer_request_errors_total', 'counter', 'HTTP ke node lain yang gagal (timeout/koneksi)')
+metrics.describe('chat_replicated_messages_total', 'counter', 'Pesan yang sudah di-ack slave/peer')
+metrics.describe('chat_replication_failures_total', 'counter', 'Batch replikasi yang gagal (di-retry dengan backoff)')
+metrics.describe('chat_archived_messages_total', 'counter', 'Pesan yang dipindah ke arsip oleh retention')
+metrics.describe('chat_pruned_rows_total', 'counter', 'Row bookkeeping sync yang di-prune, per tabel')
+metrics.describe('chat_vacuumed_pages_total', 'counter', 'Page yang dilepas incremental VACUUM')
+metrics.describe('chat_db_query_seconds', 'histogram', 'Latency query SQLite per nama query')
+metrics.describe('chat_http_requests_total', 'counter', 'Request HTTP masuk per endpoint')
+
+def record_inserted(origin, batch):
+    if batch:
+        metrics.inc('chat_messages_inserted_total', len(batch), origin=origin)
+        metrics.inc('chat_messages_stored', len(batch))
+        metrics.set_max('chat_last_seq', max(message_data['id'] for message_data in batch))
+
+# Urutan pesan antar node di mode peer
+class HybridLogicalClock:
+    """Hybrid logical clock: jam dinding (ms) + counter logis dalam satu integer.
+
+    Nilai = (physical_ms << LOGICAL_BITS) | logical. now() selalu naik di node
+    ini dan selalu lebih besar dari HLC peer yang sudah di-observe(), jadi
+    urutan (hlc, node_id) mengikuti kausalitas walaupun jam antar node tidak
+    sinkron, dan tetap dekat dengan waktu nyata.
+    """
+    LOGICAL_BITS = 16
+
+    def __init__(self):
+        self._last = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._last
+
+    def now(self):
+        """HLC untuk pesan baru yang ditulis di node ini"""
+        with self._lock:
+            wall = int(time.time() * 1000) << self.LOGICAL_BITS
+            self._last = max(wall, self._last + 1)
+            return self._last
+
+    def observe(self, remote):
+        """Gabungkan HLC dari peer (atau dari database saat start)"""
+        with self._lock:
+            self._last = max(self._last, remote or 0)
+
+hlc = HybridLogicalClock()
+
+def new_uid():
+    """ID global pesan: UUIDv7 (48 bit unix ms + random) sebagai 32 hex.
+
+    Dibuat oleh node tempat pesan ditulis dan dibawa di setiap hop replikasi,
+    jadi unique index uid sekaligus menjadi idempotency key. Urut waktu,
+    sehingga insert ke idx_messages_uid tetap di ujung kanan B-tree.
+    """
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xf << 76)) | (0x7 << 76)  # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # variant RFC 4122
+    return f'{value:032x}'
+
+# Pesan dari sebelum ada kolom uid: uid diturunkan dari isi pesan (uuid5), jadi
+# master dan setiap slave memberi uid yang sama untuk pesan historis yang sama
+LEGACY_UID_NAMESPACE = uuid.UUID('0fcd0ee2-c3dd-4ef1-b28d-7d12f8af1ea0')
+
+def legacy_uid(master_id, username, message, timestamp):
+    """uid deterministik untuk pesan lama; master_id = messages.id pesan itu di master"""
+    key = json.dumps([master_id, username, message, str(timestamp)], ensure_ascii=False)
+    return uuid.uuid5(LEGACY_UID_NAMESPACE, key).hex
+
+def stamp_message():
+    """(uid, hlc) untuk pesan baru yang ditulis di node ini"""
+    return new_uid(), hlc.now()
+
+# Room: setiap pesan milik satu room; read dan replikasi per room lewat idx_messages_room_id
+ROOM_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+def normalize_room(room):
+    """Nama room yang valid (lowercase); kosong = DEFAULT_ROOM. ValueError kalau tidak valid."""
+    room = (room or '').strip().lower() or config.DEFAULT_ROOM
+    if not ROOM_NAME.match(room):
+        raise ValueError(f"Invalid room name: {room!r}")
+    return room
+
+def parse_rooms(value):
+    """?rooms=a,b -> ['a', 'b']; kosong = semua room (None)"""
+    if not value:
+        return None
+    return sorted({normalize_room(room) for room in value.split(',') if room.strip()}) or None
+
+def rooms_clause(rooms):
+    return f"room IN ({', '.join('?' * len(rooms))})"
+
+def parse_authors(value):
+    """?authors=budi,sari -> ['budi', 'sari']; kosong = semua username (None)"""
+    if not value:
+        return None
+    return sorted({author.strip() for author in value.split(',') if author.strip()}) or None
+
+def message_slice_sql(rooms=None, authors=None, since=None):
+    """(klausa, parameter) SQL untuk slice ?rooms=, ?authors=, ?since= di /api/messages dan /api/snapshot"""
+    clauses = []
+    params = []
+    if rooms:
+        clauses.append(rooms_clause(rooms))
+        params.extend(rooms)
+    if authors:
+        clauses.append(f"username IN ({', '.join('?' * len(authors))})")
+        params.extend(authors)
+    if since:
+        clauses.append('timestamp > ?')
+        params.append(since)
+    return clauses, params
+
+# Replikasi selektif: slave mendaftarkan slice data yang disimpannya
+# (room, username, dan/atau window waktu) lewat POST /replication/filter
+def parse_replication_filter(data):
+    """Normalisasi filter dari slave. Return dict, atau None kalau slave menerima semua pesan."""
+    rooms = data.get('rooms')
+    authors = data.get('authors')
+    window_days = data.get('window_days')
+    if rooms is not None:
+        if not isinstance(rooms, list) or not rooms:
+            raise ValueError('rooms must be a non-empty list')
+        rooms = sorted({normalize_room(room) for room in rooms})
+    if authors is not None:
+        if not isinstance(authors, list) or not authors or not all(
+                isinstance(author, str) and author.strip() for author in authors):
+            raise ValueError('authors must be a non-empty list of usernames')
+        authors = sorted({author.strip() for author in authors})
+    if window_days is not None:
+        if isinstance(window_days, bool) or not isinstance(window_days, (int, float)) or window_days <= 0:
+            raise ValueError('window_days must be a positive number')
     
+    if rooms is None and authors is None and window_days is None:
+        return None
+    return {'rooms': rooms, 'authors': authors, 'window_days': window_days}
+
+def replication_filter_sql(replication_filter):
+    """(klausa, parameter) SQL untuk filter replikasi"""
+    clauses = []
+    params = []
+    if replication_filter['rooms'] is not None:
+        clauses.append(rooms_clause(replication_filter['rooms']))
+        params.extend(replication_filter['rooms'])
+    if replication_filter['authors'] is not None:
+        clauses.append(f"username IN ({', '.join('?' * len(replication_filter['authors']))})")
+        params.extend(replication_filter['authors'])
+    if replication_filter['window_days'] is not None:
+        # +timestamp: window dicek per row, range tetap lewat room/username/id
+        clauses.append("+timestamp >= datetime('now', ?)")
+        params.append(f"-{replication_filter['window_days']} days")
+    return clauses, params
+
+# Cache HTML halaman index (di-invalidate oleh versi pesan)
+class RenderCache:
+    """Cache hasil render halaman index per window (?before=).
+
+    Versi pesan naik di setiap insert lewat bump(), dan semua entry lama
+    dibuang. Selama tidak ada tulisan, page load berikutnya dilayani dari
+    memory tanpa query SQLite maupun render Jinja.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def bump(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return html
+
+    def get_or_render(self, key, render):
+        html = self.get(key)
+        if html is not None:
+            return html
+        
+        with self._lock:
+            version = self._version
+            self._misses += 1
+        html = render()
+        with self._lock:
+            # Ada insert selama render: hasilnya mungkin sudah basi, jangan di-cache
+            if self._version == version:
+                self._entries[key] = html
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+render_cache = RenderCache(config.INDEX_CACHE_SIZE)
+
+# Setiap insert pesan (lokal maupun hasil sync) di-publish ke hub setelah commit,
+# jadi publish sekaligus menjadi titik bump versi pesan
+message_hub.add_waker(render_cache.bump)
+
+# Conditional GET (ETag / If-None-Match). Versi pesan direset ke 0 setiap
+# proses start, jadi ETag diberi epoch per proses supaya tidak bentrok
+# dengan ETag yang masih dipegang client dari proses sebelumnya.
+ETAG_EPOCH = uuid.uuid4().hex[:8]
+
+def messages_etag(query):
+    """ETag /api/messages untuk satu query: berubah setiap ada insert, tanpa query ke SQLite.
+
+    query = cursor, limit, dan filter request. Ikut di-hash supaya ETag halaman atau
+    filter lain tidak pernah cocok (304 palsu untuk halaman berikutnya).
+    Harus dihitung sebelum query supaya ETag tidak pernah lebih baru dari body.
+    """
+    digest = hashlib.sha1(repr(query).encode('utf-8')).hexdigest()[:12]
+    return f'"{ETAG_EPOCH}-{render_cache.version}-{digest}"'
+
+def json_etag(data, exclude=()):
+    """Weak ETag dari isi JSON (field di exclude, mis. timestamp, tidak dihitung)"""
+    body = json.dumps({key: value for key, value in data.items() if key not in exclude},
+                      sort_keys=True, default=str)
+    return f'W/"{hashlib.sha1(body.encode()).hexdigest()[:16]}"'
+
+def etag_matches(if_none_match, etag):
+    """Perbandingan weak sesuai aturan If-None-Match (suffix representasi diabaikan)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    
+    def opaque(tag):
+        return tag.strip().removeprefix('W/').strip('"').split('+')[0]
+    return any(opaque(tag) == opaque(etag) for tag in if_none_match.split(','))
+
+def not_modified(etag):
+    return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+# Format wire antar node. Daftar pesan dikirim kolumnar (nama field sekali,
+# bukan di setiap pesan), opsional MessagePack, dan di-gzip kalau cukup besar.
+# Format dinegosiasikan lewat Accept / Content-Type; JSON biasa tetap fallback.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # opsional, tanpa msgpack dipakai JSON kolumnar
+
+WIRE_JSON = 'application/json'
+WIRE_COLUMNS = 'application/vnd.discussion.columns+json'
+WIRE_MSGPACK = 'application/vnd.discussion.columns+msgpack'
+
+class UnsupportedWireFormat(ValueError):
+    pass
+
+def wire_formats():
+    """Format yang bisa dibaca node ini, urut dari yang paling ringkas"""
+    return ([WIRE_MSGPACK] if msgpack is not None else []) + [WIRE_COLUMNS, WIRE_JSON]
+
+def wire_accept_header():
+    formats = wire_formats()
+    return ', '.join(f"{content_type};q={1 - i / 10:.1f}" for i, content_type in enumerate(formats))
+
+def negotiate_wire_format(accept):
+    """Pilih format response dari header Accept (browser selalu dapat JSON)"""
+    offered = {part.split(';')[0].strip() for part in (accept or '').split(',')}
+    for content_type in wire_formats():
+        if content_type in offered:
+            return content_type
+    return WIRE_JSON
+
+def accepts_gzip(accept_encoding):
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip() == 'gzip' and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            return True
+    return False
+
+def pack_messages(messages):
+    fields = list(messages[0]) if messages else []
+    return {'fields': fields, 'columns': [[msg[field] for msg in messages] for field in fields]}
+
+def unpack_messages(packed):
+    return [dict(zip(packed['fields'], row)) for row in zip(*packed['columns'])]
+
+def encode_wire(data, content_type):
+    """data = list pesan, atau dict dengan list pesan di key 'messages'"""
+    if content_type != WIRE_JSON:
+        if isinstance(data, list):
+            data = pack_messages(data)
+        else:
+            data = dict(data, messages=pack_messages(data['messages']))
+    if content_type == WIRE_MSGPACK:
+        return msgpack.packb(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def encode_wire_body(data, content_type, allow_gzip):
+    """Return (body, content_encoding); gzip hanya kalau body cukup besar"""
+    body = encode_wire(data, content_type)
+    if allow_gzip and len(body) >= config.WIRE_GZIP_MIN_SIZE:
+        return gzip.compress(body, config.WIRE_GZIP_LEVEL), 'gzip'
+    return body, None
+
+def decode_wire(body, content_type, content_encoding=None):
+    """Kebalikan encode_wire_body; pesan kolumnar dikembalikan sebagai list of dict"""
+    if content_encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif content_encoding not in (None, '', 'identity'):
+        raise UnsupportedWireFormat(f"Unsupported Content-Encoding: {content_encoding}")
+    
+    media_type = (content_type or WIRE_JSON).split(';')[0].strip()
+    if media_type == WIRE_JSON:
+        return json.loads(body)
+    if media_type == WIRE_MSGPACK and msgpack is not None:
+        data = msgpack.unpackb(body)
+    elif media_type == WIRE_COLUMNS:
+        data = json.loads(body)
+    else:
+        raise UnsupportedWireFormat(f"Unsupported Content-Type: {media_type}")
+    
+    if 'fields' in data:
+        return unpack_messages(data)
+    return dict(data, messages=unpack_messages(data['messages']))
+
+def variant_etag(etag, content_type, content_encoding):
+    """ETag per representasi (format + gzip); etag_matches mengabaikan suffix ini"""
+    suffix = {WIRE_JSON: '', WIRE_COLUMNS: '+cols', WIRE_MSGPACK: '+mp'}[content_type]
+    if content_encoding:
+        suffix += f'+{content_encoding}'
+    return f'{etag[:-1]}{suffix}"' if suffix else etag
+
+# Connection pool untuk traffic antar node (keep-alive per peer)
+class PeerHTTPClient:
+    """HTTP client untuk traffic antar node.
+
+    Satu requests.Session per peer dengan connection pool keep-alive, jadi
+    sync dan health check tidak membuka koneksi TCP baru di setiap request.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                                      pool_block=config.HTTP_POOL_BLOCK)
+                session.mount(base_url, adapter)
+                self._sessions[base_url] = session
+            return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (config.HTTP_CONNECT_TIMEOUT, config.SYNC_TIMEOUT))
+        parts = urlsplit(url)
+        peer = f"{parts.scheme}://{parts.netloc}"
+        started = time.perf_counter()
+        try:
+            response = self._session(url).request(method, url, **kwargs)
+        except Exception:
+            metrics.inc('chat_peer_request_errors_total', peer=peer, endpoint=parts.path)
+            raise
+        metrics.observe('chat_peer_request_seconds', time.perf_counter() - started,
+                        peer=peer, endpoint=parts.path)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def pool_stats(self):
+        """Statistik reuse koneksi per peer (dari urllib3 connection pool)"""
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        
+        for base_url, session in sessions:
+            poolmanager = session.get_adapter(base_url).poolmanager
+            total_requests = 0
+            connections_opened = 0
+            for key in list(poolmanager.pools.keys()):
+                pool = poolmanager.pools.get(key)
+                if pool is not None:
+                    total_requests += pool.num_requests
+                    connections_opened += pool.num_connections
+            
+            stats[base_url] = connection_reuse_stats(total_requests, connections_opened)
+        return stats
+
+def connection_reuse_stats(total_requests, connections_opened):
+    """Satu entry http_pools di /api/sync_status (sama untuk mode flask dan asgi)"""
+    reused = max(0, total_requests - connections_opened)
+    return {
+        'requests': total_requests,
+        'connections_opened': connections_opened,
+        'reused': reused,
+        'reuse_ratio': round(reused / total_requests, 3) if total_requests else 0.0
+    }
+
+peer_client = PeerHTTPClient()
+
+# Cache status kesehatan slave (di-update oleh satu background thread)
+class HealthTracker:
+    """Satu background thread yang mem-probe /health setiap peer dan meng-cache hasilnya.
+
+    Route dan sync loop membaca status dari cache (O(1)) dan tidak pernah
+    melakukan HTTP call sendiri. Status dianggap basi kalau probe terakhir
+    lebih lama dari ttl detik.
+    """
+
+    def __init__(self, peer_urls, interval, ttl):
+        self.interval = interval
+        self.ttl = ttl
+        self._state = {peer_url: {
+            'online': False,
+            'latency_ms': None,
+            'last_seen': None,
+            'last_check': None,
+            'error': None
+        } for peer_url in peer_urls}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add_listener(self, callback):
+        """callback(peer_url, online) dipanggil setiap kali status peer berubah"""
+        self._listeners.append(callback)
+
+    @property
+    def peer_urls(self):
+        return list(self._state)
+
+    def probe(self, peer_url):
+        started = time.monotonic()
+        error = None
+        try:
+            response = peer_client.get(
+                f"{peer_url}/health",
+                timeout=(config.HTTP_CONNECT_TIMEOUT, config.HEALTH_CHECK_TIMEOUT)
+            )
+            online = response.status_code == 200
+            if not online:
+                error = f"HTTP {response.status_code}"
+        except Exception as e:
+            online = False
+            error = str(e)
+        
+        return self.record(peer_url, online, started, error)
+
+    def record(self, peer_url, online, started, error=None):
+        """Simpan hasil satu probe (started = time.monotonic() saat probe dimulai)"""
+        now = time.time()
+        with self._lock:
+            state = self._state[peer_url]
+            was_online = state['online']
+            state['online'] = online
+            state['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+            state['last_check'] = now
+            state['error'] = error
+            if online:
+                state['last_seen'] = now
+        
+        if online != was_online:
+            logger.info(f"Peer {peer_url} is now {'online' if online else 'offline'}")
+            for callback in self._listeners:
+                try:
+                    callback(peer_url, online)
+                except Exception as e:
+                    logger.error(f"Health listener failed for {peer_url}: {str(e)}")
+        return online
+
+    def _run(self):
+        while True:
+            for peer_url in self.peer_urls:
+                self.probe(peer_url)
+            time.sleep(self.interval)
+
+    def is_online(self, peer_url):
+        state = self._state.get(peer_url)
+        if state is None or state['last_check'] is None:
+            return False
+        return state['online'] and time.time() - state['last_check'] <= self.ttl
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {peer_url: {
+                'online': state['online'],
+                'stale': state['last_check'] is None or now - state['last_check'] > self.ttl,
+                'latency_ms': state['latency_ms'],
+                'last_seen': datetime.fromtimestamp(state['last_seen']).isoformat() if state['last_seen'] else None,
+                'last_check': datetime.fromtimestamp(state['last_check']).isoformat() if state['last_check'] else None,
+                'error': state['error']
+            } for peer_url, state in self._state.items()}
+
+health_tracker = HealthTracker(config.SLAVE_SERVERS + config.PEER_SERVERS,
+                               config.HEALTH_CHECK_INTERVAL, config.HEALTH_CACHE_TTL)
+
+# Database access layer: satu koneksi long-lived per thread
+_db_local = threading.local()
+
+def get_db():
+    """Koneksi SQLite milik thread ini (dibuat sekali lalu dipakai ulang).
+
+    WAL membuat reader tidak memblok writer, synchronous=NORMAL cukup aman
+    di WAL dengan fsync jauh lebih sedikit, dan busy_timeout membuat writer
+    yang bentrok menunggu alih-alih langsung 'database is locked'. Prepared
+    statement di-cache per koneksi oleh modul sqlite3 (cached_statements).
+    """
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(
+            config.DB_PATH,
+            timeout=config.DB_BUSY_TIMEOUT,
+            cached_statements=config.DB_STATEMENT_CACHE_SIZE
+        )
+        # Hanya berlaku untuk database baru (sebelum tabel pertama dibuat)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT * 1000)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        _db_local.conn = conn
+    return conn
+
+@app.before_request
+def count_request():
+    metrics.inc('chat_http_requests_total', endpoint=request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.teardown_request
+def rollback_unfinished_transaction(exc):
+    """Koneksi dipakai ulang oleh thread yang sama, jangan tinggalkan transaksi terbuka"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Schema migrations. Versi schema disimpan di PRAGMA user_version dan setiap
+# migration dijalankan tepat sekali, berurutan, dalam transaksinya sendiri.
+def _migration_001_initial_schema(cursor):
     # Tabel messages utama
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -61,314 +822,1580 @@ def init_db():
             FOREIGN KEY (message_id) REFERENCES messages (id)
         )
     ''')
+
+def _migration_002_replication_log(cursor):
+    # messages.id sekaligus sequence replication log; origin_url = slave asal pesan
+    cursor.execute('PRAGMA table_info(messages)')
+    if 'origin_url' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE messages ADD COLUMN origin_url TEXT')
     
-    conn.commit()
-    conn.close()
+    # High-water mark per slave: seq (messages.id) tertinggi yang sudah di-apply slave
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS replication_state (
+            slave_url TEXT PRIMARY KEY,
+            acked_seq INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME
+        )
+    ''')
+    
+    # Bookkeeping per pesan lama digantikan replication_state
+    cursor.execute('DROP TABLE IF EXISTS sync_status')
+    cursor.execute('DROP TABLE IF EXISTS offline_messages')
+
+def _migration_003_hot_query_indexes(cursor):
+    # ORDER BY timestamp dan filter ?since= (keyset by id sudah pakai rowid)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+
+def _migration_004_peer_ordering(cursor):
+    # uid = id global (dedup antar peer), (hlc, node_id) = urutan pesan
+    cursor.execute('PRAGMA table_info(messages)')
+    columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in (('uid', 'TEXT'), ('hlc', 'INTEGER'), ('node_id', 'TEXT')):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE messages ADD COLUMN {column} {column_type}')
+    
+    # Pesan lama: hlc = id (selalu di bawah HLC berbasis jam), ditulis di node ini.
+    # uid deterministik supaya sama dengan uid salinan pesan ini di slave.
+    cursor.execute('SELECT id, username, message, timestamp FROM messages WHERE uid IS NULL')
+    cursor.executemany('''
+        UPDATE messages SET uid = ?, hlc = id, node_id = ? WHERE id = ?
+    ''', [(legacy_uid(message_id, username, message, timestamp), config.NODE_ID, message_id)
+          for message_id, username, message, timestamp in cursor.fetchall()])
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_uid ON messages (uid)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_hlc ON messages (hlc, node_id)')
+
+def _migration_005_message_stats(cursor):
+    # Counter persist: di-update trigger di transaksi insert/delete yang sama,
+    # jadi /health tidak perlu COUNT(*) atas seluruh history
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO message_stats (name, value)
+        SELECT 'messages', COUNT(*) FROM messages
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_count_insert AFTER INSERT ON messages
+        BEGIN
+            UPDATE message_stats SET value = value + 1 WHERE name = 'messages';
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_count_delete AFTER DELETE ON messages
+        BEGIN
+            UPDATE message_stats SET value = value - 1 WHERE name = 'messages';
+        END
+    ''')
+
+def _migration_006_search_index(cursor):
+    # Index FTS5 external content (teks tetap hanya di messages). Trigger menjaga
+    # index di transaksi yang sama untuk semua jalur insert (lokal, replikasi,
+    # snapshot) dan delete (retention).
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            username, message,
+            content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, username, message) VALUES (new.id, new.username, new.message);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, username, message)
+            VALUES ('delete', old.id, old.username, old.message);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF username, message ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, username, message)
+            VALUES ('delete', old.id, old.username, old.message);
+            INSERT INTO messages_fts (rowid, username, message) VALUES (new.id, new.username, new.message);
+        END
+    ''')
+
+def _migration_007_rooms(cursor):
+    # Pesan lama masuk room default; (room, id) untuk pull/replikasi per room,
+    # (room, hlc, node_id) untuk halaman index per room
+    cursor.execute('PRAGMA table_info(messages)')
+    if 'room' not in {row[1] for row in cursor.fetchall()}:
+        # ALTER TABLE tidak menerima parameter; nama room sudah divalidasi normalize_room
+        default_room = normalize_room(config.DEFAULT_ROOM)
+        cursor.execute(f"ALTER TABLE messages ADD COLUMN room TEXT NOT NULL DEFAULT '{default_room}'")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages (room, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_room_hlc ON messages (room, hlc, node_id)')
+
+def _migration_008_replication_filter(cursor):
+    # Filter replikasi per slave (JSON, NULL = semua pesan); (username, id) untuk
+    # fan-out dan catch-up slave yang hanya menyimpan pesan user tertentu
+    cursor.execute('PRAGMA table_info(replication_state)')
+    if 'filter' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE replication_state ADD COLUMN filter TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_username_id ON messages (username, id)')
+
+MIGRATIONS = [
+    (1, 'initial schema', _migration_001_initial_schema),
+    (2, 'replication log', _migration_002_replication_log),
+    (3, 'hot query indexes', _migration_003_hot_query_indexes),
+    (4, 'peer ordering', _migration_004_peer_ordering),
+    (5, 'message stats', _migration_005_message_stats),
+    (6, 'search index', _migration_006_search_index),
+    (7, 'rooms', _migration_007_rooms),
+    (8, 'replication filter', _migration_008_replication_filter),
+]
+
+def migrate_db(conn):
+    """Jalankan migration yang belum diterapkan ke database ini"""
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    for version, name, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            conn.execute('BEGIN')
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied migration {version}: {name}")
+
+# Pesan tertua di-arsip per slice; pesan dengan id tertinggi tidak pernah ikut
+# dihapus supaya MAX(id) (= last_seq replication log) tidak mundur. Pesan di atas
+# acked_seq terendah slave/peer (parameter kedua, NULL = tanpa replikasi) juga
+# ditahan sampai semua replica menerimanya.
+ARCHIVABLE_MESSAGES_SQL = '''
+    SELECT * FROM messages
+    WHERE timestamp < datetime('now', ?) AND id < (SELECT MAX(id) FROM messages)
+      AND id <= coalesce(?, id)
+    ORDER BY timestamp LIMIT ?
+'''
 
-def get_messages():
-    conn = sqlite3.connect(config.DB_PATH)
+# Full-text search lewat messages_fts. bm25 (rank) dihitung hanya untuk window match
+# terbaru (doclist FTS5 urut rowid, jadi LIMIT berhenti lebih awal), lalu window itu
+# diurutkan relevansi. Tanpa window, kata umum berarti bm25 untuk ratusan ribu row.
+SEARCH_SQL = '''
+    SELECT messages.id, messages.uid, messages.room, messages.username, messages.message,
+           messages.timestamp, hits.rank
+    FROM (
+        SELECT rowid, rank FROM messages_fts
+        WHERE messages_fts MATCH ?
+        ORDER BY rowid DESC
+        LIMIT ?
+    ) AS hits
+    JOIN messages ON messages.id = hits.rowid
+    {username_filter}
+    ORDER BY hits.rank
+    LIMIT ? OFFSET ?
+'''
+
+# Hot query yang dijaga supaya tidak kembali menjadi full table scan:
+# (nama, sql, contoh parameter, index yang harus muncul di query plan)
+HOT_QUERIES = [
+    ('messages_since_id',
+     'SELECT id, username, message, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?',
+     (0, 1), 'INTEGER PRIMARY KEY'),
+    ('messages_since_timestamp',
+     'SELECT id, username, message, timestamp FROM messages WHERE timestamp > ? ORDER BY +id ASC LIMIT ?',
+     ('', 1), 'idx_messages_timestamp'),
+    ('messages_by_hlc',
+     'SELECT id, username, message, timestamp FROM messages ORDER BY hlc DESC, node_id DESC LIMIT ?',
+     (1,), 'idx_messages_hlc'),
+    ('messages_before_hlc',
+     'SELECT id, username, message, timestamp FROM messages '
+     'WHERE (hlc, node_id) < (SELECT hlc, node_id FROM messages WHERE id = ?) '
+     'ORDER BY hlc DESC, node_id DESC LIMIT ?',
+     (0, 1), 'idx_messages_hlc'),
+    ('replication_range',
+     'SELECT id, username, message, timestamp, origin_url, uid, hlc, node_id FROM messages '
+     'WHERE id > ? ORDER BY id ASC LIMIT ?',
+     (0, 1), 'INTEGER PRIMARY KEY'),
+    ('room_messages_since_id',
+     'SELECT id, username, message, timestamp, uid, room FROM messages '
+     'WHERE room IN (?) AND id > ? ORDER BY id ASC LIMIT ?',
+     ('general', 0, 1), 'idx_messages_room_id'),
+    ('room_messages_by_hlc',
+     'SELECT id, username, message, timestamp, uid, room FROM messages '
+     'WHERE room IN (?) ORDER BY hlc DESC, node_id DESC LIMIT ?',
+     ('general', 1), 'idx_messages_room_hlc'),
+    ('author_messages_since_id',
+     'SELECT id, username, message, timestamp, uid, room FROM messages '
+     'WHERE username IN (?) AND id > ? ORDER BY id ASC LIMIT ?',
+     ('', 0, 1), 'idx_messages_username_id'),
+    ('windowed_replication_range',
+     'SELECT id, username, message, timestamp, origin_url, uid, hlc, node_id, room FROM messages '
+     "WHERE +timestamp >= datetime('now', ?) AND id > ? AND id <= ? ORDER BY id ASC LIMIT ?",
+     ('-1 days', 0, 1, 1), 'INTEGER PRIMARY KEY'),
+    ('message_by_uid',
+     'SELECT id FROM messages WHERE uid = ?',
+     ('',), 'idx_messages_uid'),
+    ('max_hlc',
+     'SELECT MAX(hlc) FROM messages',
+     (), 'idx_messages_hlc'),
+    ('search_messages',
+     SEARCH_SQL.format(username_filter=''),
+     ('"halo"', 1, 1, 0), 'messages_fts VIRTUAL TABLE'),
+    ('archivable_messages',
+     ARCHIVABLE_MESSAGES_SQL,
+     ('-1 days', 0, 1), 'idx_messages_timestamp'),
+    ('replication_state_by_slave',
+     'SELECT acked_seq FROM replication_state WHERE slave_url = ?',
+     ('',), 'sqlite_autoindex_replication_state'),
+]
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN setiap hot query; return daftar query yang regress ke scan"""
+    regressions = []
+    for name, sql, params, expected_index in HOT_QUERIES:
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        # Scan atas subquery yang sudah di-materialize (hasil ber-LIMIT) bukan table scan
+        materialized = {step.split()[1] for step in plan if step.startswith('MATERIALIZE ')}
+        full_scan = any(step.startswith('SCAN ') and 'INDEX' not in step
+                        and step.split()[1] not in materialized for step in plan)
+        if full_scan or not any(expected_index in step for step in plan):
+            logger.warning(f"Query plan regression for {name}: {plan}")
+            regressions.append((name, plan))
+    return regressions
+
+# Database initialization
+def load_message_count(conn):
+    """Jumlah pesan dari message_stats (O(1), dijaga trigger migration message stats)"""
+    row = conn.execute("SELECT value FROM message_stats WHERE name = 'messages'").fetchone()
+    return row[0] if row else 0
+
+def init_db():
+    conn = get_db()
+    migrate_db(conn)
+    check_query_plans(conn)
+    
+    # HLC tidak boleh mundur walaupun jam server mundur saat restart
+    hlc.observe(conn.execute('SELECT MAX(hlc) FROM messages').fetchone()[0])
+    metrics.set_max('chat_last_seq', get_last_seq())
+    metrics.set('chat_messages_stored', load_message_count(conn))
+
+@timed_query('messages_page')
+def get_messages_page(since_id=None, before_id=None, since=None, limit=None, rooms=None, authors=None):
+    """Ambil satu halaman pesan dengan keyset pagination di atas id (rowid).
+
+    - since_id: pesan dengan id > since_id, urut naik (untuk incremental pull)
+    - before_id: pesan dengan id < before_id, urut turun (halaman lebih lama)
+    - since: filter timestamp > since (memakai idx_messages_timestamp)
+    - rooms: hanya pesan di room ini (idx_messages_room_id / idx_messages_room_hlc)
+    - authors: hanya pesan dari username ini (idx_messages_username_id)
+    Tanpa cursor, kembalikan halaman terbaru (urut turun).
+    
+    Halaman urut turun (index, "Load older") diurutkan (hlc, node_id), jadi pesan
+    peer yang datang terlambat tetap muncul di posisinya. Cursor tetap id:
+    before_id diterjemahkan ke posisi (hlc, node_id) pesan itu.
+    """
+    if limit is None:
+        limit = config.API_PAGE_SIZE
+    limit = max(1, min(limit, config.API_MAX_PAGE_SIZE))
+    
+    clauses, params = message_slice_sql(rooms, authors, since)
+    if since_id is not None:
+        clauses.append('id > ?')
+        params.append(since_id)
+    descending = since_id is None and not since
+    if before_id is not None:
+        if descending:
+            clauses.append('(hlc, node_id) < (SELECT hlc, node_id FROM messages WHERE id = ?)')
+        else:
+            clauses.append('id < ?')
+        params.append(before_id)
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    if descending:
+        order_by = 'hlc DESC, node_id DESC'
+    elif since and since_id is None and before_id is None and not rooms and not authors:
+        # Hanya ?since= tanpa cursor id: paksa pakai idx_messages_timestamp (+id mematikan
+        # index rowid untuk ORDER BY), kalau tidak planner memilih scan dari awal tabel
+        order_by = '+id ASC'
+    else:
+        order_by = 'id ASC'
+    
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT id, username, message, timestamp FROM messages ORDER BY timestamp DESC')
+    cursor.execute(f'''
+        SELECT id, username, message, timestamp, uid, room FROM messages
+        {where}
+        ORDER BY {order_by}
+        LIMIT ?
+    ''', params + [limit])
     messages = cursor.fetchall()
-    conn.close()
-    return messages
+    
+    # Cursor berikutnya hanya ada kalau halaman penuh
+    next_cursor = messages[-1][0] if len(messages) == limit else None
+    return messages, next_cursor
 
-def add_message(username, message):
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT INTO messages (username, message) VALUES (?, ?)', (username, message))
-    message_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+# Full-text search (FTS5)
+def fts_query(text):
+    """Ubah input user jadi query FTS5 yang aman.
+
+    Setiap kata di-quote (operator dan tanda baca FTS5 tidak diinterpretasi),
+    semua kata harus ada (AND), dan kata yang diakhiri '*' menjadi prefix search.
+    Return None kalau tidak ada kata sama sekali.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms) or None
+
+@timed_query('search')
+def search_messages(text, username=None, limit=None, offset=0):
+    """Cari pesan lewat messages_fts, urut relevansi (bm25). Return (hasil, next_offset).
+
+    Yang diurutkan hanya SEARCH_RANK_WINDOW match terbaru (diperbesar kalau
+    offset melewatinya), jadi latency tidak tumbuh dengan jumlah match.
+    """
+    match = fts_query(text)
+    if match is None:
+        raise ValueError('Query must contain at least one word')
+    if limit is None:
+        limit = config.SEARCH_PAGE_SIZE
+    limit = max(1, min(limit, config.API_MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    window = max(config.SEARCH_RANK_WINDOW, offset + limit)
     
-    # Queue pesan untuk sinkronisasi
-    message_data = {
-        'id': message_id,
+    username_filter = ''
+    params = []
+    if username:
+        # Filter kolom FTS memperkecil window ke pesan user itu; filter exact di luar
+        # membuang user lain yang kebetulan punya token yang sama. Username tanpa
+        # huruf/angka tidak punya token, jadi hanya filter exact.
+        if any(char.isalnum() for char in username):
+            phrase = username.replace('"', '""')
+            match = f'({match}) AND username : "{phrase}"'
+        username_filter = 'WHERE messages.username = ?'
+        params.append(username)
+    
+    cursor = get_db().execute(SEARCH_SQL.format(username_filter=username_filter),
+                              [match, window] + params + [limit, offset])
+    columns = [column[0] for column in cursor.description]
+    results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return results, (offset + limit if len(results) == limit else None)
+
+def search_data(text, username=None, limit=None, offset=0):
+    """Isi /api/search"""
+    results, next_offset = search_messages(text, username, limit, offset)
+    return {
+        'query': text,
         'username': username,
-        'message': message,
-        'timestamp': datetime.now().isoformat()
+        'results': results,
+        'next_offset': next_offset
     }
-    
-    # Sync ke slaves dengan queue system
-    threading.Thread(target=sync_to_slaves_with_queue, args=(message_data,)).start()
-    return message_id
 
-def sync_to_slaves_with_queue(message_data):
-    """Sync dengan retry mechanism dan offline queue"""
-    for slave_url in config.SLAVE_SERVERS:
-        success = attempt_sync_to_slave(slave_url, message_data)
-        
-        if not success:
-            # Simpan ke offline queue
-            save_offline_message(message_data['id'], slave_url, message_data)
-            logger.warning(f"Message {message_data['id']} queued for offline sync to {slave_url}")
-
-def attempt_sync_to_slave(slave_url, message_data, max_retries=3):
-    """Attempt to sync message to slave with retries"""
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
-    
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                f"{slave_url}/sync_message",
-                json={
-                    'username': message_data['username'],
-                    'message': message_data['message'],
-                    'master_id': message_data['id'],
-                    'timestamp': message_data['timestamp']
-                },
-                timeout=config.SYNC_TIMEOUT
-            )
+class GroupCommitWriter:
+    """Group commit untuk insert pesan dari request handler.
+
+    Handler tidak commit sendiri: submit() memasukkan insert ke queue dan
+    mengembalikan Future. Satu writer thread mengambil insert yang datang
+    dalam GROUP_COMMIT_WINDOW (maksimal GROUP_COMMIT_MAX_BATCH), menjalankan
+    semuanya dalam satu transaksi lalu commit sekali, jadi burst ratusan
+    post per detik hanya butuh beberapa commit. Id hasil insert dikembalikan
+    ke setiap Future setelah commit.
+    """
+
+    def __init__(self, write_row, after_commit):
+        self._write_row = write_row  # write_row(cursor, *args) -> message_data
+        self._after_commit = after_commit  # after_commit(list message_data), urut id
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._lock = threading.Lock()
+        self._counters = {'rows': 0, 'commits': 0, 'failed': 0, 'max_batch': 0}
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, *args):
+        """Antrikan satu insert. Future.result() = message_data setelah di-commit."""
+        if not self._thread.is_alive():
+            raise RuntimeError('GroupCommitWriter is not started')
+        future = Future()
+        self._queue.put((future, args))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + config.GROUP_COMMIT_WINDOW
+            while len(batch) < config.GROUP_COMMIT_MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except Empty:
+                    break
             
-            if response.status_code == 200:
-                # Update sync status sebagai success
-                cursor.execute('''
-                    INSERT OR REPLACE INTO sync_status 
-                    (message_id, slave_url, sync_status, attempts, last_attempt)
-                    VALUES (?, ?, 'success', ?, ?)
-                ''', (message_data['id'], slave_url, attempt + 1, datetime.now()))
+            if not self._commit(batch) and len(batch) > 1:
+                # Satu insert yang gagal tidak boleh menggagalkan insert lain di batch
+                for item in batch:
+                    self._commit([item])
+
+    def _commit(self, batch):
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            with metrics.timed('chat_db_query_seconds', query='group_commit'):
+                results = [self._write_row(cursor, *args) for _, args in batch]
                 conn.commit()
-                conn.close()
-                
-                logger.info(f"Successfully synced message {message_data['id']} to {slave_url}")
-                return True
-                
         except Exception as e:
-            logger.error(f"Attempt {attempt + 1} failed for {slave_url}: {str(e)}")
-            time.sleep(2 ** attempt)  # Exponential backoff
-    
-    # Semua attempt gagal
+            conn.rollback()
+            if len(batch) == 1:
+                self._count(failed=1)
+                batch[0][0].set_exception(e)
+            return False
+        
+        self._count(rows=len(batch), commits=1, max_batch=len(batch))
+        try:
+            self._after_commit(results)
+        except Exception as e:
+            logger.error(f"After-commit hook failed: {str(e)}")
+        for (future, _), result in zip(batch, results):
+            future.set_result(result)
+        return True
+
+    def _count(self, rows=0, commits=0, failed=0, max_batch=0):
+        with self._lock:
+            self._counters['rows'] += rows
+            self._counters['commits'] += commits
+            self._counters['failed'] += failed
+            self._counters['max_batch'] = max(self._counters['max_batch'], max_batch)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, queued=self._queue.qsize())
+        stats['rows_per_commit'] = round(stats['rows'] / stats['commits'], 2) if stats['commits'] else 0.0
+        return stats
+
+def write_local_message(cursor, username, message, room):
+    """Insert satu pesan lokal di dalam transaksi group commit"""
+    # uid/hlc dibuat di writer thread, jadi urutan hlc sama dengan urutan id
+    uid, message_hlc = stamp_message()
     cursor.execute('''
-        INSERT OR REPLACE INTO sync_status 
-        (message_id, slave_url, sync_status, attempts, last_attempt)
-        VALUES (?, ?, 'failed', ?, ?)
-    ''', (message_data['id'], slave_url, max_retries, datetime.now()))
-    conn.commit()
-    conn.close()
+        INSERT INTO messages (username, message, uid, hlc, node_id, room) VALUES (?, ?, ?, ?, ?, ?)
+        RETURNING id, timestamp
+    ''', (username, message, uid, message_hlc, config.NODE_ID, room))
+    message_id, timestamp = cursor.fetchone()
+    return {
+        'id': message_id,
+        'room': room,
+        'username': username,
+        'message': message,
+        'timestamp': timestamp
+    }
+
+def publish_local_messages(batch):
+    # Push ke browser yang sedang subscribe /api/stream
+    for message_data in batch:
+        message_hub.publish(message_data)
+    record_inserted('local', batch)
     
-    return False
+    # Replikasi ke slaves (dan peer) dari replication log, satu notify per batch
+    notify_slave_replicators()
+    notify_peer_replicators()
 
-def save_offline_message(message_id, slave_url, message_data):
-    """Simpan pesan ke offline queue"""
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO offline_messages (message_id, slave_url, message_data)
-        VALUES (?, ?, ?)
-    ''', (message_id, slave_url, json.dumps(message_data)))
-    conn.commit()
-    conn.close()
+message_writer = GroupCommitWriter(write_local_message, publish_local_messages)
 
-def process_offline_queue():
-    """Background process untuk mengirim pesan offline"""
-    while True:
-        try:
-            conn = sqlite3.connect(config.DB_PATH)
-            cursor = conn.cursor()
-            
-            # Ambil pesan offline yang belum terkirim
-            cursor.execute('''
-                SELECT id, message_id, slave_url, message_data 
-                FROM offline_messages 
-                ORDER BY created_at ASC
-            ''')
-            offline_messages = cursor.fetchall()
-            
-            for offline_id, message_id, slave_url, message_data_json in offline_messages:
-                message_data = json.loads(message_data_json)
-                
-                # Coba kirim lagi
-                if attempt_sync_to_slave(slave_url, message_data, max_retries=1):
-                    # Berhasil, hapus dari offline queue
-                    cursor.execute('DELETE FROM offline_messages WHERE id = ?', (offline_id,))
-                    conn.commit()
-                    logger.info(f"Offline message {message_id} successfully synced to {slave_url}")
-            
-            conn.close()
+def add_message(username, message, room=None):
+    return message_writer.submit(username, message, normalize_room(room)).result()['id']
+
+def notify_slave_replicators():
+    """Bangunkan pengirim replikasi setiap slave setelah ada pesan baru"""
+    for replicator in slave_replicators.values():
+        replicator.notify()
+
+def notify_peer_replicators():
+    for replicator in peer_replicators.values():
+        replicator.notify()
+
+class StaleLeader(Exception):
+    """Batch dari leader term lama (dijawab 409 + state cluster)"""
+
+class ClusterRole:
+    """Peran master di failover antar slave (config.FAILOVER_ENABLED di slave).
+
+    Term 0 = master ini leader. Kalau slave memilih leader baru selama master
+    mati, master yang hidup lagi melihat term lebih tinggi (pengumuman leader
+    atau 409 dari slave) lalu turun menjadi follower: replikasi ke slave
+    berhenti dan write lokal diteruskan ke leader lewat LeaderForwarder.
+    Hanya di memori; setelah restart master mulai lagi dari term 0 dan turun
+    kembali saat bertemu slave pertama.
+    """
+
+    def __init__(self):
+        self.term = 0
+        self.leader_url = None  # None = master ini
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(term, leader_url) dipanggil saat master turun/pindah leader"""
+        self._listeners.append(callback)
+
+    @property
+    def is_leader(self):
+        return self.leader_url is None
+
+    def observe(self, term, leader_url):
+        """Term/leader dari slave. False kalau term-nya lebih lama dari yang sudah dilihat."""
+        with self._lock:
+            if term < self.term:
+                return False
+            changed = term > self.term and bool(leader_url) and leader_url != self.leader_url
+            if term > self.term:
+                self.term = term
+                self.leader_url = leader_url or self.leader_url
+        if changed:
+            logger.warning(f"Term {term}: stepping down, leader is now {leader_url}")
+            for callback in self._listeners:
+                callback(term, leader_url)
+        return True
+
+    def snapshot(self):
+        return {
+            'term': self.term,
+            'leader': self.leader_url,
+            'role': 'leader' if self.is_leader else 'follower'
+        }
+
+cluster = ClusterRole()
+
+def observe_cluster(response):
+    """Slave menolak batch (409) karena ada leader term baru: ikuti. True kalau ditolak."""
+    if response.status_code != 409:
+        return False
+    data = response.json()
+    cluster.observe(data.get('term', 0), data.get('leader'))
+    return True
+
+class SlaveReplicator:
+    """Replikasi ke satu slave berbasis replication log.
+
+    Sequence replikasi adalah messages.id di master (monoton naik). Untuk
+    setiap slave disimpan acked_seq di replication_state, yaitu seq tertinggi
+    yang sudah di-apply slave. Pengirim membaca messages WHERE id > acked_seq
+    per batch, jadi catch-up setelah slave offline cukup satu range scan dan
+    tidak ada salinan pesan per slave.
+    """
+    ENDPOINT = '/sync_messages'
+
+    def __init__(self, slave_url):
+        self.slave_url = slave_url
+        self.acked_seq = 0
+        self.last_ack_at = None
+        self.filter = None  # Filter replikasi yang didaftarkan slave; None = semua pesan
+        self.wire_format = wire_formats()[0]
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.load_state()
+        self._thread.start()
+
+    def load_state(self):
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT acked_seq, filter FROM replication_state WHERE slave_url = ?
+        ''', (self.slave_url,))
+        result = cursor.fetchone()
+        
+        self.acked_seq = result[0] if result else self.initial_seq()
+        self.filter = json.loads(result[1]) if result and result[1] else None
+
+    def initial_seq(self):
+        return 0
+
+    def is_active(self):
+        # Setelah failover leader baru yang mereplikasi ke slave
+        return cluster.is_leader
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        failures = 0
+        while True:
+            if failures:
+                # Backoff; health_tracker membangunkan lebih cepat saat slave online lagi
+                self._wakeup.wait(min(2 ** failures, config.REPLICATION_MAX_BACKOFF))
+            elif self._wakeup.wait(config.SYNC_INTERVAL):
+                # Tunggu sebentar supaya pesan yang datang berdekatan masuk satu batch
+                time.sleep(config.REPLICATION_BATCH_WINDOW)
+            self._wakeup.clear()
             
-        except Exception as e:
-            logger.error(f"Error processing offline queue: {str(e)}")
+            try:
+                while self._replicate_batch():
+                    pass
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error(f"Replication to {self.slave_url} failed at seq {self.acked_seq}: {str(e)}")
+                metrics.inc('chat_replication_failures_total', peer=self.slave_url)
+                get_db().rollback()
+
+    def _replicate_batch(self):
+        """Kirim satu batch setelah acked_seq. Return True kalau masih ada sisa."""
+        if not self.is_active():
+            return False
+        batch = self.next_batch()
+        if batch is None:
+            return False
+        messages, seq_end, has_more = batch
         
-        time.sleep(30)  # Check setiap 30 detik
+        acked_seq = seq_end
+        if messages:
+            body, headers = self.encode_batch(messages, seq_end)
+            response = peer_client.post(f"{self.slave_url}{self.ENDPOINT}", data=body, headers=headers)
+            if self.downgrade_wire_format(response):
+                return True  # Kirim ulang batch yang sama dengan format berikutnya
+            if observe_cluster(response):
+                return False
+            response.raise_for_status()
+            acked_seq = response.json().get('acked_seq', seq_end)
+            logger.info(f"Successfully synced {len(messages)} messages to {self.slave_url} (seq {seq_end})")
+            metrics.inc('chat_replicated_messages_total', len(messages), peer=self.slave_url)
+        
+        self.ack(acked_seq)
+        return has_more
+
+    def encode_batch(self, messages, seq_end):
+        """Body + headers POST /sync_messages dalam format wire slave ini"""
+        # JSON biasa = format lama, dikirim tanpa gzip supaya tetap bisa dibaca
+        body, content_encoding = encode_wire_body({'messages': messages, 'seq_end': seq_end},
+                                                  self.wire_format, self.wire_format != WIRE_JSON)
+        headers = {'Content-Type': self.wire_format}
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        return body, headers
+
+    def downgrade_wire_format(self, response):
+        """Slave menolak format wire (415): pakai format berikutnya. True kalau perlu kirim ulang."""
+        formats = wire_formats()
+        if response.status_code != 415 or self.wire_format == formats[-1]:
+            return False
+        
+        previous = self.wire_format
+        self.wire_format = formats[formats.index(previous) + 1]
+        logger.warning(f"{self.slave_url} rejected {previous}, falling back to {self.wire_format}")
+        return True
 
-def check_slave_health_enhanced():
-    """Enhanced health check yang juga trigger offline sync"""
-    while True:
-        conn = sqlite3.connect(config.DB_PATH)
+    @timed_query('replication_batch')
+    def next_batch(self):
+        """Baca batch berikutnya setelah acked_seq: (messages, seq_end, has_more) atau None"""
+        if self.filter is not None:
+            return self.next_filtered_batch(self.filter)
+        conn = get_db()
         cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, username, message, timestamp, origin_url, uid, hlc, node_id, room FROM messages
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+        ''', (self.acked_seq, config.REPLICATION_BATCH_SIZE))
+        rows = cursor.fetchall()
+        
+        if not rows:
+            return None
+        seq_end = rows[-1][0]
+        
+        messages = [self.to_wire(row) for row in rows if self.should_send(row)]
+        return messages, seq_end, len(rows) == config.REPLICATION_BATCH_SIZE
+
+    def next_filtered_batch(self, replication_filter):
+        """next_batch untuk slave dengan filter replikasi (replikasi selektif).
+
+        Filter dijalankan di master: range dibaca lewat idx_messages_room_id atau
+        idx_messages_username_id, jadi pesan di luar slice slave tidak di-scan dan
+        tidak dikirim. High water dibaca duluan: kalau batch tidak penuh, seq_end =
+        high water (pesan yang commit sesudahnya punya id lebih besar).
+        """
+        conn = get_db()
+        high_water = conn.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0
+        if high_water <= self.acked_seq:
+            return None
+        clauses, params = replication_filter_sql(replication_filter)
+        rows = conn.execute(f'''
+            SELECT id, username, message, timestamp, origin_url, uid, hlc, node_id, room FROM messages
+            WHERE {' AND '.join(clauses)} AND id > ? AND id <= ?
+            ORDER BY id ASC
+            LIMIT ?
+        ''', (*params, self.acked_seq, high_water, config.REPLICATION_BATCH_SIZE)).fetchall()
+        
+        has_more = len(rows) == config.REPLICATION_BATCH_SIZE
+        seq_end = rows[-1][0] if has_more else high_water
+        return [self.to_wire(row) for row in rows if self.should_send(row)], seq_end, has_more
+
+    def should_send(self, row):
+        # Pesan yang berasal dari slave ini tidak perlu dikirim balik
+        return row[4] != self.slave_url
+
+    def to_wire(self, row):
+        message_id, username, message, timestamp, origin_url, uid = row[:6]
+        return {
+            'uid': uid,
+            'room': row[8],
+            'username': username,
+            'message': message,
+            'master_id': message_id,
+            'timestamp': timestamp
+        }
+
+    def set_filter(self, replication_filter):
+        """Simpan filter dari POST /replication/filter; berlaku mulai batch berikutnya"""
+        conn = get_db()
+        conn.execute('''
+            INSERT INTO replication_state (slave_url, acked_seq, updated_at, filter)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(slave_url) DO UPDATE SET filter = excluded.filter
+        ''', (self.slave_url, self.acked_seq, datetime.now(),
+              json.dumps(replication_filter) if replication_filter else None))
+        conn.commit()
+        
+        self.filter = replication_filter
+        logger.info(f"Replication filter for {self.slave_url}: {replication_filter or 'all messages'}")
+
+    @timed_query('replication_ack')
+    def ack(self, acked_seq):
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO replication_state (slave_url, acked_seq, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(slave_url) DO UPDATE SET
+                acked_seq = excluded.acked_seq,
+                updated_at = excluded.updated_at
+        ''', (self.slave_url, acked_seq, datetime.now()))
+        conn.commit()
         
-        for slave_url in config.SLAVE_SERVERS:
+        self.acked_seq = acked_seq
+        self.last_ack_at = datetime.now()
+
+class PeerReplicator(SlaveReplicator):
+    """Replikasi ke peer lain di mode peer (PEER_SERVERS).
+
+    Setiap peer menerima write sendiri dan mengirimnya langsung ke semua peer
+    (full mesh), jadi yang dikirim hanya pesan dengan node_id node ini; pesan
+    dari peer lain sudah dikirim oleh peer asalnya. Posisi di replication log
+    tetap acked_seq per peer di replication_state.
+    """
+    ENDPOINT = '/peer/sync_messages'
+
+    def is_active(self):
+        return True
+
+    def should_send(self, row):
+        return row[7] == config.NODE_ID
+
+    def to_wire(self, row):
+        message_id, username, message, timestamp, origin_url, uid, message_hlc, node_id, room = row
+        return {
+            'uid': uid,
+            'room': room,
+            'hlc': message_hlc,
+            'node_id': node_id,
+            'username': username,
+            'message': message,
+            'timestamp': timestamp
+        }
+
+class LeaderForwarder(PeerReplicator):
+    """Setelah master turun: teruskan write lokal master ke leader hasil failover.
+
+    Yang dikirim pesan dengan node_id master (write lokal dan dari slave yang
+    masih mengirim ke master) setelah master_id tertinggi yang sudah dimiliki
+    leader. Pesan dari leader sendiri masuk dengan node_id kosong, jadi tidak
+    dikirim balik.
+    """
+
+    def start(self):
+        # load_state butuh leader; dilakukan di thread sendiri sampai leader bisa dihubungi
+        self._thread.start()
+
+    def _run(self):
+        failures = 0
+        while True:
             try:
-                response = requests.get(f"{slave_url}/health", timeout=5)
-                if response.status_code == 200:
-                    logger.info(f"Slave {slave_url} is healthy")
-                    
-                    # Slave online, coba kirim pesan offline
-                    cursor.execute('''
-                        SELECT COUNT(*) FROM offline_messages WHERE slave_url = ?
-                    ''', (slave_url,))
-                    offline_count = cursor.fetchone()[0]
-                    
-                    if offline_count > 0:
-                        logger.info(f"Found {offline_count} offline messages for {slave_url}, processing...")
-                        threading.Thread(target=sync_offline_messages_for_slave, args=(slave_url,)).start()
-                        
-                else:
-                    logger.warning(f"Slave {slave_url} returned status {response.status_code}")
-                    
+                self.load_state()
+                break
             except Exception as e:
-                logger.error(f"Slave {slave_url} is unreachable: {str(e)}")
-        
-        conn.close()
-        time.sleep(config.HEALTH_CHECK_INTERVAL)
+                failures += 1
+                logger.error(f"Cannot reach leader {self.slave_url}: {str(e)}")
+                time.sleep(min(2 ** failures, config.REPLICATION_MAX_BACKOFF))
+        super()._run()
+
+    def is_active(self):
+        return cluster.leader_url == self.slave_url
+
+    def initial_seq(self):
+        response = peer_client.get(f"{self.slave_url}/cluster/state")
+        response.raise_for_status()
+        return response.json()['master_high_water']
+
+    def to_wire(self, row):
+        return dict(super().to_wire(row), master_id=row[0])
+
+slave_replicators = {slave_url: SlaveReplicator(slave_url) for slave_url in config.SLAVE_SERVERS}
+peer_replicators = {peer_url: PeerReplicator(peer_url) for peer_url in config.PEER_SERVERS}
+
+def replication_lag():
+    """Antrian per slave/peer: pesan di replication log yang belum di-ack (dari memori)"""
+    last_seq = metrics.value('chat_last_seq')
+    replicators = dict(slave_replicators, **peer_replicators)
+    return {url: max(0, last_seq - (replicator.acked_seq or 0)) for url, replicator in replicators.items()}
+
+metrics.gauge_callback('chat_replication_lag_messages', 'Pesan yang belum di-ack per slave/peer',
+                       replication_lag, label='peer')
+metrics.gauge_callback('chat_group_commit_queue', 'Insert yang menunggu group commit',
+                       lambda: message_writer.stats()['queued'])
+metrics.gauge_callback('chat_stream_seq', 'Seq terakhir MessageHub (/api/stream)',
+                       lambda: message_hub.last_seq)
+
+def start_leader_forwarder(term, leader_url):
+    """Listener cluster: master turun, write lokal mulai diteruskan ke leader baru"""
+    if leader_url not in peer_replicators:
+        forwarder = LeaderForwarder(leader_url)
+        peer_replicators[leader_url] = forwarder
+        forwarder.start()
+
+def on_slave_health_change(peer_url, online):
+    """Slave/peer kembali online, langsung lanjutkan replikasi dari acked_seq"""
+    if online:
+        replicator = slave_replicators.get(peer_url) or peer_replicators.get(peer_url)
+        replicator.notify()
+
+def idempotency_key(headers, data):
+    """uid pesan dari header Idempotency-Key atau body; slave lama tidak mengirim keduanya"""
+    # Header lowercase supaya sama untuk Flask (case-insensitive) dan dict header ASGI
+    key = headers.get('idempotency-key') or data.get('uid')
+    if key and len(key) <= 64:
+        return key
+    return None
+
+def find_sender_slave(remote_addr):
+    """Cocokkan IP pengirim dengan config.SLAVE_SERVERS (naive, berdasarkan host)"""
+    for slave_url in config.SLAVE_SERVERS:
+        if urlsplit(slave_url).hostname == remote_addr:
+            return slave_url
+    return None
+
+def register_replication_filter(data, remote_addr):
+    """Isi POST /replication/filter. LookupError kalau slave tidak ada di SLAVE_SERVERS."""
+    # slave_url (NODE_URL slave) lebih tepat daripada IP kalau beberapa slave satu host
+    slave_url = data.get('slave_url')
+    if slave_url not in slave_replicators:
+        slave_url = find_sender_slave(remote_addr)
+    if slave_url is None:
+        raise LookupError('Sender is not a configured slave')
+    
+    replication_filter = parse_replication_filter(data)
+    slave_replicators[slave_url].set_filter(replication_filter)
+    return {'status': 'success', 'slave_url': slave_url, 'filter': replication_filter}
+
+@timed_query('ingest_slave')
+def ingest_slave_message(username, message, origin_url, uid=None, room=None):
+    """Simpan pesan yang dikirim slave lalu replikasikan ke slave lain.
 
-def sync_offline_messages_for_slave(slave_url):
-    """Sync semua pesan offline untuk slave tertentu"""
-    conn = sqlite3.connect(config.DB_PATH)
+    uid dari slave adalah idempotency key: retry setelah timeout (POST pertama
+    ternyata sudah masuk) tidak menambah baris dan tidak di-fan-out lagi, cukup
+    dijawab dengan master_id yang sama. Return (master_id, duplicate).
+    """
+    conn = get_db()
     cursor = conn.cursor()
+    # Replay biasa dijawab dari idx_messages_uid tanpa write (dan tanpa memakan id)
+    if uid:
+        cursor.execute('SELECT id FROM messages WHERE uid = ?', (uid,))
+        existing = cursor.fetchone()
+        if existing:
+            logger.info(f"Replayed message {uid} from slave, already stored as {existing[0]}")
+            return existing[0], True
     
+    room = normalize_room(room)
+    stamped_uid, message_hlc = stamp_message()
     cursor.execute('''
-        SELECT id, message_id, message_data 
-        FROM offline_messages 
-        WHERE slave_url = ?
-        ORDER BY created_at ASC
-    ''', (slave_url,))
+        INSERT INTO messages (username, message, sync_status, origin_url, uid, hlc, node_id, room)
+        VALUES (?, ?, 'synced', ?, ?, ?, ?, ?)
+        ON CONFLICT(uid) DO NOTHING
+        RETURNING id, timestamp
+    ''', (username, message, origin_url, uid or stamped_uid, message_hlc, config.NODE_ID, room))
+    row = cursor.fetchone()
+    if row is None:
+        # Retry yang sama masuk bersamaan dan menang duluan
+        conn.commit()
+        cursor.execute('SELECT id FROM messages WHERE uid = ?', (uid,))
+        return cursor.fetchone()[0], True
+    master_id, timestamp = row
+    conn.commit()
     
-    offline_messages = cursor.fetchall()
+    message_data = {
+        'id': master_id,
+        'room': room,
+        'username': username,
+        'message': message,
+        'timestamp': timestamp
+    }
+    message_hub.publish(message_data)
+    record_inserted('slave', [message_data])
     
-    for offline_id, message_id, message_data_json in offline_messages:
-        message_data = json.loads(message_data_json)
-        
-        if attempt_sync_to_slave(slave_url, message_data, max_retries=1):
-            cursor.execute('DELETE FROM offline_messages WHERE id = ?', (offline_id,))
-            conn.commit()
-            logger.info(f"Synced offline message {message_id} to {slave_url}")
+    # Sync ke slaves lain (slave pengirim di-skip lewat origin_url) dan ke peer
+    notify_slave_replicators()
+    notify_peer_replicators()
+    return master_id, False
+
+@timed_query('peer_batch')
+def receive_peer_batch(data):
+    """Simpan batch dari peer dalam satu transaksi, dedup lewat uid. Return body response."""
+    messages = data['messages']
+    if messages:
+        # Pesan lokal berikutnya harus diurutkan sesudah pesan peer yang sudah terlihat
+        hlc.observe(max(msg.get('hlc') or 0 for msg in messages))
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    inserted = []
+    for msg in messages:
+        room = msg.get('room') or config.DEFAULT_ROOM
+        cursor.execute('''
+            INSERT INTO messages (username, message, timestamp, sync_status, uid, hlc, node_id, room)
+            VALUES (?, ?, ?, 'synced', ?, ?, ?, ?)
+            ON CONFLICT(uid) DO NOTHING
+            RETURNING id
+        ''', (msg['username'], msg['message'], msg['timestamp'], msg['uid'],
+              msg.get('hlc') or hlc.now(), msg.get('node_id', ''), room))
+        row = cursor.fetchone()
+        if row is not None:
+            inserted.append({
+                'id': row[0],
+                'room': room,
+                'username': msg['username'],
+                'message': msg['message'],
+                'timestamp': msg['timestamp']
+            })
+    conn.commit()
+    
+    for message_data in inserted:
+        message_hub.publish(message_data)
+    record_inserted('peer', inserted)
+    
+    # Pesan peer diteruskan ke slave node ini (tidak ke peer lain, full mesh)
+    if inserted:
+        logger.info(f"Received {len(inserted)} messages from peer")
+        notify_slave_replicators()
+    
+    return {
+        'status': 'success',
+        'received': len(messages),
+        'inserted': len(inserted),
+        'acked_seq': data.get('seq_end')
+    }
+
+def receive_leader_batch(data):
+    """Batch dari slave yang terpilih sebagai leader (failover). Return body response."""
+    if not cluster.observe(data.get('term', 0), data.get('leader')):
+        raise StaleLeader()
+    
+    # Pesan yang punya master_id berasal dari master ini dan sudah ada
+    received = len(data['messages'])
+    data['messages'] = [msg for msg in data['messages'] if msg.get('master_id') is None]
+    return dict(receive_peer_batch(data), received=received)
+
+def cluster_state_data():
+    # master_high_water: LeaderForwarder leader baru mulai dari seq setelah ini
+    return dict(cluster.snapshot(), master_high_water=get_last_seq())
+
+def messages_to_dicts(messages):
+    return [{
+        'id': msg[0],
+        'username': msg[1],
+        'message': msg[2],
+        'timestamp': msg[3],
+        'uid': msg[4],
+        'room': msg[5]
+    } for msg in messages]
+
+def encode_messages_page(since_id, before_id, since, limit, content_type, allow_gzip, rooms=None, authors=None):
+    """Satu halaman /api/messages yang sudah di-encode: (body, content_encoding, next_cursor)"""
+    messages, next_cursor = get_messages_page(since_id, before_id, since, limit, rooms, authors)
+    body, content_encoding = encode_wire_body(messages_to_dicts(messages), content_type, allow_gzip)
+    return body, content_encoding, next_cursor
+
+def render_index(room, before_id=None):
+    """HTML index untuk satu window pesan di satu room: terbaru, atau yang lebih lama dari ?before="""
+    def render():
+        messages, older_cursor = get_messages_page(before_id=before_id, limit=config.INDEX_PAGE_SIZE,
+                                                   rooms=[room])
+        with app.app_context():
+            return render_template('index.html', messages=messages, server_type='Master', room=room,
+                                   older_cursor=older_cursor, before_id=before_id)
+    
+    return render_cache.get_or_render((room, before_id), render)
+
+def get_last_seq(rooms=None, authors=None, since=None):
+    """messages.id tertinggi, atau tertinggi di slice ?rooms=/?authors=/?since= kalau diberikan"""
+    clauses, params = message_slice_sql(rooms, authors, since)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    cursor = get_db().cursor()
+    cursor.execute(f'SELECT MAX(id) FROM messages {where}', params)
+    return cursor.fetchone()[0] or 0
+
+@timed_query('snapshot')
+def create_snapshot(rooms=None, authors=None, since=None):
+    """Snapshot konsisten database lewat SQLite online backup API.
+
+    Return (path, seq, size). seq dibaca dari snapshot itu sendiri, jadi slave
+    yang memuat snapshot tepat berada di messages.id <= seq dan bisa lanjut
+    replikasi incremental dari sana. Dengan slice (parameter sama dengan
+    /api/messages) snapshot hanya berisi tabel messages untuk slice itu; seq
+    tetap posisi seluruh replication log.
+    """
+    fd, path = tempfile.mkstemp(prefix='snapshot-', suffix='.db',
+                                dir=os.path.dirname(os.path.abspath(config.DB_PATH)))
+    os.close(fd)
+    
+    try:
+        if rooms or authors or since:
+            seq = copy_message_slice(path, rooms, authors, since)
         else:
-            break  # Jika gagal, stop untuk mencegah spam
+            seq = backup_database(path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, seq, os.path.getsize(path)
+
+def backup_database(path):
+    """Salin seluruh database ke path; return seq snapshot"""
+    target = sqlite3.connect(path)
+    try:
+        get_db().backup(target)
+        seq = target.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0
+        # Snapshot dibaca sebagai satu file, tanpa -wal/-shm
+        target.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        target.close()
+    return seq
+
+def copy_message_slice(path, rooms, authors, since):
+    """Salin pesan satu slice ke database baru di path; return seq snapshot.
+
+    Pesan dengan id <= seq tidak berubah lagi, jadi salinan konsisten walaupun
+    ada write baru selama CREATE TABLE ... AS SELECT berjalan.
+    """
+    clauses, params = message_slice_sql(rooms, authors, since)
+    conn = get_db()
+    seq = get_last_seq()
+    conn.execute('ATTACH DATABASE ? AS snapshot', (path,))
+    try:
+        conn.execute(f'''
+            CREATE TABLE snapshot.messages AS
+            SELECT * FROM main.messages WHERE id <= ? AND {' AND '.join(clauses)}
+        ''', [seq] + params)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('DETACH DATABASE snapshot')
+    return seq
+
+def read_snapshot_chunks(path):
+    """Baca file snapshot per chunk (file dihapus pemanggil lewat remove_snapshot)"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(config.SNAPSHOT_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def remove_snapshot(path):
+    """Hapus file snapshot sementara; dipanggil saat response ditutup, juga kalau
+    body tidak pernah dibaca (client putus sebelum body, HEAD)"""
+    if os.path.exists(path):
+        os.remove(path)
+
+# Retention dan maintenance database
+def write_archive(rows):
+    """Append pesan ke arsip per bulan: ARCHIVE_DIR/messages-YYYY-MM.jsonl.gz.
+
+    Setiap slice ditulis sebagai satu member gzip baru (file gzip multi-member
+    tetap bisa dibaca gzip.open biasa) dan di-fsync sebelum row dihapus dari
+    database. Kalau proses mati di antaranya, slice itu ter-arsip dua kali;
+    baris arsip membawa uid jadi pembaca bisa dedup.
+    """
+    os.makedirs(config.ARCHIVE_DIR, exist_ok=True)
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(str(row['timestamp'])[:7], []).append(row)
     
-    conn.close()
+    for month, partition in partitions.items():
+        lines = ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in partition)
+        path = os.path.join(config.ARCHIVE_DIR, f'messages-{month}.jsonl.gz')
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(lines.encode('utf-8'), compresslevel=config.ARCHIVE_GZIP_LEVEL))
+            f.flush()
+            os.fsync(f.fileno())
 
-# API endpoint untuk mendapatkan sync status
-@app.route('/api/sync_status')
-def get_sync_status():
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
+def replication_low_water(conn):
+    """acked_seq terendah slave/peer yang dikonfigurasi (belum pernah ack = 0), None kalau tidak ada"""
+    urls = list(slave_replicators) + list(peer_replicators)
+    if not urls:
+        return None
+    placeholders = ', '.join('?' * len(urls))
+    acked = dict(conn.execute(f'''
+        SELECT slave_url, acked_seq FROM replication_state WHERE slave_url IN ({placeholders})
+    ''', urls).fetchall())
+    return min(acked.get(url, 0) for url in urls)
+
+@timed_query('archive_slice')
+def archive_messages_slice(limit):
+    """Arsipkan lalu hapus maksimal limit pesan yang lebih tua dari MESSAGE_RETENTION_DAYS
+    dan sudah di-ack semua slave/peer"""
+    conn = get_db()
+    # timestamp pesan = CURRENT_TIMESTAMP (UTC), jadi cutoff juga dihitung oleh SQLite
+    cursor = conn.execute(ARCHIVABLE_MESSAGES_SQL,
+                          (f'-{config.MESSAGE_RETENTION_DAYS} days', replication_low_water(conn), limit))
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    if not rows:
+        return 0
     
-    # Hitung pesan yang belum tersinkronisasi
-    cursor.execute('''
-        SELECT slave_url, COUNT(*) as pending_count
-        FROM offline_messages
-        GROUP BY slave_url
-    ''')
-    offline_stats = dict(cursor.fetchall())
+    write_archive(rows)
+    try:
+        conn.executemany('DELETE FROM messages WHERE id = ?', [(row['id'],) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     
-    # Status slave terakhir
-    cursor.execute('''
-        SELECT slave_url, sync_status, COUNT(*) as count
-        FROM sync_status
-        WHERE last_attempt > datetime('now', '-1 hour')
-        GROUP BY slave_url, sync_status
-    ''')
-    sync_stats = cursor.fetchall()
+    metrics.inc('chat_archived_messages_total', len(rows))
+    metrics.inc('chat_messages_stored', -len(rows))
+    render_cache.bump()
+    return len(rows)
+
+@timed_query('prune_slice')
+def prune_bookkeeping_slice(limit):
+    """Hapus replication_state milik slave/peer yang sudah tidak dikonfigurasi dan lama tidak ack"""
+    active = set(config.SLAVE_SERVERS) | set(config.PEER_SERVERS) | set(slave_replicators) | set(peer_replicators)
+    cutoff = datetime.now() - timedelta(days=config.SYNC_LOG_RETENTION_DAYS)
+    placeholders = ', '.join('?' * len(active))
+    conn = get_db()
+    cursor = conn.execute(f'''
+        DELETE FROM replication_state WHERE slave_url IN (
+            SELECT slave_url FROM replication_state
+            WHERE slave_url NOT IN ({placeholders}) AND updated_at < ?
+            LIMIT ?
+        )
+    ''', (*active, cutoff, limit))
+    conn.commit()
     
-    conn.close()
+    if cursor.rowcount:
+        metrics.inc('chat_pruned_rows_total', cursor.rowcount, table='replication_state')
+    return cursor.rowcount
+
+def incremental_vacuum_slice(pages):
+    """Kembalikan maksimal pages page kosong ke filesystem. Return jumlah page yang dilepas."""
+    conn = get_db()
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if not free_pages:
+        return 0
+    # executescript: incremental_vacuum hanya melepas satu page per step kalau lewat execute()
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    released = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    metrics.inc('chat_vacuumed_pages_total', released)
+    return released
+
+@timed_query('analyze')
+def analyze_db():
+    # analysis_limit membatasi jumlah row yang dibaca per index, jadi ANALYZE tetap
+    # murah berapapun ukuran tabel
+    get_db().executescript(f'PRAGMA analysis_limit={config.MAINTENANCE_ANALYSIS_LIMIT}; ANALYZE;')
+
+class MaintenanceWorker:
+    """Background thread: arsip pesan lama, prune bookkeeping sync, incremental VACUUM dan ANALYZE.
+
+    Setiap pass dipotong per slice kecil (MAINTENANCE_BATCH_SIZE row atau
+    MAINTENANCE_VACUUM_PAGES page per transaksi) dengan jeda di antaranya,
+    jadi write lock hanya dipegang sebentar dan group commit writer tetap
+    mendapat giliran.
+    """
+
+    def __init__(self, interval, batch_size, vacuum_pages, slice_pause):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.slice_pause = slice_pause
+        self.incremental_vacuum = False
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.totals = {'archived': 0, 'pruned': 0, 'vacuumed_pages': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        # auto_vacuum hanya bisa diset sebelum tabel pertama dibuat (lihat get_db);
+        # database lama tetap jalan, page kosong dipakai ulang tapi tidak dilepas
+        self.incremental_vacuum = get_db().execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        if not self.incremental_vacuum:
+            logger.info("auto_vacuum is not INCREMENTAL; run VACUUM once offline to enable it")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Maintenance pass failed: {e}")
+            time.sleep(self.interval)
+
+    def _drain(self, step, size):
+        """Jalankan step(size) sampai tidak ada yang tersisa, dengan jeda antar slice"""
+        total = 0
+        while True:
+            done = step(size)
+            total += done
+            if done < size:
+                return total
+            time.sleep(self.slice_pause)
+
+    def run_once(self):
+        started = time.monotonic()
+        archived = 0
+        if config.MESSAGE_RETENTION_DAYS is not None:
+            archived = self._drain(archive_messages_slice, self.batch_size)
+        pruned = self._drain(prune_bookkeeping_slice, self.batch_size)
+        vacuumed = self._drain(incremental_vacuum_slice, self.vacuum_pages) if self.incremental_vacuum else 0
+        if archived or pruned or self.last_run is None:
+            analyze_db()
+        
+        self.totals['archived'] += archived
+        self.totals['pruned'] += pruned
+        self.totals['vacuumed_pages'] += vacuumed
+        self.last_run = datetime.now()
+        self.last_duration = time.monotonic() - started
+        self.last_error = None
+        if archived or pruned or vacuumed:
+            logger.info(f"Maintenance: archived {archived} messages, pruned {pruned} rows, "
+                        f"released {vacuumed} pages in {self.last_duration:.2f}s")
+
+    def stats(self):
+        return dict(self.totals,
+                    retention_days=config.MESSAGE_RETENTION_DAYS,
+                    incremental_vacuum=self.incremental_vacuum,
+                    last_run=self.last_run.isoformat() if self.last_run else None,
+                    last_duration=round(self.last_duration, 3) if self.last_duration is not None else None,
+                    last_error=self.last_error)
+
+maintenance = MaintenanceWorker(config.MAINTENANCE_INTERVAL, config.MAINTENANCE_BATCH_SIZE,
+                                config.MAINTENANCE_VACUUM_PAGES, config.MAINTENANCE_SLICE_PAUSE)
+
+def sync_status_data():
+    """Isi /api/sync_status (tanpa statistik HTTP pool, itu tergantung mode serving)"""
+    last_seq = get_last_seq()
+    
+    # Posisi replikasi setiap slave relatif terhadap seq terakhir
+    replication = {slave_url: {
+        'acked_seq': replicator.acked_seq,
+        'lag': last_seq - replicator.acked_seq,
+        'last_ack': replicator.last_ack_at.isoformat() if replicator.last_ack_at else None,
+        'filter': replicator.filter
+    } for slave_url, replicator in slave_replicators.items()}
+    peer_replication = {peer_url: {
+        'acked_seq': replicator.acked_seq,
+        'lag': last_seq - replicator.acked_seq,
+        'last_ack': replicator.last_ack_at.isoformat() if replicator.last_ack_at else None
+    } for peer_url, replicator in peer_replicators.items()}
     
-    return jsonify({
-        'offline_messages': offline_stats,
-        'sync_statistics': sync_stats,
+    return {
+        'node_id': config.NODE_ID,
+        'cluster': cluster.snapshot(),
+        'hlc': hlc.value,
+        'last_seq': last_seq,
+        'replication': replication,
+        'peer_replication': peer_replication,
+        'slave_health': health_tracker.snapshot(),
+        'render_cache': render_cache.stats(),
+        'group_commit': message_writer.stats(),
+        'maintenance': maintenance.stats(),
         'timestamp': datetime.now().isoformat()
-    })
+    }
+
+def health_data():
+    return {
+        'status': 'healthy',
+        'server_type': 'master',
+        'node_id': config.NODE_ID,
+        'timestamp': datetime.now().isoformat(),
+        'message_count': int(metrics.value('chat_messages_stored'))
+    }
+
+def database_size():
+    conn = get_db()
+    return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+def health_detail_data():
+    """Isi /health/detail: /health + counter persist, posisi log dan status cluster.
+
+    Semua nilai dibaca dari memory atau satu row/PRAGMA, jadi tetap konstan
+    berapapun jumlah history pesan.
+    """
+    return dict(health_data(),
+                uptime_seconds=round(time.time() - STARTED_AT, 1),
+                stored_message_count=load_message_count(get_db()),
+                last_seq=int(metrics.value('chat_last_seq')),
+                hlc=hlc.value,
+                database_bytes=database_size(),
+                cluster=cluster.snapshot(),
+                slave_health=health_tracker.snapshot(),
+                group_commit=message_writer.stats())
+
+# API endpoint untuk mendapatkan sync status
+@app.route('/api/sync_status')
+def get_sync_status():
+    data = sync_status_data()
+    data['http_pools'] = peer_client.pool_stats()
+    
+    etag = json_etag(data, exclude=('timestamp',))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return not_modified(etag)
+    response = jsonify(data)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # Routes yang sudah ada (sama seperti sebelumnya)
 @app.route('/')
 def index():
-    messages = get_messages()
-    return render_template('index.html', messages=messages, server_type='Master')
+    try:
+        room = normalize_room(request.args.get('room'))
+    except ValueError:
+        return redirect(url_for('index'))
+    return render_index(room, request.args.get('before', type=int))
 
 @app.route('/send_message', methods=['POST'])
 def send_message():
     username = request.form.get('username', '').strip()
     message = request.form.get('message', '').strip()
+    try:
+        room = normalize_room(request.form.get('room'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     
-    if not username or not message:
-        return redirect(url_for('index'))
-    
-    add_message(username, message)
-    return redirect(url_for('index'))
+    if username and message:
+        add_message(username, message, room)
+    return redirect(url_for('index', room=room))
 
 @app.route('/api/messages')
 def api_messages():
-    messages = get_messages()
-    return jsonify([{
-        'id': msg[0],
-        'username': msg[1],
-        'message': msg[2],
-        'timestamp': msg[3]
-    } for msg in messages])
+    """List pesan dengan cursor: ?since_id= (alias ?after=), ?before=, ?since=, ?limit=,
+    ?rooms=a,b, ?authors=budi,sari"""
+    try:
+        rooms = parse_rooms(request.args.get('rooms'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    since_id = request.args.get('since_id', type=int)
+    if since_id is None:
+        since_id = request.args.get('after', type=int)
+    page = (since_id, request.args.get('before', type=int), request.args.get('since'),
+            request.args.get('limit', type=int))
+    filters = (rooms, parse_authors(request.args.get('authors')))
+    
+    etag = messages_etag(page + filters)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return not_modified(etag)
+    
+    # Node lain minta format kolumnar/msgpack lewat Accept, browser tetap JSON
+    content_type = negotiate_wire_format(request.headers.get('Accept'))
+    body, content_encoding, next_cursor = encode_messages_page(
+        *page,
+        content_type,
+        accepts_gzip(request.headers.get('Accept-Encoding')),
+        *filters
+    )
+    
+    response = Response(body, content_type=content_type)
+    response.headers['ETag'] = variant_etag(etag, content_type, content_encoding)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        # Halaman penuh: beri tahu seberapa jauh client tertinggal di slice yang
+        # sama (slave bisa pilih snapshot)
+        response.headers['X-Last-Seq'] = str(get_last_seq(*filters, page[2]))
+    return response
+
+@app.route('/api/search')
+def api_search():
+    """Full-text search: ?q= (wajib), ?username=, ?limit=, ?offset="""
+    try:
+        data = search_data(
+            request.args.get('q', ''),
+            request.args.get('username'),
+            request.args.get('limit', type=int),
+            request.args.get('offset', 0, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify(data)
+
+@app.route('/api/snapshot')
+def api_snapshot():
+    """Snapshot database untuk bootstrap slave baru, di-stream per chunk.
+    ?rooms=, ?authors=, ?since= = hanya pesan di slice itu (slave parsial)"""
+    try:
+        rooms = parse_rooms(request.args.get('rooms'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    path, seq, size = create_snapshot(rooms, parse_authors(request.args.get('authors')),
+                                      request.args.get('since'))
+    logger.info(f"Streaming snapshot at seq {seq} ({size} bytes)")
+    response = Response(read_snapshot_chunks(path), content_type='application/vnd.sqlite3', headers={
+        'Content-Length': str(size),
+        'X-Snapshot-Seq': str(seq)
+    })
+    response.call_on_close(lambda: remove_snapshot(path))
+    return response
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: push pesan baru begitu di-commit (?rooms=a,b = hanya room itu).
+    Di mode 'flask' setiap stream memegang satu thread; banyak client = mode 'asgi'."""
+    try:
+        rooms = parse_rooms(request.args.get('rooms'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    last_seq = request.headers.get('Last-Event-ID', type=int)
+    if last_seq is None:
+        last_seq = message_hub.last_seq
+    
+    def generate(last_seq):
+        yield 'retry: 3000\n\n'
+        while True:
+            events, last_seq, missed = message_hub.wait_for_events(last_seq, config.STREAM_HEARTBEAT)
+            if missed:
+                # Client ketinggalan, minta dia re-fetch lewat /api/messages?since_id=
+                yield f'id: {last_seq}\nevent: reset\ndata: {{}}\n\n'
+            for seq, message_data in events:
+                if rooms is None or message_data['room'] in rooms:
+                    yield f'id: {seq}\ndata: {json.dumps(message_data)}\n\n'
+            if not events and not missed:
+                yield ': keepalive\n\n'
+    
+    return Response(generate(last_seq), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
 
 @app.route('/sync_message', methods=['POST'])
 def sync_message():
     """Receive message from slave server"""
     try:
         data = request.get_json()
-        username = data['username']
-        message = data['message']
-        slave_id = data.get('slave_id')
+        master_id, duplicate = ingest_slave_message(data['username'], data['message'],
+                                                    find_sender_slave(request.remote_addr),
+                                                    idempotency_key(request.headers, data),
+                                                    data.get('room'))
+        return jsonify({'status': 'success', 'master_id': master_id, 'duplicate': duplicate})
         
-        conn = sqlite3.connect(config.DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO messages (username, message, sync_status) VALUES (?, ?, ?)',
-                      (username, message, 'synced'))
-        master_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        # Sync ke slaves lain dengan queue system
-        message_data = {
-            'id': master_id,
-            'username': username,
-            'message': message,
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        threading.Thread(target=sync_to_other_slaves, args=(message_data, request.remote_addr)).start()
+    except Exception as e:
+        logger.error(f"Error syncing message: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/replication/filter', methods=['POST'])
+def replication_filter_endpoint():
+    """Slave mendaftarkan slice data yang direplikasi ke dia: rooms, authors, window_days"""
+    try:
+        return jsonify(register_replication_filter(request.get_json(), request.remote_addr))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except LookupError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 404
+
+@app.route('/peer/sync_messages', methods=['POST'])
+def peer_sync_messages():
+    """Receive batch of messages from peer (mode peer)"""
+    try:
+        data = decode_wire(request.get_data(), request.content_type,
+                           request.headers.get('Content-Encoding'))
+        return jsonify(receive_peer_batch(data))
         
-        return jsonify({'status': 'success', 'master_id': master_id})
+    except UnsupportedWireFormat as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except Exception as e:
+        logger.error(f"Error receiving batch from peer: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/sync_messages', methods=['POST'])
+def sync_messages():
+    """Receive batch of messages from the leader elected by slaves (failover)"""
+    try:
+        data = decode_wire(request.get_data(), request.content_type,
+                           request.headers.get('Content-Encoding'))
+        return jsonify(receive_leader_batch(data))
         
+    except UnsupportedWireFormat as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except StaleLeader:
+        return jsonify(dict(cluster.snapshot(), status='error', message='Stale leader')), 409
     except Exception as e:
-        logger.error(f"Error syncing message: {str(e)}")
+        logger.error(f"Error receiving batch from leader: {str(e)}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-def sync_to_other_slaves(message_data, sender_ip):
-    """Sync ke slaves lain kecuali pengirim"""
-    for slave_url in config.SLAVE_SERVERS:
-        # Skip sender (naive check berdasarkan IP)
-        if sender_ip not in slave_url:
-            success = attempt_sync_to_slave(slave_url, message_data)
-            if not success:
-                save_offline_message(message_data['id'], slave_url, message_data)
+@app.route('/cluster/leader', methods=['POST'])
+def cluster_leader():
+    """Pengumuman leader baru hasil election antar slave"""
+    data = request.get_json()
+    if not cluster.observe(data['term'], data['leader']):
+        return jsonify(dict(cluster.snapshot(), status='error', message='Stale leader')), 409
+    return jsonify(dict(cluster.snapshot(), status='success'))
+
+@app.route('/cluster/state')
+def cluster_state():
+    return jsonify(cluster_state_data())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/health')
 def health():
-    return jsonify({
-        'status': 'healthy',
-        'server_type': 'master',
-        'timestamp': datetime.now().isoformat(),
-        'message_count': len(get_messages())
-    })
+    return jsonify(health_data())
+
+@app.route('/health/detail')
+def health_detail():
+    return jsonify(health_detail_data())
 
 if __name__ == '__main__':
     init_db()
     
     # Start background processes
-    health_thread = threading.Thread(target=check_slave_health_enhanced, daemon=True)
-    health_thread.start()
+    message_writer.start()
+    maintenance.start()
+    health_tracker.add_listener(on_slave_health_change)
+    health_tracker.start()
+    cluster.add_listener(start_leader_forwarder)
     
-    offline_queue_thread = threading.Thread(target=process_offline_queue, daemon=True)
-    offline_queue_thread.start()
+    for replicator in slave_replicators.values():
+        replicator.start()
+    for replicator in peer_replicators.values():
+        replicator.start()
     
     logger.info(f"Starting Enhanced Master Server on {config.HOST}:{config.PORT}")
-    logger.info("Features: Offline messaging, message queue, retry mechanism")
+    logger.info("Features: Replication log, batched sync, retry mechanism")
     
     app.run(host=config.HOST, port=config.PORT, debug=True)
\ No newline at end of file
@@ -0,0 +1,662 @@
+# asgi.py
+# Production serving mode: HTTP surface dan replikasi ke slave berjalan di satu
+# event loop asyncio (uvicorn + httpx), bukan satu thread per request/sync.
+# Logika data tetap di app.py; query SQLite dijalankan di thread pool kecil
+# karena modul sqlite3 blocking.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, quote, urlsplit
+
+import httpx
+import uvicorn
+
+import config
+import app as core
+
+logger = logging.getLogger(__name__)
+# httpx me-log setiap request di level INFO; sync loop terlalu sering untuk itu
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# Thread pool untuk SQLite. Setiap thread memegang satu koneksi (core.get_db)
+db_executor = ThreadPoolExecutor(max_workers=config.ASGI_DB_THREADS, thread_name_prefix='db')
+
+def _call_db(fn, args):
+    try:
+        return fn(*args)
+    finally:
+        # Sama seperti teardown_request di app.py: jangan tinggalkan transaksi terbuka
+        conn = core.get_db()
+        if conn.in_transaction:
+            conn.rollback()
+
+async def run_db(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(_call_db, fn, args))
+
+class AsyncPeerHTTPClient:
+    """Versi async dari PeerHTTPClient: satu httpx.AsyncClient dengan connection
+    pool keep-alive untuk semua peer."""
+
+    def __init__(self):
+        self._client = None
+        self._requests = {}
+        self._connections = {}
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.SYNC_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=config.ASGI_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=config.HTTP_POOL_MAXSIZE * max(1, len(core.health_tracker.peer_urls)))
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def request(self, method, url, **kwargs):
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        self._requests[base_url] = self._requests.get(base_url, 0) + 1
+        started = time.perf_counter()
+        try:
+            response = await self._client.request(method, url, extensions={'trace': self._trace(url)},
+                                                  **kwargs)
+        except Exception:
+            core.metrics.inc('chat_peer_request_errors_total', peer=base_url, endpoint=parts.path)
+            raise
+        core.metrics.observe('chat_peer_request_seconds', time.perf_counter() - started,
+                             peer=base_url, endpoint=parts.path)
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def _trace(self, url):
+        """Trace httpcore: hitung koneksi TCP baru per peer (request lain memakai ulang pool)"""
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+
+        async def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                self._connections[base_url] = self._connections.get(base_url, 0) + 1
+        return trace
+
+    def pool_stats(self):
+        """Statistik reuse koneksi per peer, skema sama dengan PeerHTTPClient.pool_stats"""
+        return {base_url: core.connection_reuse_stats(count, self._connections.get(base_url, 0))
+                for base_url, count in self._requests.items()}
+
+peer_http = AsyncPeerHTTPClient()
+
+class StreamNotifier:
+    """Jembatan message_hub (thread) ke event loop.
+
+    Semua subscriber /api/stream menunggu satu future bersama; publish dari
+    thread manapun me-resolve future itu lewat call_soon_threadsafe lalu
+    future baru dibuat untuk generasi berikutnya.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._future = loop.create_future()
+
+    def wake(self):
+        self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+        self._future = self._loop.create_future()
+
+    async def wait_for_events(self, last_seq, timeout):
+        if last_seq == core.message_hub.last_seq:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return core.message_hub.wait_for_events(last_seq, 0)
+
+stream_notifier = None
+loop = None
+
+class AsyncSlaveReplicator(core.SlaveReplicator):
+    """SlaveReplicator yang berjalan sebagai task asyncio (bukan thread)"""
+
+    def __init__(self, slave_url, loop):
+        super().__init__(slave_url)
+        self._loop = loop
+        self._async_wakeup = asyncio.Event()
+
+    def notify(self):
+        # Bisa dipanggil dari thread db_executor (add_message) maupun event loop
+        self._loop.call_soon_threadsafe(self._async_wakeup.set)
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._async_wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self):
+        await run_db(self.load_state)
+        failures = 0
+        while True:
+            if failures:
+                await self._wait(min(2 ** failures, config.REPLICATION_MAX_BACKOFF))
+            elif await self._wait(config.SYNC_INTERVAL):
+                await asyncio.sleep(config.REPLICATION_BATCH_WINDOW)
+            self._async_wakeup.clear()
+
+            try:
+                while await self._replicate_batch_async():
+                    pass
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error(f"Replication to {self.slave_url} failed at seq {self.acked_seq}: {str(e)}")
+                core.metrics.inc('chat_replication_failures_total', peer=self.slave_url)
+
+    async def _replicate_batch_async(self):
+        if not self.is_active():
+            return False
+        batch = await run_db(self.next_batch)
+        if batch is None:
+            return False
+        messages, seq_end, has_more = batch
+
+        acked_seq = seq_end
+        if messages:
+            body, headers = self.encode_batch(messages, seq_end)
+            response = await peer_http.post(f"{self.slave_url}{self.ENDPOINT}", content=body, headers=headers)
+            if self.downgrade_wire_format(response):
+                return True
+            if await run_db(core.observe_cluster, response):
+                return False
+            response.raise_for_status()
+            acked_seq = response.json().get('acked_seq', seq_end)
+            logger.info(f"Successfully synced {len(messages)} messages to {self.slave_url} (seq {seq_end})")
+            core.metrics.inc('chat_replicated_messages_total', len(messages), peer=self.slave_url)
+
+        await run_db(self.ack, acked_seq)
+        return has_more
+
+class AsyncPeerReplicator(AsyncSlaveReplicator, core.PeerReplicator):
+    """PeerReplicator sebagai task asyncio"""
+
+class AsyncLeaderForwarder(AsyncSlaveReplicator, core.LeaderForwarder):
+    """LeaderForwarder sebagai task asyncio; posisi awal diambil lewat httpx"""
+
+    def __init__(self, slave_url, loop):
+        super().__init__(slave_url, loop)
+        self.leader_high_water = 0
+
+    def initial_seq(self):
+        return self.leader_high_water
+
+    async def run(self):
+        failures = 0
+        while True:
+            try:
+                response = await peer_http.get(f"{self.slave_url}/cluster/state")
+                response.raise_for_status()
+                self.leader_high_water = response.json()['master_high_water']
+                break
+            except Exception as e:
+                failures += 1
+                logger.error(f"Cannot reach leader {self.slave_url}: {str(e) or type(e).__name__}")
+                await asyncio.sleep(min(2 ** failures, config.REPLICATION_MAX_BACKOFF))
+        await super().run()
+
+def start_leader_forwarder(term, leader_url):
+    """Listener cluster (dipanggil dari thread db_executor): forwarder dibuat di event loop"""
+    loop.call_soon_threadsafe(_start_leader_forwarder, leader_url)
+
+def _start_leader_forwarder(leader_url):
+    if leader_url not in core.peer_replicators:
+        forwarder = AsyncLeaderForwarder(leader_url, loop)
+        core.peer_replicators[leader_url] = forwarder
+        spawn(forwarder.run())
+
+async def probe_peer(peer_url):
+    started = time.monotonic()
+    error = None
+    try:
+        response = await peer_http.get(
+            f"{peer_url}/health",
+            timeout=httpx.Timeout(config.HEALTH_CHECK_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+        )
+        online = response.status_code == 200
+        if not online:
+            error = f"HTTP {response.status_code}"
+    except Exception as e:
+        online = False
+        error = str(e) or type(e).__name__
+    core.health_tracker.record(peer_url, online, started, error)
+
+async def health_check_loop():
+    """Pengganti thread HealthTracker: semua peer di-probe bersamaan"""
+    while True:
+        await asyncio.gather(*(probe_peer(peer_url) for peer_url in core.health_tracker.peer_urls))
+        await asyncio.sleep(core.health_tracker.interval)
+
+# HTTP plumbing minimal di atas ASGI
+class Request:
+    def __init__(self, scope, receive):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = {key: values[0] for key, values in
+                      parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                        for key, value in scope['headers']}
+        self.remote_addr = scope['client'][0] if scope.get('client') else None
+        self._receive = receive
+
+    def int_arg(self, name):
+        try:
+            return int(self.query[name])
+        except (KeyError, ValueError):
+            return None
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self._receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def json(self):
+        return json.loads(await self.body())
+
+    async def form(self):
+        body = (await self.body()).decode('utf-8')
+        return {key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()}
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.headers = dict(headers or {}, **{'Content-Type': content_type})
+
+    def _raw_headers(self):
+        return [(key.lower().encode('latin-1'), str(value).encode('latin-1'))
+                for key, value in self.headers.items()]
+
+    async def __call__(self, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': self._raw_headers() + [(b'content-length', str(len(self.body)).encode())]})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+class StreamingResponse(Response):
+    """Kirim chunk dari async generator sampai client disconnect"""
+
+    def __init__(self, chunks, content_type, headers=None, on_close=None):
+        super().__init__(b'', 200, content_type, headers)
+        self.chunks = chunks
+        self.on_close = on_close  # Dipanggil setelah response selesai, juga kalau body tidak pernah dibaca
+
+    async def __call__(self, receive, send):
+        try:
+            await self._stream(receive, send)
+        finally:
+            if self.on_close is not None:
+                await run_db(self.on_close)
+
+    async def _stream(self, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self._raw_headers()})
+
+        async def pump():
+            async for chunk in self.chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_disconnect())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if tasks[0] in done and tasks[0].exception() is None:
+            await send({'type': 'http.response.body', 'body': b''})
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data), status, 'application/json', headers)
+
+def redirect(location):
+    return Response(b'', 302, headers={'Location': location})
+
+def not_modified(etag):
+    return Response(b'', 304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+# Routes (sama dengan app.py)
+async def index(request):
+    try:
+        room = core.normalize_room(request.query.get('room'))
+    except ValueError:
+        return redirect('/')
+    before_id = request.int_arg('before')
+    # Cache hit dilayani langsung di event loop tanpa lewat thread SQLite
+    html = core.render_cache.get((room, before_id))
+    if html is None:
+        html = await run_db(core.render_index, room, before_id)
+    return Response(html)
+
+async def send_message(request):
+    form = await request.form()
+    username = form.get('username', '').strip()
+    message = form.get('message', '').strip()
+    try:
+        room = core.normalize_room(form.get('room'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+
+    if username and message:
+        await asyncio.wrap_future(core.message_writer.submit(username, message, room))
+    return redirect(f'/?room={quote(room)}')
+
+async def api_messages(request):
+    """List pesan dengan cursor: ?since_id= (alias ?after=), ?before=, ?since=, ?limit=,
+    ?rooms=a,b, ?authors=budi,sari"""
+    try:
+        rooms = core.parse_rooms(request.query.get('rooms'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    since_id = request.int_arg('since_id')
+    if since_id is None:
+        since_id = request.int_arg('after')
+    page = (since_id, request.int_arg('before'), request.query.get('since'), request.int_arg('limit'))
+    filters = (rooms, core.parse_authors(request.query.get('authors')))
+
+    etag = core.messages_etag(page + filters)
+    if core.etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+
+    # Query + encode (+ gzip) dijalankan di thread supaya event loop tidak tertahan
+    content_type = core.negotiate_wire_format(request.headers.get('accept'))
+    body, content_encoding, next_cursor = await run_db(
+        core.encode_messages_page,
+        *page,
+        content_type,
+        core.accepts_gzip(request.headers.get('accept-encoding')),
+        *filters
+    )
+
+    headers = {
+        'ETag': core.variant_etag(etag, content_type, content_encoding),
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept, Accept-Encoding'
+    }
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+        headers['X-Last-Seq'] = await run_db(core.get_last_seq, *filters, page[2])
+    return Response(body, 200, content_type, headers)
+
+async def api_snapshot(request):
+    """Snapshot database untuk bootstrap slave baru, di-stream per chunk.
+    ?rooms=, ?authors=, ?since= = hanya pesan di slice itu (slave parsial)"""
+    try:
+        rooms = core.parse_rooms(request.query.get('rooms'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    path, seq, size = await run_db(core.create_snapshot, rooms, core.parse_authors(request.query.get('authors')),
+                                   request.query.get('since'))
+    logger.info(f"Streaming snapshot at seq {seq} ({size} bytes)")
+
+    async def generate():
+        # Baca file di thread; file dihapus on_close setelah response selesai. Generator
+        # tidak di-close() dari sini: saat client putus next() bisa masih jalan di thread,
+        # jadi file ditutup oleh generator itu sendiri setelah tidak dipakai lagi.
+        loop = asyncio.get_running_loop()
+        chunks = core.read_snapshot_chunks(path)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    return StreamingResponse(generate(), 'application/vnd.sqlite3', headers={
+        'Content-Length': size,
+        'X-Snapshot-Seq': seq
+    }, on_close=lambda: core.remove_snapshot(path))
+
+async def api_stream(request):
+    """Server-Sent Events: push pesan baru begitu di-commit (?rooms=a,b = hanya room itu)"""
+    try:
+        rooms = core.parse_rooms(request.query.get('rooms'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    try:
+        last_seq = int(request.headers['last-event-id'])
+    except (KeyError, ValueError):
+        last_seq = core.message_hub.last_seq
+
+    async def generate(last_seq):
+        yield 'retry: 3000\n\n'
+        while True:
+            events, last_seq, missed = await stream_notifier.wait_for_events(last_seq, config.STREAM_HEARTBEAT)
+            if missed:
+                # Client ketinggalan, minta dia re-fetch lewat /api/messages?since_id=
+                yield f'id: {last_seq}\nevent: reset\ndata: {{}}\n\n'
+            for seq, message_data in events:
+                if rooms is None or message_data['room'] in rooms:
+                    yield f'id: {seq}\ndata: {json.dumps(message_data)}\n\n'
+            if not events and not missed:
+                yield ': keepalive\n\n'
+
+    return StreamingResponse(generate(last_seq), 'text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+async def sync_message(request):
+    """Receive message from slave server"""
+    try:
+        data = await request.json()
+        master_id, duplicate = await run_db(core.ingest_slave_message, data['username'], data['message'],
+                                            core.find_sender_slave(request.remote_addr),
+                                            core.idempotency_key(request.headers, data),
+                                            data.get('room'))
+        return json_response({'status': 'success', 'master_id': master_id, 'duplicate': duplicate})
+
+    except Exception as e:
+        logger.error(f"Error syncing message: {str(e)}")
+        return json_response({'status': 'error', 'message': str(e)}, 500)
+
+async def replication_filter(request):
+    """Slave mendaftarkan slice data yang direplikasi ke dia: rooms, authors, window_days"""
+    try:
+        return json_response(await run_db(core.register_replication_filter, await request.json(),
+                                          request.remote_addr))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    except LookupError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 404)
+
+async def peer_sync_messages(request):
+    """Receive batch of messages from peer (mode peer)"""
+    try:
+        data = core.decode_wire(await request.body(), request.headers.get('content-type'),
+                                request.headers.get('content-encoding'))
+        return json_response(await run_db(core.receive_peer_batch, data))
+
+    except core.UnsupportedWireFormat as e:
+        return json_response({'status': 'error', 'message': str(e)}, 415)
+    except Exception as e:
+        logger.error(f"Error receiving batch from peer: {str(e)}")
+        return json_response({'status': 'error', 'message': str(e)}, 500)
+
+async def sync_messages(request):
+    """Receive batch of messages from the leader elected by slaves (failover)"""
+    try:
+        data = core.decode_wire(await request.body(), request.headers.get('content-type'),
+                                request.headers.get('content-encoding'))
+        return json_response(await run_db(core.receive_leader_batch, data))
+
+    except core.UnsupportedWireFormat as e:
+        return json_response({'status': 'error', 'message': str(e)}, 415)
+    except core.StaleLeader:
+        return json_response(dict(core.cluster.snapshot(), status='error', message='Stale leader'), 409)
+    except Exception as e:
+        logger.error(f"Error receiving batch from leader: {str(e)}")
+        return json_response({'status': 'error', 'message': str(e)}, 500)
+
+async def cluster_leader(request):
+    """Pengumuman leader baru hasil election antar slave"""
+    data = await request.json()
+    if not await run_db(core.cluster.observe, data['term'], data['leader']):
+        return json_response(dict(core.cluster.snapshot(), status='error', message='Stale leader'), 409)
+    return json_response(dict(core.cluster.snapshot(), status='success'))
+
+async def cluster_state(request):
+    return json_response(await run_db(core.cluster_state_data))
+
+async def api_search(request):
+    """Full-text search: ?q= (wajib), ?username=, ?limit=, ?offset="""
+    try:
+        data = await run_db(
+            core.search_data,
+            request.query.get('q', ''),
+            request.query.get('username'),
+            request.int_arg('limit'),
+            request.int_arg('offset') or 0
+        )
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    return json_response(data)
+
+async def health(request):
+    # Hanya counter in-memory, tidak perlu thread DB
+    return json_response(core.health_data())
+
+async def health_detail(request):
+    return json_response(await run_db(core.health_detail_data))
+
+async def metrics(request):
+    return Response(core.metrics.render(), content_type='text/plain; version=0.0.4')
+
+async def get_sync_status(request):
+    data = await run_db(core.sync_status_data)
+    data['http_pools'] = peer_http.pool_stats()
+
+    etag = core.json_etag(data, exclude=('timestamp',))
+    if core.etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    return json_response(data, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+ROUTES = {
+    ('GET', '/'): index,
+    ('POST', '/send_message'): send_message,
+    ('GET', '/api/messages'): api_messages,
+    ('GET', '/api/search'): api_search,
+    ('GET', '/api/stream'): api_stream,
+    ('GET', '/api/snapshot'): api_snapshot,
+    ('POST', '/sync_message'): sync_message,
+    ('POST', '/replication/filter'): replication_filter,
+    ('POST', '/peer/sync_messages'): peer_sync_messages,
+    ('POST', '/sync_messages'): sync_messages,
+    ('POST', '/cluster/leader'): cluster_leader,
+    ('GET', '/cluster/state'): cluster_state,
+    ('GET', '/health'): health,
+    ('GET', '/health/detail'): health_detail,
+    ('GET', '/metrics'): metrics,
+    ('GET', '/api/sync_status'): get_sync_status,
+}
+
+background_tasks = set()
+
+def spawn(coro):
+    """Jalankan coroutine di background dan simpan referensinya sampai selesai"""
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def startup():
+    global stream_notifier, loop
+    await run_db(core.init_db)
+    core.message_writer.start()
+    core.maintenance.start()
+    await peer_http.start()
+
+    loop = asyncio.get_running_loop()
+    stream_notifier = StreamNotifier(loop)
+    core.message_hub.add_waker(stream_notifier.wake)
+
+    # Replikasi ke slave sebagai task asyncio, menggantikan thread SlaveReplicator
+    for slave_url in config.SLAVE_SERVERS:
+        replicator = AsyncSlaveReplicator(slave_url, loop)
+        core.slave_replicators[slave_url] = replicator
+        spawn(replicator.run())
+    for peer_url in config.PEER_SERVERS:
+        replicator = AsyncPeerReplicator(peer_url, loop)
+        core.peer_replicators[peer_url] = replicator
+        spawn(replicator.run())
+
+    core.health_tracker.add_listener(core.on_slave_health_change)
+    spawn(health_check_loop())
+    core.cluster.add_listener(start_leader_forwarder)
+
+    logger.info(f"Starting Enhanced Master Server (ASGI) on {config.HOST}:{config.PORT}")
+
+async def shutdown():
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await peer_http.close()
+    db_executor.shutdown(wait=False)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+            except Exception as e:
+                logger.exception("Startup failed")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope, receive)
+    handler = ROUTES.get((request.method, request.path))
+    core.metrics.inc('chat_http_requests_total', endpoint=request.path if handler else 'unmatched')
+    if handler is None:
+        allowed = any(path == request.path for _, path in ROUTES)
+        response = json_response({'status': 'error', 'message': 'Not found'}, 405 if allowed else 404)
+    else:
+        try:
+            response = await handler(request)
+        except Exception as e:
+            logger.exception(f"Error handling {request.method} {request.path}")
+            response = json_response({'status': 'error', 'message': str(e)}, 500)
+    await response(receive, send)
+
+if __name__ == '__main__':
+    uvicorn.run('asgi:app', host=config.HOST, port=config.PORT, access_log=False)
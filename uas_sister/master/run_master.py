@@ -6,10 +6,13 @@ import config
 def main(): 
     print(f"Starting Master Server on {config.HOST}:{config.PORT}") 
     print(f"Configured slaves: {config.SLAVE_SERVERS}") 
+    # python run_master.py asgi  -> override config.SERVER_MODE 
+    mode = sys.argv[1] if len(sys.argv) > 1 else config.SERVER_MODE 
+    print(f"Serving mode: {mode}") 
     print("Press Ctrl+C to stop the server") 
      
     try: 
-        subprocess.run([sys.executable, 'app.py']) 
+        subprocess.run([sys.executable, 'asgi.py' if mode == 'asgi' else 'app.py']) 
     except KeyboardInterrupt: 
         print("\nMaster server stopped.") 
  
@@ -1,12 +1,27 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
 import threading
 import time
+import random
 import json
-from datetime import datetime
+import re
+import gzip
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from itertools import islice
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlsplit
 import logging
+import os
 import config
+from queue import Queue, Full, Empty
+from concurrent.futures import Future
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -14,12 +29,768 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.secret_key = config.SECRET_KEY
+STARTED_AT = time.time()
 
-# Database initialization dengan tabel tambahan
-def init_db():
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
+# Hub untuk push pesan baru ke browser (Server-Sent Events)
+class MessageHub:
+    """Fan-out pesan baru ke semua subscriber /api/stream.
+
+    Event disimpan di satu ring buffer bersama. Subscriber hanya mengingat
+    seq terakhir yang sudah dikirim, jadi tidak ada queue per client dan
+    menyimpan event O(1) berapapun jumlah subscriber.
+
+    Biaya membangunkan subscriber tergantung serving mode. Di mode 'flask'
+    setiap stream memegang satu thread Werkzeug yang menunggu di Condition,
+    jadi notify_all() membangunkan O(subscriber) thread. Di mode 'asgi'
+    (default, asgi.py) satu-satunya waker adalah StreamNotifier: publish
+    me-resolve satu future bersama dan subscriber berupa coroutine, tanpa
+    thread per client.
+    """
+
+    def __init__(self, buffer_size):
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._wakers = []
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def add_waker(self, callback):
+        """callback() dipanggil setiap publish, untuk subscriber di luar Condition (event loop ASGI)"""
+        self._wakers.append(callback)
+
+    def publish(self, message):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, message))
+            self._cond.notify_all()
+            seq = self._seq
+        
+        for callback in self._wakers:
+            callback()
+        return seq
+
+    def wait_for_events(self, last_seq, timeout):
+        """Tunggu event dengan seq > last_seq.
+
+        Return (events, last_seq, missed). missed=True berarti sebagian event
+        sudah keluar dari buffer (atau server restart), client harus re-fetch
+        lewat /api/messages?since_id=.
+        """
+        with self._cond:
+            if last_seq > self._seq:
+                return [], self._seq, True
+            if last_seq == self._seq:
+                self._cond.wait(timeout)
+            if not self._events or last_seq >= self._seq:
+                return [], self._seq, False
+
+            oldest = self._events[0][0]
+            missed = last_seq + 1 < oldest
+            start = max(0, last_seq + 1 - oldest)
+            events = list(islice(self._events, start, None))
+            return events, self._seq, missed
+
+message_hub = MessageHub(config.STREAM_BUFFER_SIZE)
+
+# Metrics in-memory untuk /metrics (format text Prometheus)
+class Metrics:
+    """Counter, gauge dan histogram yang di-update langsung di hot path.
+
+    Semua nilai disimpan di memori per (nama, label), jadi scrape /metrics
+    hanya memformat angka yang sudah ada dan tidak pernah query SQLite.
+    Gauge yang nilainya sudah dipegang objek lain (acked_seq replicator,
+    ukuran queue) dibaca lewat callback saat scrape.
+    """
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # nama -> (type, help)
+        self._values = {}  # nama -> {labels: value}
+        self._histograms = {}  # nama -> {labels: [bucket counts, sum, count]}
+        self._callbacks = {}  # nama -> (label, fn)
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def gauge_callback(self, name, help_text, fn, label=None):
+        """Gauge yang dibaca saat scrape: fn() -> angka, atau {nilai label: angka} kalau label diisi"""
+        self.describe(name, 'gauge', help_text)
+        self._callbacks[name] = (label, fn)
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def set_max(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = max(series.get(key, value), value)
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = [[0] * (len(self.BUCKETS) + 1), 0.0, 0]
+            entry[0][bisect_left(self.BUCKETS, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def timed(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _format_labels(key):
+        if not key:
+            return ''
+        pairs = []
+        for label, value in key:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            pairs.append(f'{label}="{value}"')
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self):
+        with self._lock:
+            values = {name: dict(series) for name, series in self._values.items()}
+            histograms = {name: {key: (list(entry[0]), entry[1], entry[2]) for key, entry in series.items()}
+                          for name, series in self._histograms.items()}
+        for name, (label, fn) in list(self._callbacks.items()):
+            try:
+                result = fn()
+            except Exception as e:
+                logger.error(f"Metric {name} failed: {str(e)}")
+                continue
+            if label is None:
+                values[name] = {(): result}
+            else:
+                values[name] = {((label, label_value),): value for label_value, value in result.items()}
+        
+        lines = []
+        for name in sorted(set(values) | set(histograms)):
+            kind, help_text = self._meta.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(values.get(name, {}).items()):
+                lines.append(f'{name}{self._format_labels(key)} {value}')
+            for key, (buckets, total, count) in sorted(histograms.get(name, {}).items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.BUCKETS + ('+Inf',), buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{self._format_labels(key + (("le", bound),))} {cumulative}')
+                lines.append(f'{name}_sum{self._format_labels(key)} {total}')
+                lines.append(f'{name}_count{self._format_labels(key)} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def timed_query(name):
+    """Decorator: latency fungsi database dicatat di chat_db_query_seconds{query=name}"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metrics.timed('chat_db_query_seconds', query=name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+metrics.describe('chat_messages_inserted_total', 'counter', 'Pesan yang disimpan, per asal pesan')
+metrics.describe('chat_messages_stored', 'gauge', 'Jumlah pesan di database node ini (counter, bukan COUNT(*))')
+metrics.describe('chat_last_seq', 'gauge', 'messages.id tertinggi di node ini')
+metrics.describe('chat_sync_pending_messages', 'gauge', 'Pesan lokal yang belum sampai di master/leader (offline queue)')
+metrics.describe('chat_sync_retries_total', 'counter', 'Attempt sync ke master/leader yang gagal dan di-retry')
+metrics.describe('chat_sync_gave_up_total', 'counter', 'Pesan yang ditandai failed setelah semua retry habis')
+metrics.describe('chat_peer_request_seconds', 'histogram', 'Latency HTTP ke node lain per peer dan endpoint')
+metrics.describe('chat_peer_request_errors_total', 'counter', 'HTTP ke node lain yang gagal (timeout/koneksi)')
+metrics.describe('chat_replication_failures_total', 'counter', 'Batch replikasi ke follower yang gagal (saat leader)')
+metrics.describe('chat_archived_messages_total', 'counter', 'Pesan yang dipindah ke arsip oleh retention')
+metrics.describe('chat_pruned_rows_total', 'counter', 'Row bookkeeping sync yang di-prune, per tabel')
+metrics.describe('chat_vacuumed_pages_total', 'counter', 'Page yang dilepas incremental VACUUM')
+metrics.describe('chat_db_query_seconds', 'histogram', 'Latency query SQLite per nama query')
+metrics.describe('chat_http_requests_total', 'counter', 'Request HTTP masuk per endpoint')
+
+def record_inserted(origin, batch):
+    if batch:
+        metrics.inc('chat_messages_inserted_total', len(batch), origin=origin)
+        metrics.inc('chat_messages_stored', len(batch))
+        metrics.set_max('chat_last_seq', max(message_data['id'] for message_data in batch))
+
+# Cache HTML halaman index (di-invalidate oleh versi pesan)
+class RenderCache:
+    """Cache hasil render halaman index per window (?before=).
+
+    Versi pesan naik di setiap insert lewat bump(), dan semua entry lama
+    dibuang. Selama tidak ada tulisan, page load berikutnya dilayani dari
+    memory tanpa query SQLite maupun render Jinja.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._version = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def bump(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return html
+
+    def get_or_render(self, key, render):
+        html = self.get(key)
+        if html is not None:
+            return html
+        
+        with self._lock:
+            version = self._version
+            self._misses += 1
+        html = render()
+        with self._lock:
+            # Ada insert selama render: hasilnya mungkin sudah basi, jangan di-cache
+            if self._version == version:
+                self._entries[key] = html
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'hits': self._hits,
+                'misses': self._misses
+            }
+
+render_cache = RenderCache(config.INDEX_CACHE_SIZE)
+
+# Setiap insert pesan (lokal maupun hasil sync) di-publish ke hub setelah commit,
+# jadi publish sekaligus menjadi titik bump versi pesan
+message_hub.add_waker(render_cache.bump)
+
+# Conditional GET (ETag / If-None-Match). Versi pesan direset ke 0 setiap
+# proses start, jadi ETag diberi epoch per proses supaya tidak bentrok
+# dengan ETag yang masih dipegang client dari proses sebelumnya.
+ETAG_EPOCH = uuid.uuid4().hex[:8]
+
+def messages_etag(query):
+    """ETag /api/messages untuk satu query: berubah setiap ada insert, tanpa query ke SQLite.
+
+    query = cursor, limit, dan filter request. Ikut di-hash supaya ETag halaman atau
+    filter lain tidak pernah cocok (304 palsu untuk halaman berikutnya).
+    Harus dihitung sebelum query supaya ETag tidak pernah lebih baru dari body.
+    """
+    digest = hashlib.sha1(repr(query).encode('utf-8')).hexdigest()[:12]
+    return f'"{ETAG_EPOCH}-{render_cache.version}-{digest}"'
+
+def json_etag(data, exclude=()):
+    """Weak ETag dari isi JSON (field di exclude, mis. timestamp, tidak dihitung)"""
+    body = json.dumps({key: value for key, value in data.items() if key not in exclude},
+                      sort_keys=True, default=str)
+    return f'W/"{hashlib.sha1(body.encode()).hexdigest()[:16]}"'
+
+def etag_matches(if_none_match, etag):
+    """Perbandingan weak sesuai aturan If-None-Match (suffix representasi diabaikan)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    
+    def opaque(tag):
+        return tag.strip().removeprefix('W/').strip('"').split('+')[0]
+    return any(opaque(tag) == opaque(etag) for tag in if_none_match.split(','))
+
+def not_modified(etag):
+    return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+# Format wire antar node. Daftar pesan dikirim kolumnar (nama field sekali,
+# bukan di setiap pesan), opsional MessagePack, dan di-gzip kalau cukup besar.
+# Format dinegosiasikan lewat Accept / Content-Type; JSON biasa tetap fallback.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # opsional, tanpa msgpack dipakai JSON kolumnar
+
+WIRE_JSON = 'application/json'
+WIRE_COLUMNS = 'application/vnd.discussion.columns+json'
+WIRE_MSGPACK = 'application/vnd.discussion.columns+msgpack'
+
+class UnsupportedWireFormat(ValueError):
+    pass
+
+def wire_formats():
+    """Format yang bisa dibaca node ini, urut dari yang paling ringkas"""
+    return ([WIRE_MSGPACK] if msgpack is not None else []) + [WIRE_COLUMNS, WIRE_JSON]
+
+def wire_accept_header():
+    formats = wire_formats()
+    return ', '.join(f"{content_type};q={1 - i / 10:.1f}" for i, content_type in enumerate(formats))
+
+def negotiate_wire_format(accept):
+    """Pilih format response dari header Accept (browser selalu dapat JSON)"""
+    offered = {part.split(';')[0].strip() for part in (accept or '').split(',')}
+    for content_type in wire_formats():
+        if content_type in offered:
+            return content_type
+    return WIRE_JSON
+
+def accepts_gzip(accept_encoding):
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.partition(';')
+        if coding.strip() == 'gzip' and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            return True
+    return False
+
+def pack_messages(messages):
+    fields = list(messages[0]) if messages else []
+    return {'fields': fields, 'columns': [[msg[field] for msg in messages] for field in fields]}
+
+def unpack_messages(packed):
+    return [dict(zip(packed['fields'], row)) for row in zip(*packed['columns'])]
+
+def encode_wire(data, content_type):
+    """data = list pesan, atau dict dengan list pesan di key 'messages'"""
+    if content_type != WIRE_JSON:
+        if isinstance(data, list):
+            data = pack_messages(data)
+        else:
+            data = dict(data, messages=pack_messages(data['messages']))
+    if content_type == WIRE_MSGPACK:
+        return msgpack.packb(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+def encode_wire_body(data, content_type, allow_gzip):
+    """Return (body, content_encoding); gzip hanya kalau body cukup besar"""
+    body = encode_wire(data, content_type)
+    if allow_gzip and len(body) >= config.WIRE_GZIP_MIN_SIZE:
+        return gzip.compress(body, config.WIRE_GZIP_LEVEL), 'gzip'
+    return body, None
+
+def decode_wire(body, content_type, content_encoding=None):
+    """Kebalikan encode_wire_body; pesan kolumnar dikembalikan sebagai list of dict"""
+    if content_encoding == 'gzip':
+        body = gzip.decompress(body)
+    elif content_encoding not in (None, '', 'identity'):
+        raise UnsupportedWireFormat(f"Unsupported Content-Encoding: {content_encoding}")
+    
+    media_type = (content_type or WIRE_JSON).split(';')[0].strip()
+    if media_type == WIRE_JSON:
+        return json.loads(body)
+    if media_type == WIRE_MSGPACK and msgpack is not None:
+        data = msgpack.unpackb(body)
+    elif media_type == WIRE_COLUMNS:
+        data = json.loads(body)
+    else:
+        raise UnsupportedWireFormat(f"Unsupported Content-Type: {media_type}")
+    
+    if 'fields' in data:
+        return unpack_messages(data)
+    return dict(data, messages=unpack_messages(data['messages']))
+
+def variant_etag(etag, content_type, content_encoding):
+    """ETag per representasi (format + gzip); etag_matches mengabaikan suffix ini"""
+    suffix = {WIRE_JSON: '', WIRE_COLUMNS: '+cols', WIRE_MSGPACK: '+mp'}[content_type]
+    if content_encoding:
+        suffix += f'+{content_encoding}'
+    return f'{etag[:-1]}{suffix}"' if suffix else etag
+
+# Connection pool untuk traffic antar node (keep-alive per peer)
+class PeerHTTPClient:
+    """HTTP client untuk traffic antar node.
+
+    Satu requests.Session per peer dengan connection pool keep-alive, jadi
+    sync dan health check tidak membuka koneksi TCP baru di setiap request.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _session(self, url):
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.HTTP_POOL_MAXSIZE,
+                                      pool_block=config.HTTP_POOL_BLOCK)
+                session.mount(base_url, adapter)
+                self._sessions[base_url] = session
+            return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (config.HTTP_CONNECT_TIMEOUT, config.SYNC_TIMEOUT))
+        parts = urlsplit(url)
+        peer = f"{parts.scheme}://{parts.netloc}"
+        started = time.perf_counter()
+        try:
+            response = self._session(url).request(method, url, **kwargs)
+        except Exception:
+            metrics.inc('chat_peer_request_errors_total', peer=peer, endpoint=parts.path)
+            raise
+        metrics.observe('chat_peer_request_seconds', time.perf_counter() - started,
+                        peer=peer, endpoint=parts.path)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def pool_stats(self):
+        """Statistik reuse koneksi per peer (dari urllib3 connection pool)"""
+        stats = {}
+        with self._lock:
+            sessions = list(self._sessions.items())
+        
+        for base_url, session in sessions:
+            poolmanager = session.get_adapter(base_url).poolmanager
+            total_requests = 0
+            connections_opened = 0
+            for key in list(poolmanager.pools.keys()):
+                pool = poolmanager.pools.get(key)
+                if pool is not None:
+                    total_requests += pool.num_requests
+                    connections_opened += pool.num_connections
+            
+            stats[base_url] = connection_reuse_stats(total_requests, connections_opened)
+        return stats
+
+def connection_reuse_stats(total_requests, connections_opened):
+    """Satu entry http_pools di /api/sync_status (sama untuk mode flask dan asgi)"""
+    reused = max(0, total_requests - connections_opened)
+    return {
+        'requests': total_requests,
+        'connections_opened': connections_opened,
+        'reused': reused,
+        'reuse_ratio': round(reused / total_requests, 3) if total_requests else 0.0
+    }
+
+peer_client = PeerHTTPClient()
+
+# Cache status kesehatan master (di-update oleh satu background thread)
+class HealthTracker:
+    """Satu background thread yang mem-probe /health setiap peer dan meng-cache hasilnya.
+
+    Route dan sync loop membaca status dari cache (O(1)) dan tidak pernah
+    melakukan HTTP call sendiri. Status dianggap basi kalau probe terakhir
+    lebih lama dari ttl detik.
+    """
+
+    def __init__(self, peer_urls, interval, ttl):
+        self.interval = interval
+        self.ttl = ttl
+        self._state = {peer_url: {
+            'online': False,
+            'latency_ms': None,
+            'last_seen': None,
+            'last_check': None,
+            'error': None
+        } for peer_url in peer_urls}
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add_listener(self, callback):
+        """callback(peer_url, online) dipanggil setiap kali status peer berubah"""
+        self._listeners.append(callback)
+
+    @property
+    def peer_urls(self):
+        return list(self._state)
+
+    def probe(self, peer_url):
+        started = time.monotonic()
+        error = None
+        try:
+            response = peer_client.get(
+                f"{peer_url}/health",
+                timeout=(config.HTTP_CONNECT_TIMEOUT, config.HEALTH_CHECK_TIMEOUT)
+            )
+            online = response.status_code == 200
+            if not online:
+                error = f"HTTP {response.status_code}"
+        except Exception as e:
+            online = False
+            error = str(e)
+        
+        return self.record(peer_url, online, started, error)
+
+    def record(self, peer_url, online, started, error=None):
+        """Simpan hasil satu probe (started = time.monotonic() saat probe dimulai)"""
+        now = time.time()
+        with self._lock:
+            state = self._state[peer_url]
+            was_online = state['online']
+            state['online'] = online
+            state['latency_ms'] = round((time.monotonic() - started) * 1000, 1)
+            state['last_check'] = now
+            state['error'] = error
+            if online:
+                state['last_seen'] = now
+        
+        if online != was_online:
+            logger.info(f"Peer {peer_url} is now {'online' if online else 'offline'}")
+            for callback in self._listeners:
+                try:
+                    callback(peer_url, online)
+                except Exception as e:
+                    logger.error(f"Health listener failed for {peer_url}: {str(e)}")
+        return online
+
+    def _run(self):
+        while True:
+            for peer_url in self.peer_urls:
+                self.probe(peer_url)
+            time.sleep(self.interval)
+
+    def is_online(self, peer_url):
+        state = self._state.get(peer_url)
+        if state is None or state['last_check'] is None:
+            return False
+        return state['online'] and time.time() - state['last_check'] <= self.ttl
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            return {peer_url: {
+                'online': state['online'],
+                'stale': state['last_check'] is None or now - state['last_check'] > self.ttl,
+                'latency_ms': state['latency_ms'],
+                'last_seen': datetime.fromtimestamp(state['last_seen']).isoformat() if state['last_seen'] else None,
+                'last_check': datetime.fromtimestamp(state['last_check']).isoformat() if state['last_check'] else None,
+                'error': state['error']
+            } for peer_url, state in self._state.items()}
+
+health_tracker = HealthTracker([config.MASTER_SERVER] + config.CLUSTER_NODES,
+                               config.HEALTH_CHECK_INTERVAL, config.HEALTH_CACHE_TTL)
+
+# Worker pool untuk sync job (jumlah thread tetap, queue terbatas)
+class TimerWheel:
+    """Hashed timer wheel untuk menjadwalkan retry tanpa time.sleep di worker.
+
+    Satu thread ticker maju setiap `tick` detik dan mengeluarkan job yang
+    jatuh tempo di slot saat ini. schedule() O(1) berapapun jumlah job.
+    """
+
+    def __init__(self, tick, slots, on_due):
+        self.tick = tick
+        self._slots = [[] for _ in range(slots)]
+        self._current = 0
+        self._size = 0
+        self._on_due = on_due
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __len__(self):
+        return self._size
+
+    def start(self):
+        self._thread.start()
+
+    def schedule(self, delay, fn, *args):
+        ticks = max(1, int(-(-delay // self.tick)))  # ceil
+        with self._lock:
+            slot = (self._current + ticks) % len(self._slots)
+            rounds = (ticks - 1) // len(self._slots)
+            self._slots[slot].append([rounds, fn, args])
+            self._size += 1
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            with self._lock:
+                self._current = (self._current + 1) % len(self._slots)
+                entries = self._slots[self._current]
+                due = [entry for entry in entries if entry[0] == 0]
+                pending = [entry for entry in entries if entry[0] > 0]
+                for entry in pending:
+                    entry[0] -= 1
+                self._slots[self._current] = pending
+                self._size -= len(due)
+            
+            for _, fn, args in due:
+                self._on_due(fn, *args)
+
+class WorkerPool:
+    """Executor ukuran tetap untuk sync job dengan job queue terbatas.
+
+    submit() tidak pernah block: kalau queue penuh job ditolak (return False)
+    dan pemanggil yang menentukan fallback-nya (backpressure). Retry dijadwalkan
+    lewat TimerWheel sehingga worker tidak pernah tidur menunggu backoff.
+    """
+
+    def __init__(self, size, queue_size, wheel_tick, wheel_slots):
+        self._jobs = Queue(maxsize=queue_size)
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(size)]
+        self._wheel = TimerWheel(wheel_tick, wheel_slots, self._submit_scheduled)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+        self._wheel.start()
+
+    def submit(self, fn, *args):
+        try:
+            self._jobs.put_nowait((fn, args))
+        except Full:
+            self._count('rejected')
+            return False
+        self._count('submitted')
+        return True
+
+    def schedule(self, delay, fn, *args, on_drop=None):
+        """Jalankan fn(*args) di worker setelah `delay` detik. Kalau saat jatuh tempo
+        queue penuh, job dibuang dan on_drop() dipanggil (mis. melepas claim job)."""
+        self._wheel.schedule(delay, fn, args, on_drop)
+
+    def _submit_scheduled(self, fn, args, on_drop):
+        if not self.submit(fn, *args):
+            logger.warning(f"Worker queue full, dropped scheduled job {fn.__name__}")
+            if on_drop is not None:
+                on_drop()
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _work(self):
+        while True:
+            fn, args = self._jobs.get()
+            with self._lock:
+                self._in_flight += 1
+            try:
+                fn(*args)
+                self._count('completed')
+            except Exception as e:
+                self._count('failed')
+                logger.error(f"Job {fn.__name__} failed: {str(e)}")
+                get_db().rollback()
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters,
+                        queue_depth=self._jobs.qsize(),
+                        in_flight=self._in_flight,
+                        scheduled=len(self._wheel),
+                        workers=len(self._workers))
+
+sync_pool = WorkerPool(config.SYNC_WORKERS, config.SYNC_QUEUE_SIZE,
+                       config.RETRY_WHEEL_TICK, config.RETRY_WHEEL_SLOTS)
+
+# Pesan lokal yang sedang antri/di-retry ke master, supaya tidak dikirim dobel
+_master_sync_in_progress = set()
+_master_sync_lock = threading.Lock()
+
+def claim_master_sync(message_id):
+    """Tandai pesan sedang di-sync ke master. False kalau sudah ada yang memegang."""
+    with _master_sync_lock:
+        if message_id in _master_sync_in_progress:
+            return False
+        _master_sync_in_progress.add(message_id)
+        return True
+
+def release_master_sync(message_id):
+    with _master_sync_lock:
+        _master_sync_in_progress.discard(message_id)
+
+def submit_master_sync(message_id, username, message, max_retries=5):
+    """Antrikan sync pesan lokal ke master. False kalau sudah antri atau pool penuh."""
+    if not claim_master_sync(message_id):
+        return False
     
+    if not sync_pool.submit(sync_to_master_with_retry, message_id, username, message, max_retries):
+        release_master_sync(message_id)
+        return False
+    return True
+
+# Database access layer: satu koneksi long-lived per thread
+_db_local = threading.local()
+
+def get_db():
+    """Koneksi SQLite milik thread ini (dibuat sekali lalu dipakai ulang).
+
+    WAL membuat reader tidak memblok writer, synchronous=NORMAL cukup aman
+    di WAL dengan fsync jauh lebih sedikit, dan busy_timeout membuat writer
+    yang bentrok menunggu alih-alih langsung 'database is locked'. Prepared
+    statement di-cache per koneksi oleh modul sqlite3 (cached_statements).
+    """
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(
+            config.DB_PATH,
+            timeout=config.DB_BUSY_TIMEOUT,
+            cached_statements=config.DB_STATEMENT_CACHE_SIZE
+        )
+        # Hanya berlaku untuk database baru (sebelum tabel pertama dibuat)
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT * 1000)}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        _db_local.conn = conn
+    return conn
+
+@app.before_request
+def count_request():
+    metrics.inc('chat_http_requests_total', endpoint=request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.teardown_request
+def rollback_unfinished_transaction(exc):
+    """Koneksi dipakai ulang oleh thread yang sama, jangan tinggalkan transaksi terbuka"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Schema migrations. Versi schema disimpan di PRAGMA user_version dan setiap
+# migration dijalankan tepat sekali, berurutan, dalam transaksinya sendiri.
+def _migration_001_initial_schema(cursor):
     # Tabel messages utama
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS messages (
@@ -54,307 +825,1784 @@ def init_db():
             updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+
+def _migration_002_hot_query_indexes(cursor):
+    # ORDER BY timestamp dan filter ?since=
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+    
+    # Dedup berdasarkan master_id. Buang duplikat lama dulu (simpan baris pertama).
+    cursor.execute('''
+        DELETE FROM messages
+        WHERE master_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM messages WHERE master_id IS NOT NULL GROUP BY master_id
+        )
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_master_id ON messages (master_id)')
+    
+    # periodic_sync_check: pesan lokal yang belum tersinkronisasi
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_origin_status ON messages (origin, sync_status)')
+    
+    # INSERT OR REPLACE ke master_sync_log butuh unique key supaya benar-benar replace
+    cursor.execute('''
+        DELETE FROM master_sync_log
+        WHERE id NOT IN (SELECT MAX(id) FROM master_sync_log GROUP BY message_id)
+    ''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_master_sync_log_message_id ON master_sync_log (message_id)')
+
+def _migration_003_cluster(cursor):
+    # uid = id global pesan; setelah failover master_id tidak lagi cukup untuk dedup
+    cursor.execute('PRAGMA table_info(messages)')
+    if 'uid' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE messages ADD COLUMN uid TEXT')
+    # uid deterministik dari master_id + isi, sama dengan uid pesan ini di master.
+    # Pesan lokal yang belum pernah sampai di master memakai id lokal (unik per slave).
+    cursor.execute('SELECT id, master_id, username, message, timestamp FROM messages WHERE uid IS NULL')
+    cursor.executemany('UPDATE messages SET uid = ? WHERE id = ?', [
+        (legacy_uid(master_id if master_id is not None else f'local:{config.NODE_URL}:{message_id}',
+                    username, message, timestamp), message_id)
+        for message_id, master_id, username, message, timestamp in cursor.fetchall()
+    ])
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_uid ON messages (uid)')
+    
+    # Saat node ini leader: seq (messages.id) tertinggi yang sudah di-apply setiap follower
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS replication_state (
+            peer_url TEXT PRIMARY KEY,
+            acked_seq INTEGER NOT NULL DEFAULT 0,
+            updated_at DATETIME
+        )
+    ''')
+
+def _migration_004_message_stats(cursor):
+    # Counter persist: di-update trigger di transaksi insert/delete yang sama,
+    # jadi /health tidak perlu COUNT(*) atas seluruh history
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO message_stats (name, value)
+        SELECT 'messages', COUNT(*) FROM messages
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_count_insert AFTER INSERT ON messages
+        BEGIN
+            UPDATE message_stats SET value = value + 1 WHERE name = 'messages';
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_count_delete AFTER DELETE ON messages
+        BEGIN
+            UPDATE message_stats SET value = value - 1 WHERE name = 'messages';
+        END
+    ''')
+
+def _migration_005_search_index(cursor):
+    # Index FTS5 external content (teks tetap hanya di messages). Trigger menjaga
+    # index di transaksi yang sama untuk semua jalur insert (lokal, replikasi,
+    # snapshot) dan delete (retention).
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            username, message,
+            content='messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, username, message) VALUES (new.id, new.username, new.message);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, username, message)
+            VALUES ('delete', old.id, old.username, old.message);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF username, message ON messages
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, username, message)
+            VALUES ('delete', old.id, old.username, old.message);
+            INSERT INTO messages_fts (rowid, username, message) VALUES (new.id, new.username, new.message);
+        END
+    ''')
+
+def _migration_006_rooms(cursor):
+    # Pesan lama masuk room default; (room, id) untuk halaman dan catch-up per room
+    cursor.execute('PRAGMA table_info(messages)')
+    if 'room' not in {row[1] for row in cursor.fetchall()}:
+        # ALTER TABLE tidak menerima parameter; nama room sudah divalidasi normalize_room
+        default_room = normalize_room(config.DEFAULT_ROOM)
+        cursor.execute(f"ALTER TABLE messages ADD COLUMN room TEXT NOT NULL DEFAULT '{default_room}'")
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages (room, id)')
+
+MIGRATIONS = [
+    (1, 'initial schema', _migration_001_initial_schema),
+    (2, 'hot query indexes', _migration_002_hot_query_indexes),
+    (3, 'cluster', _migration_003_cluster),
+    (4, 'message stats', _migration_004_message_stats),
+    (5, 'search index', _migration_005_search_index),
+    (6, 'rooms', _migration_006_rooms),
+]
+
+def migrate_db(conn):
+    """Jalankan migration yang belum diterapkan ke database ini"""
+    current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+    
+    for version, name, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            conn.execute('BEGIN')
+            migration(conn.cursor())
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Applied migration {version}: {name}")
+
+# Pesan tertua di-arsip per slice. Pesan lokal yang belum sampai di master tidak
+# pernah diarsip, dan pesan dengan id / master_id tertinggi selalu disimpan supaya
+# posisi catch-up (MAX(master_id)) dan seq replikasi saat leader tidak mundur.
+ARCHIVABLE_MESSAGES_SQL = '''
+    SELECT * FROM messages
+    WHERE timestamp < datetime('now', ?)
+      AND id < (SELECT MAX(id) FROM messages)
+      AND (master_id IS NULL OR master_id < (SELECT MAX(master_id) FROM messages))
+      AND NOT (origin = 'local' AND sync_status != 'synced')
+    ORDER BY timestamp LIMIT ?
+'''
+
+# Full-text search lewat messages_fts. bm25 (rank) dihitung hanya untuk window match
+# terbaru (doclist FTS5 urut rowid, jadi LIMIT berhenti lebih awal), lalu window itu
+# diurutkan relevansi. Tanpa window, kata umum berarti bm25 untuk ratusan ribu row.
+SEARCH_SQL = '''
+    SELECT messages.id, messages.uid, messages.master_id, messages.room, messages.username, messages.message,
+           messages.timestamp, hits.rank
+    FROM (
+        SELECT rowid, rank FROM messages_fts
+        WHERE messages_fts MATCH ?
+        ORDER BY rowid DESC
+        LIMIT ?
+    ) AS hits
+    JOIN messages ON messages.id = hits.rowid
+    {username_filter}
+    ORDER BY hits.rank
+    LIMIT ? OFFSET ?
+'''
+
+# Hot query yang dijaga supaya tidak kembali menjadi full table scan:
+# (nama, sql, contoh parameter, index yang harus muncul di query plan)
+HOT_QUERIES = [
+    ('messages_since_id',
+     'SELECT id, username, message, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?',
+     (0, 1), 'INTEGER PRIMARY KEY'),
+    ('messages_since_timestamp',
+     'SELECT id, username, message, timestamp FROM messages WHERE timestamp > ? ORDER BY +id ASC LIMIT ?',
+     ('', 1), 'idx_messages_timestamp'),
+    ('room_messages_since_id',
+     'SELECT id, username, message, timestamp, uid, room FROM messages '
+     'WHERE room IN (?) AND id > ? ORDER BY id ASC LIMIT ?',
+     ('general', 0, 1), 'idx_messages_room_id'),
+    ('room_messages_latest',
+     'SELECT id, username, message, timestamp, uid, room FROM messages '
+     'WHERE room IN (?) ORDER BY id DESC LIMIT ?',
+     ('general', 1), 'idx_messages_room_id'),
+    ('settle_by_uid',
+     'SELECT id FROM messages WHERE uid = ? AND master_id IS NULL',
+     ('',), 'idx_messages_uid'),
+    ('search_messages',
+     SEARCH_SQL.format(username_filter=''),
+     ('"halo"', 1, 1, 0), 'messages_fts VIRTUAL TABLE'),
+    ('archivable_messages',
+     ARCHIVABLE_MESSAGES_SQL,
+     ('-1 days', 1), 'idx_messages_timestamp'),
+    ('leader_replication_range',
+     'SELECT id, uid, master_id, username, message, timestamp FROM messages WHERE id > ? ORDER BY id ASC LIMIT ?',
+     (0, 1), 'INTEGER PRIMARY KEY'),
+    ('first_unmastered',
+     'SELECT MIN(id) FROM messages WHERE master_id IS NULL',
+     (), 'idx_messages_master_id'),
+    ('max_master_id',
+     'SELECT MAX(master_id) FROM messages',
+     (), 'idx_messages_master_id'),
+    ('unsynced_local_messages',
+     "SELECT id, username, message FROM messages WHERE sync_status IN ('failed', 'pending') "
+     "AND origin = 'local' ORDER BY timestamp ASC LIMIT 10",
+     (), 'idx_messages_origin_status'),
+]
+
+def check_query_plans(conn):
+    """EXPLAIN QUERY PLAN setiap hot query; return daftar query yang regress ke scan"""
+    regressions = []
+    for name, sql, params, expected_index in HOT_QUERIES:
+        plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+        # Scan atas subquery yang sudah di-materialize (hasil ber-LIMIT) bukan table scan
+        materialized = {step.split()[1] for step in plan if step.startswith('MATERIALIZE ')}
+        full_scan = any(step.startswith('SCAN ') and 'INDEX' not in step
+                        and step.split()[1] not in materialized for step in plan)
+        if full_scan or not any(expected_index in step for step in plan):
+            logger.warning(f"Query plan regression for {name}: {plan}")
+            regressions.append((name, plan))
+    return regressions
+
+# Database initialization
+def load_message_count(conn):
+    """Jumlah pesan dari message_stats (O(1), dijaga trigger migration message stats)"""
+    row = conn.execute("SELECT value FROM message_stats WHERE name = 'messages'").fetchone()
+    return row[0] if row else 0
+
+def init_db():
+    conn = get_db()
+    migrate_db(conn)
+    check_query_plans(conn)
+    
+    # Dihitung sekali saat start; setelah itu gauge di-update di setiap perubahan status
+    metrics.set('chat_sync_pending_messages', conn.execute('''
+        SELECT COUNT(*) FROM messages WHERE origin = 'local' AND sync_status != 'synced'
+    ''').fetchone()[0])
+    metrics.set_max('chat_last_seq', conn.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0)
+    metrics.set('chat_messages_stored', load_message_count(conn))
+
+@timed_query('messages_page')
+def get_messages_page(since_id=None, before_id=None, since=None, limit=None, rooms=None):
+    """Ambil satu halaman pesan dengan keyset pagination di atas id (rowid).
+
+    - since_id: pesan dengan id > since_id, urut naik (untuk incremental pull)
+    - before_id: pesan dengan id < before_id, urut turun (halaman lebih lama)
+    - since: filter timestamp > since (memakai idx_messages_timestamp)
+    - rooms: hanya pesan di room ini (idx_messages_room_id)
+    Tanpa cursor, kembalikan halaman terbaru (urut turun).
+    """
+    if limit is None:
+        limit = config.API_PAGE_SIZE
+    limit = max(1, min(limit, config.API_MAX_PAGE_SIZE))
+    
+    clauses = []
+    params = []
+    if rooms:
+        clauses.append(rooms_clause(rooms))
+        params.extend(rooms)
+    if since_id is not None:
+        clauses.append('id > ?')
+        params.append(since_id)
+    if before_id is not None:
+        clauses.append('id < ?')
+        params.append(before_id)
+    if since:
+        clauses.append('timestamp > ?')
+        params.append(since)
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    order = 'DESC' if since_id is None and not since else 'ASC'
+    # Hanya ?since= tanpa cursor id: paksa pakai idx_messages_timestamp (+id mematikan
+    # index rowid untuk ORDER BY), kalau tidak planner memilih scan dari awal tabel
+    order_by = '+id' if since and since_id is None and before_id is None and not rooms else 'id'
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT id, username, message, timestamp, uid, room FROM messages
+        {where}
+        ORDER BY {order_by} {order}
+        LIMIT ?
+    ''', params + [limit])
+    messages = cursor.fetchall()
+    
+    # Cursor berikutnya hanya ada kalau halaman penuh
+    next_cursor = messages[-1][0] if len(messages) == limit else None
+    return messages, next_cursor
+
+# Full-text search (FTS5)
+def fts_query(text):
+    """Ubah input user jadi query FTS5 yang aman.
+
+    Setiap kata di-quote (operator dan tanda baca FTS5 tidak diinterpretasi),
+    semua kata harus ada (AND), dan kata yang diakhiri '*' menjadi prefix search.
+    Return None kalau tidak ada kata sama sekali.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms) or None
+
+@timed_query('search')
+def search_messages(text, username=None, limit=None, offset=0):
+    """Cari pesan lewat messages_fts, urut relevansi (bm25). Return (hasil, next_offset).
+
+    Yang diurutkan hanya SEARCH_RANK_WINDOW match terbaru (diperbesar kalau
+    offset melewatinya), jadi latency tidak tumbuh dengan jumlah match.
+    """
+    match = fts_query(text)
+    if match is None:
+        raise ValueError('Query must contain at least one word')
+    if limit is None:
+        limit = config.SEARCH_PAGE_SIZE
+    limit = max(1, min(limit, config.API_MAX_PAGE_SIZE))
+    offset = max(0, offset)
+    window = max(config.SEARCH_RANK_WINDOW, offset + limit)
+    
+    username_filter = ''
+    params = []
+    if username:
+        # Filter kolom FTS memperkecil window ke pesan user itu; filter exact di luar
+        # membuang user lain yang kebetulan punya token yang sama. Username tanpa
+        # huruf/angka tidak punya token, jadi hanya filter exact.
+        if any(char.isalnum() for char in username):
+            phrase = username.replace('"', '""')
+            match = f'({match}) AND username : "{phrase}"'
+        username_filter = 'WHERE messages.username = ?'
+        params.append(username)
+    
+    cursor = get_db().execute(SEARCH_SQL.format(username_filter=username_filter),
+                              [match, window] + params + [limit, offset])
+    columns = [column[0] for column in cursor.description]
+    results = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return results, (offset + limit if len(results) == limit else None)
+
+def search_data(text, username=None, limit=None, offset=0):
+    """Isi /api/search"""
+    results, next_offset = search_messages(text, username, limit, offset)
+    return {
+        'query': text,
+        'username': username,
+        'results': results,
+        'next_offset': next_offset
+    }
+
+def new_uid():
+    """ID global pesan: UUIDv7 (48 bit unix ms + random) sebagai 32 hex.
+
+    Dibuat saat pesan ditulis dan dibawa ke master/leader dan kembali lewat
+    replikasi, jadi unique index uid menggantikan dedup lewat isi + timestamp.
+    """
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), 'big')
+    value = (value & ~(0xf << 76)) | (0x7 << 76)  # version 7
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)  # variant RFC 4122
+    return f'{value:032x}'
+
+# Pesan dari sebelum ada kolom uid: uid diturunkan dari isi pesan (uuid5), jadi
+# master dan setiap slave memberi uid yang sama untuk pesan historis yang sama
+LEGACY_UID_NAMESPACE = uuid.UUID('0fcd0ee2-c3dd-4ef1-b28d-7d12f8af1ea0')
+
+def legacy_uid(master_id, username, message, timestamp):
+    """uid deterministik untuk pesan lama; master_id = messages.id pesan itu di master"""
+    key = json.dumps([master_id, username, message, str(timestamp)], ensure_ascii=False)
+    return uuid.uuid5(LEGACY_UID_NAMESPACE, key).hex
+
+# Room: setiap pesan milik satu room; read dan replikasi per room lewat idx_messages_room_id
+ROOM_NAME = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+def normalize_room(room):
+    """Nama room yang valid (lowercase); kosong = DEFAULT_ROOM. ValueError kalau tidak valid."""
+    room = (room or '').strip().lower() or config.DEFAULT_ROOM
+    if not ROOM_NAME.match(room):
+        raise ValueError(f"Invalid room name: {room!r}")
+    return room
+
+def parse_rooms(value):
+    """?rooms=a,b -> ['a', 'b']; kosong = semua room (None)"""
+    if not value:
+        return None
+    return sorted({normalize_room(room) for room in value.split(',') if room.strip()}) or None
+
+def rooms_clause(rooms):
+    return f"room IN ({', '.join('?' * len(rooms))})"
+
+def serves_room(room):
+    """True kalau node ini menyimpan room ini (config.ROOMS None = semua room)"""
+    return config.ROOMS is None or room in config.ROOMS
+
+# Replikasi selektif: slice data yang disimpan node ini (room, username, window
+# waktu) didaftarkan ke master, yang lalu hanya mengirim dan melayani slice itu
+def node_replication_filter():
+    """Filter replikasi dari config; nilai None = tanpa batas di dimensi itu"""
+    return {
+        'rooms': config.ROOMS,
+        'authors': config.REPLICATION_AUTHORS,
+        'window_days': config.REPLICATION_WINDOW_DAYS
+    }
+
+def is_partial_replica():
+    return any(value is not None for value in node_replication_filter().values())
+
+def window_start(days):
+    """Batas bawah window waktu, format sama dengan messages.timestamp (UTC)"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+
+def replication_filter_sql(replication_filter):
+    """(klausa, parameter) SQL untuk filter replikasi"""
+    clauses = []
+    params = []
+    if replication_filter['rooms'] is not None:
+        clauses.append(rooms_clause(replication_filter['rooms']))
+        params.extend(replication_filter['rooms'])
+    if replication_filter['authors'] is not None:
+        clauses.append(f"username IN ({', '.join('?' * len(replication_filter['authors']))})")
+        params.extend(replication_filter['authors'])
+    if replication_filter['window_days'] is not None:
+        clauses.append("+timestamp >= datetime('now', ?)")
+        params.append(f"-{replication_filter['window_days']} days")
+    return clauses, params
+
+def subscribed_messages(messages):
+    """Buang pesan dari master/leader di luar filter replikasi node ini.
+
+    Master sudah memfilter setelah filter terdaftar; ini untuk batch yang dikirim
+    sebelum itu, dari master versi lama, atau dari leader hasil failover.
+    """
+    if not is_partial_replica():
+        return messages
+    cutoff = None
+    if config.REPLICATION_WINDOW_DAYS is not None:
+        cutoff = window_start(config.REPLICATION_WINDOW_DAYS)
+    return [msg for msg in messages
+            if serves_room(msg.get('room') or config.DEFAULT_ROOM)
+            and (config.REPLICATION_AUTHORS is None or msg['username'] in config.REPLICATION_AUTHORS)
+            and (cutoff is None or msg.get('timestamp', cutoff) >= cutoff)]
+
+class GroupCommitWriter:
+    """Group commit untuk insert pesan dari request handler.
+
+    Handler tidak commit sendiri: submit() memasukkan insert ke queue dan
+    mengembalikan Future. Satu writer thread mengambil insert yang datang
+    dalam GROUP_COMMIT_WINDOW (maksimal GROUP_COMMIT_MAX_BATCH), menjalankan
+    semuanya dalam satu transaksi lalu commit sekali, jadi burst ratusan
+    post per detik hanya butuh beberapa commit. Id hasil insert dikembalikan
+    ke setiap Future setelah commit.
+    """
+
+    def __init__(self, write_row, after_commit):
+        self._write_row = write_row  # write_row(cursor, *args) -> message_data
+        self._after_commit = after_commit  # after_commit(list message_data), urut id
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._lock = threading.Lock()
+        self._counters = {'rows': 0, 'commits': 0, 'failed': 0, 'max_batch': 0}
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, *args):
+        """Antrikan satu insert. Future.result() = message_data setelah di-commit."""
+        if not self._thread.is_alive():
+            raise RuntimeError('GroupCommitWriter is not started')
+        future = Future()
+        self._queue.put((future, args))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + config.GROUP_COMMIT_WINDOW
+            while len(batch) < config.GROUP_COMMIT_MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except Empty:
+                    break
+            
+            if not self._commit(batch) and len(batch) > 1:
+                # Satu insert yang gagal tidak boleh menggagalkan insert lain di batch
+                for item in batch:
+                    self._commit([item])
+
+    def _commit(self, batch):
+        conn = get_db()
+        cursor = conn.cursor()
+        try:
+            with metrics.timed('chat_db_query_seconds', query='group_commit'):
+                results = [self._write_row(cursor, *args) for _, args in batch]
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            if len(batch) == 1:
+                self._count(failed=1)
+                batch[0][0].set_exception(e)
+            return False
+        
+        self._count(rows=len(batch), commits=1, max_batch=len(batch))
+        try:
+            self._after_commit(results)
+        except Exception as e:
+            logger.error(f"After-commit hook failed: {str(e)}")
+        for (future, _), result in zip(batch, results):
+            future.set_result(result)
+        return True
+
+    def _count(self, rows=0, commits=0, failed=0, max_batch=0):
+        with self._lock:
+            self._counters['rows'] += rows
+            self._counters['commits'] += commits
+            self._counters['failed'] += failed
+            self._counters['max_batch'] = max(self._counters['max_batch'], max_batch)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, queued=self._queue.qsize())
+        stats['rows_per_commit'] = round(stats['rows'] / stats['commits'], 2) if stats['commits'] else 0.0
+        return stats
+
+def write_local_message(cursor, username, message, room):
+    """Insert satu pesan lokal (status pending) di dalam transaksi group commit"""
+    cursor.execute('''
+        INSERT INTO messages (username, message, origin, uid, room) 
+        VALUES (?, ?, 'local', ?, ?)
+        RETURNING id, timestamp
+    ''', (username, message, new_uid(), room))
+    message_id, timestamp = cursor.fetchone()
+    return {
+        'id': message_id,
+        'room': room,
+        'username': username,
+        'message': message,
+        'timestamp': timestamp
+    }
+
+def publish_local_messages(batch):
+    # Push ke browser yang sedang subscribe /api/stream
+    for message_data in batch:
+        message_hub.publish(message_data)
+    record_inserted('local', batch)
+    metrics.inc('chat_sync_pending_messages', len(batch))
+
+message_writer = GroupCommitWriter(write_local_message, publish_local_messages)
+
+def local_room(room):
+    """Room untuk pesan lokal; ValueError kalau node ini tidak menyimpan room itu"""
+    room = normalize_room(room)
+    if not serves_room(room):
+        raise ValueError(f"Room {room!r} is not served by this node")
+    return room
+
+def store_local_message(username, message, room=None):
+    """Simpan pesan lokal lewat group commit dan push ke /api/stream. Return id."""
+    return message_writer.submit(username, message, local_room(room)).result()['id']
+
+def add_message(username, message, room=None):
+    message_id = store_local_message(username, message, room)
+    
+    # Sync ke master lewat worker pool. Kalau pool penuh pesan tetap 'pending'
+    # dan akan diambil oleh periodic_sync_check.
+    if not submit_master_sync(message_id, username, message):
+        logger.warning(f"Sync queue full, message {message_id} deferred to periodic sync")
+    return message_id
+
+def is_master_synced(message_id):
+    """True kalau pesan sudah tersinkronisasi (atau sudah tidak ada)"""
+    cursor = get_db().cursor()
+    cursor.execute('SELECT sync_status FROM messages WHERE id = ?', (message_id,))
+    result = cursor.fetchone()
+    return result is None or result[0] == 'synced'
+
+def get_outgoing_message(message_id):
+    """(uid, timestamp, room) pesan lokal yang belum tersinkronisasi, None kalau sudah"""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT uid, timestamp, room FROM messages WHERE id = ? AND sync_status != 'synced'
+    ''', (message_id,))
+    return cursor.fetchone()
+
+def leader_sync_request(uid, username, message, timestamp, room):
+    """(url, json body) untuk mengirim satu pesan lokal ke leader sekarang"""
+    if cluster.leader_url == config.MASTER_SERVER:
+        return f"{config.MASTER_SERVER}/sync_message", {
+            'username': username,
+            'message': message,
+            'room': room,
+            'uid': uid,
+            'timestamp': datetime.now().isoformat()
+        }
+    # Slave yang dipromosikan menerima pesan follower sebagai batch
+    return f"{cluster.leader_url}/peer/sync_messages", {'messages': [{
+        'uid': uid,
+        'room': room,
+        'username': username,
+        'message': message,
+        'timestamp': timestamp
+    }]}
+
+@timed_query('sync_ack')
+def record_master_sync_success(message_id, master_id, attempt):
+    # Update status sync sebagai success. master_id dicatat supaya pesan ini
+    # tidak masuk dua kali saat kembali lewat replikasi/catch-up dari master.
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE messages SET sync_status = 'synced', master_id = ? WHERE id = ? AND sync_status != 'synced'
+    ''', (master_id, message_id))
+    settled = cursor.rowcount
+    
+    cursor.execute('''
+        INSERT OR REPLACE INTO master_sync_log 
+        (message_id, sync_status, attempts, last_attempt)
+        VALUES (?, 'success', ?, ?)
+    ''', (message_id, attempt + 1, datetime.now()))
+    
+    conn.commit()
+    metrics.inc('chat_sync_pending_messages', -settled)
+
+def record_master_sync_failure(message_id, attempt):
+    # Record failed attempt
+    conn = get_db()
+    conn.execute('''
+        INSERT OR REPLACE INTO master_sync_log 
+        (message_id, sync_status, attempts, last_attempt)
+        VALUES (?, 'failed', ?, ?)
+    ''', (message_id, attempt + 1, datetime.now()))
+    conn.commit()
+    metrics.inc('chat_sync_retries_total')
+
+def mark_master_sync_failed(message_id):
+    # Semua attempt gagal
+    conn = get_db()
+    conn.execute('''
+        UPDATE messages SET sync_status = 'failed' WHERE id = ?
+    ''', (message_id,))
+    conn.commit()
+    metrics.inc('chat_sync_gave_up_total')
+
+def sync_to_master_with_retry(message_id, username, message, max_retries=5, attempt=0):
+    """Satu attempt sync ke master; kalau gagal, attempt berikutnya dijadwalkan
+    lewat timer wheel dengan exponential backoff (worker tidak ikut tidur).
+
+    Claim pesan (claim_master_sync) dilepas di setiap jalan keluar selain retry,
+    termasuk exception, supaya periodic_sync_check bisa mengirimnya lagi.
+    """
+    retry_scheduled = False
+    try:
+        # Bisa saja sudah tersinkronisasi oleh job lain sejak dijadwalkan
+        outgoing = get_outgoing_message(message_id)
+        if outgoing is None:
+            return True
+        
+        if cluster.is_leader:
+            # Node ini leader: pesan sudah ada di log leader, replicator yang mengirimnya
+            record_master_sync_success(message_id, None, attempt)
+            notify_follower_replicators()
+            return True
+        if not is_master_online():
+            # Leader belum ada/offline: tetap 'pending' (bukan menghabiskan retry),
+            # periodic_sync_check mengirimnya begitu leader online lagi
+            return False
+        
+        try:
+            url, payload = leader_sync_request(outgoing[0], username, message, outgoing[1], outgoing[2])
+            # uid sebagai idempotency key: retry setelah timeout tidak membuat duplikat di master
+            response = peer_client.post(url, json=payload, headers={'Idempotency-Key': outgoing[0]})
+            if response.status_code == 409:
+                observe_leader(response.json())
+            response.raise_for_status()
+            record_master_sync_success(message_id, response.json().get('master_id'), attempt)
+            
+            logger.info(f"Successfully synced message {message_id} to master")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Sync attempt {attempt + 1} failed: {str(e)}")
+            record_master_sync_failure(message_id, attempt)
+        
+        if attempt < max_retries - 1:
+            # Exponential backoff; retry yang dibuang karena queue penuh melepas claim
+            retry_delay = (2 ** attempt) * 5  # 5, 10, 20, 40, 80 seconds
+            logger.info(f"Retrying message {message_id} in {retry_delay} seconds...")
+            sync_pool.schedule(retry_delay, sync_to_master_with_retry,
+                               message_id, username, message, max_retries, attempt + 1,
+                               on_drop=lambda: release_master_sync(message_id))
+            retry_scheduled = True
+            return False
+        
+        mark_master_sync_failed(message_id)
+        logger.error(f"Failed to sync message {message_id} after {max_retries} attempts")
+        return False
+    finally:
+        if not retry_scheduled:
+            release_master_sync(message_id)
+
+@timed_query('claim_unsynced')
+def claim_unsynced_messages(limit=10):
+    """Ambil pesan lokal yang belum tersinkronisasi dan reset yang 'failed' ke 'pending'"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, username, message 
+        FROM messages 
+        WHERE sync_status IN ('failed', 'pending')
+        AND origin = 'local'
+        ORDER BY timestamp ASC
+        LIMIT ?
+    ''', (limit,))
+    
+    failed_messages = cursor.fetchall()
+    
+    if failed_messages:
+        logger.info(f"Found {len(failed_messages)} unsynced messages, attempting to sync...")
+        
+        # Reset status ke pending
+        cursor.executemany('''
+            UPDATE messages SET sync_status = 'pending'
+            WHERE id = ? AND sync_status = 'failed'
+        ''', [(msg_id,) for msg_id, _, _ in failed_messages])
+        conn.commit()
+    return failed_messages
+
+def periodic_sync_check():
+    """Periodic check untuk sync pesan yang gagal"""
+    while True:
+        try:
+            # Check jika master (leader) online
+            if is_master_online():
+                # Ambil pesan yang belum tersinkronisasi
+                for msg_id, username, message in claim_unsynced_messages():
+                    # Pesan yang masih antri/di-retry di worker pool dilewati
+                    submit_master_sync(msg_id, username, message, 3)
+                
+                # Sync messages dari master yang mungkin terlewat
+                # (leader hasil failover mengirim sendiri lewat replicator)
+                if is_following_master():
+                    sync_missing_messages_from_master()
+            
+        except Exception as e:
+            logger.error(f"Error in periodic sync check: {str(e)}")
+            get_db().rollback()
+        
+        time.sleep(config.SYNC_INTERVAL)
+
+def is_master_online():
+    """Status leader (master, atau slave yang dipromosikan) dari cache health_tracker"""
+    if cluster.is_leader:
+        return True
+    return cluster.leader_url is not None and health_tracker.is_online(cluster.leader_url)
+
+def is_following_master():
+    """Term 0: leader masih master dari config, catch-up lewat /api/messages master"""
+    return cluster.leader_url == config.MASTER_SERVER
+
+def get_master_high_water():
+    """Cursor catch-up = master_id tertinggi yang sudah ada di slave"""
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT MAX(master_id) FROM messages
+    ''')
+    result = cursor.fetchone()
+    return result[0] if result[0] else 0
+
+@timed_query('catch_up_page')
+def apply_master_messages(master_messages):
+    """Simpan satu halaman /api/messages dari master. Return (inserted, skipped).
+
+    Set-based: halaman dimuat ke temp table dengan executemany lalu di-apply
+    dengan satu INSERT...SELECT dalam satu transaksi. Dedup lewat unique index
+    master_id dan uid (ON CONFLICT DO NOTHING). Pesan lokal yang sudah sampai
+    di master tapi ack-nya hilang (timeout) dikenali lewat uid dan langsung
+    ditandai synced, jadi tidak dikirim ulang.
+    """
+    subscribed = subscribed_messages(master_messages)
+    if not subscribed:
+        return 0, len(master_messages)
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS master_batch (
+                master_id INTEGER PRIMARY KEY,
+                username TEXT NOT NULL,
+                message TEXT NOT NULL,
+                timestamp DATETIME NOT NULL,
+                uid TEXT,
+                room TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('DELETE FROM temp.master_batch')
+        cursor.executemany('''
+            INSERT OR IGNORE INTO temp.master_batch (master_id, username, message, timestamp, uid, room)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(msg['id'], msg['username'], msg['message'], msg['timestamp'], msg.get('uid'),
+               msg.get('room') or config.DEFAULT_ROOM)
+              for msg in subscribed])
+        
+        cursor.execute('''
+            UPDATE messages SET master_id = b.master_id, sync_status = 'synced'
+            FROM temp.master_batch b
+            WHERE messages.uid = b.uid AND messages.master_id IS NULL
+              AND messages.sync_status != 'synced'
+        ''')
+        settled = cursor.rowcount
+        cursor.execute('''
+            INSERT INTO messages (username, message, timestamp, master_id, origin, sync_status, uid, room)
+            SELECT b.username, b.message, b.timestamp, b.master_id, 'master', 'synced',
+                   coalesce(b.uid, lower(hex(randomblob(16)))), b.room
+            FROM temp.master_batch b
+            WHERE true
+            ORDER BY b.master_id
+            ON CONFLICT DO NOTHING
+            RETURNING id, username, message, timestamp, room
+        ''')
+        inserted = [{
+            'id': row[0],
+            'room': row[4],
+            'username': row[1],
+            'message': row[2],
+            'timestamp': row[3]
+        } for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM temp.master_batch')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    # Push setelah commit supaya client tidak melihat pesan yang belum tersimpan
+    inserted.sort(key=lambda message_data: message_data['id'])
+    for message_data in inserted:
+        message_hub.publish(message_data)
+    record_inserted('master', inserted)
+    metrics.inc('chat_sync_pending_messages', -settled)
+    return len(inserted), len(master_messages) - len(inserted)
+
+# Hasil catch-up terakhir (dilaporkan di /api/sync_status)
+last_catch_up = None
+
+def record_catch_up(inserted, skipped, elapsed):
+    global last_catch_up
+    last_catch_up = {
+        'inserted': inserted,
+        'skipped': skipped,
+        'elapsed_ms': round(elapsed * 1000, 1),
+        'finished_at': datetime.now().isoformat()
+    }
+    if inserted > 0:
+        logger.info(f"Synced {inserted} new messages from master "
+                    f"({skipped} skipped) in {elapsed:.3f}s")
+
+def record_last_master_sync():
+    # Update timestamp terakhir sync
+    conn = get_db()
+    conn.execute('''
+        INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
+        VALUES ('last_master_sync', ?, ?)
+    ''', (datetime.now().isoformat(), datetime.now()))
+    conn.commit()
+
+# ETag halaman terakhir /api/messages dari master; selama master belum punya
+# pesan baru, poll berikutnya dijawab 304 tanpa body
+master_messages_etag = None
+
+def should_bootstrap_from_snapshot(since_id, last_seq):
+    """Tertinggal >= SNAPSHOT_BOOTSTRAP_LAG pesan: salin snapshot, bukan paging /api/messages.
+    last_seq = X-Last-Seq master untuk slice yang sama dengan since_id (catch_up_params)"""
+    return last_seq is not None and int(last_seq) - since_id >= config.SNAPSHOT_BOOTSTRAP_LAG
+
+def get_snapshot_seq():
+    cursor = get_db().cursor()
+    cursor.execute("SELECT value FROM sync_metadata WHERE key = 'snapshot_seq'")
+    result = cursor.fetchone()
+    return int(result[0]) if result else 0
+
+@timed_query('apply_snapshot')
+def apply_snapshot(path, seq, expected_size=None):
+    """Salin pesan dari file snapshot master dengan satu INSERT...SELECT (satu transaksi).
+
+    Biayanya sebanding dengan ukuran file, bukan jumlah round trip per pesan.
+    Pesan yang sudah ada (master_id atau uid sama) dilewati oleh unique index.
+    Seperti apply_master_messages, pesan lokal yang sudah sampai di master tapi
+    ack-nya hilang dikenali lewat uid dan ditandai synced lebih dulu.
+    """
+    size = os.path.getsize(path)
+    if expected_size is not None and size != int(expected_size):
+        raise IOError(f"Incomplete snapshot: {size} of {expected_size} bytes")
+    
+    started = time.monotonic()
+    # Master memfilter snapshot per slice (slice_params), tapi master lama mengirim
+    # semua pesan, jadi slice node ini tetap dipilih saat INSERT...SELECT
+    clauses, params = replication_filter_sql(node_replication_filter())
+    slice_filter = ''.join(f' AND {clause}' for clause in clauses)
+    conn = get_db()
+    conn.execute('ATTACH DATABASE ? AS snapshot', (path,))
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE messages SET master_id = s.id, sync_status = 'synced'
+            FROM (SELECT id, uid FROM snapshot.messages WHERE id <= ?) AS s
+            WHERE messages.uid = s.uid AND messages.master_id IS NULL
+              AND messages.sync_status != 'synced'
+        ''', (seq,))
+        settled = cursor.rowcount
+        cursor.execute(f'''
+            INSERT INTO messages (username, message, timestamp, master_id, origin, sync_status, uid, room)
+            SELECT username, message, timestamp, id, 'master', 'synced', uid, room
+            FROM snapshot.messages
+            WHERE id <= ?{slice_filter}
+            ORDER BY id
+            ON CONFLICT DO NOTHING
+        ''', [seq] + params)
+        inserted = cursor.rowcount
+        
+        # High-water mark: semua pesan master <= seq sudah ada di slave
+        cursor.execute('''
+            INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
+            VALUES ('snapshot_seq', ?, ?)
+        ''', (str(seq), datetime.now()))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute('DETACH DATABASE snapshot')
+    
+    # History masuk tanpa lewat message_hub (bisa ratusan ribu pesan), jadi versi
+    # pesan di-bump langsung supaya render cache dan ETag ikut berubah
+    render_cache.bump()
+    metrics.set('chat_messages_stored', load_message_count(conn))
+    metrics.set_max('chat_last_seq', get_last_id())
+    metrics.inc('chat_sync_pending_messages', -settled)
+    logger.info(f"Loaded snapshot at seq {seq}: {inserted} messages, {size} bytes "
+                f"in {time.monotonic() - started:.2f}s")
+    return inserted
+
+def bootstrap_from_snapshot():
+    """Download snapshot master per chunk lalu muat. Return seq snapshot."""
+    path = f"{config.DB_PATH}.snapshot"
+    try:
+        response = peer_client.get(f"{config.MASTER_SERVER}/api/snapshot", params=slice_params(), stream=True)
+        try:
+            response.raise_for_status()
+            seq = int(response.headers['X-Snapshot-Seq'])
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(config.SNAPSHOT_CHUNK_SIZE):
+                    f.write(chunk)
+        finally:
+            response.close()
+        
+        apply_snapshot(path, seq, response.headers.get('Content-Length'))
+    finally:
+        # Juga download yang gagal/terputus: jangan tinggalkan file setengah jadi
+        if os.path.exists(path):
+            os.remove(path)
+    return seq
+
+def catch_up_params(since_id):
+    """Query /api/messages master untuk catch-up: master hanya mengembalikan slice node ini"""
+    return dict(slice_params(), since_id=since_id, limit=config.API_MAX_PAGE_SIZE)
+
+def slice_params():
+    """Query slice node ini untuk /api/messages dan /api/snapshot master (kosong = semua pesan)"""
+    params = {}
+    if config.ROOMS is not None:
+        params['rooms'] = ','.join(config.ROOMS)
+    if config.REPLICATION_AUTHORS is not None:
+        params['authors'] = ','.join(config.REPLICATION_AUTHORS)
+    if config.REPLICATION_WINDOW_DAYS is not None:
+        params['since'] = window_start(config.REPLICATION_WINDOW_DAYS)
+    return params
+
+# Filter replikasi sudah didaftarkan ke master sejak master terakhir terlihat online
+replication_filter_registered = False
+
+def replication_filter_request():
+    """(url, json body) POST /replication/filter master"""
+    return f"{config.MASTER_SERVER}/replication/filter", dict(node_replication_filter(),
+                                                             slave_url=config.NODE_URL)
+
+def record_replication_filter_response(response):
+    global replication_filter_registered
+    # Hanya error koneksi yang di-retry; penolakan master (mis. versi lama) tidak berubah dengan retry
+    replication_filter_registered = True
+    if response.status_code != 200:
+        logger.warning(f"Master rejected replication filter ({response.status_code}), "
+                       f"filtering replicated messages locally")
+
+def register_replication_filter():
+    """Daftarkan filter replikasi node ini ke master (juga filter kosong = semua pesan)"""
+    if replication_filter_registered:
+        return
+    url, payload = replication_filter_request()
+    record_replication_filter_response(peer_client.post(url, json=payload))
+
+def sync_missing_messages_from_master():
+    """Sync pesan dari master yang mungkin terlewat saat offline"""
+    global master_messages_etag
+    try:
+        register_replication_filter()
+        started = time.monotonic()
+        since_id = get_master_high_water()
+        new_messages = skipped_messages = 0
+        headers = {'Accept': wire_accept_header()}
+        if master_messages_etag:
+            headers['If-None-Match'] = master_messages_etag
+
+        # Tarik per halaman sampai master tidak punya pesan baru lagi
+        while True:
+            response = peer_client.get(
+                f"{config.MASTER_SERVER}/api/messages",
+                params=catch_up_params(since_id),
+                headers=headers
+            )
+            if response.status_code != 200:
+                break
+
+            next_cursor = response.headers.get('X-Next-Cursor')
+            if next_cursor and should_bootstrap_from_snapshot(since_id, response.headers.get('X-Last-Seq')):
+                since_id = bootstrap_from_snapshot()
+                headers.pop('If-None-Match', None)
+                continue
+
+            # Gzip sudah di-decode oleh requests, tinggal format kolumnar/msgpack
+            inserted, skipped = apply_master_messages(decode_wire(response.content, response.headers.get('Content-Type')))
+            new_messages += inserted
+            skipped_messages += skipped
+
+            if not next_cursor:
+                # Semua pesan sampai versi ini sudah di-apply
+                master_messages_etag = response.headers.get('ETag')
+                break
+            since_id = int(next_cursor)
+            headers.pop('If-None-Match', None)
+
+        record_catch_up(new_messages, skipped_messages, time.monotonic() - started)
+        if new_messages > 0:
+            record_last_master_sync()
+
+    except Exception as e:
+        logger.error(f"Error syncing from master: {str(e)}")
+        get_db().rollback()
+
+# Failover: term-based leader election antar slave
+class StaleLeader(Exception):
+    """Request dari/ke node yang bukan leader term sekarang (dijawab 409 + state cluster)"""
+
+class ClusterState:
+    """Term dan leader cluster menurut node ini.
+
+    Term 0 = master dari config. Setiap election menaikkan term, vote hanya
+    diberikan sekali per term dan node selalu ikut term tertinggi yang
+    dilihatnya, jadi paling banyak ada satu leader per term. Disimpan di
+    sync_metadata supaya restart tidak membuat node memberi vote dua kali.
+    """
+
+    def __init__(self):
+        self.term = 0
+        self.leader_url = config.MASTER_SERVER
+        self.voted_for = None
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """callback(term, leader_url) dipanggil setiap leader berganti"""
+        self._listeners.append(callback)
+
+    @property
+    def is_leader(self):
+        return self.leader_url == config.NODE_URL
+
+    @property
+    def quorum(self):
+        return (len(config.CLUSTER_NODES) + 1) // 2 + 1
+
+    def load(self):
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT key, value FROM sync_metadata
+            WHERE key IN ('cluster_term', 'cluster_leader', 'cluster_voted_for')
+        ''')
+        state = dict(cursor.fetchall())
+        self.term = int(state.get('cluster_term', 0))
+        self.leader_url = state.get('cluster_leader', config.MASTER_SERVER) or None
+        self.voted_for = state.get('cluster_voted_for') or None
+
+    def _save(self):
+        now = datetime.now()
+        conn = get_db()
+        conn.executemany('''
+            INSERT OR REPLACE INTO sync_metadata (key, value, updated_at) VALUES (?, ?, ?)
+        ''', [('cluster_term', str(self.term), now),
+              ('cluster_leader', self.leader_url or '', now),
+              ('cluster_voted_for', self.voted_for or '', now)])
+        conn.commit()
+
+    def _notify(self, term, leader_url):
+        logger.warning(f"Term {term}: leader is now {leader_url}")
+        for callback in self._listeners:
+            try:
+                callback(term, leader_url)
+            except Exception as e:
+                logger.error(f"Cluster listener failed: {str(e)}")
+
+    def observe(self, term, leader_url):
+        """Term/leader yang dilaporkan node lain. False kalau term-nya basi."""
+        with self._lock:
+            if term < self.term:
+                return False
+            changed = bool(leader_url) and leader_url != self.leader_url
+            if term == self.term and not changed:
+                return True
+            if self.is_leader and leader_url != config.NODE_URL:
+                # Turun dari leader: posisi log term itu tetap dihitung saat vote berikutnya
+                record_log_position(self.term, get_last_id())
+            if term > self.term:
+                self.voted_for = None
+            self.term = term
+            self.leader_url = leader_url or None
+            self._save()
+        if changed:
+            self._notify(term, leader_url)
+        return True
+
+    def start_election(self):
+        """Naikkan term dan vote diri sendiri. Return term baru."""
+        with self._lock:
+            self.term += 1
+            self.voted_for = config.NODE_URL
+            self.leader_url = None
+            self._save()
+            return self.term
+
+    def grant_vote(self, term, candidate_url, up_to_date):
+        with self._lock:
+            if term < self.term:
+                return False
+            if term > self.term:
+                self.term = term
+                self.voted_for = None
+                self.leader_url = None
+            granted = up_to_date and self.voted_for in (None, candidate_url)
+            if granted:
+                self.voted_for = candidate_url
+            self._save()
+            return granted
+
+    def become_leader(self, term):
+        with self._lock:
+            if term != self.term or self.leader_url is not None:
+                return False
+            self.leader_url = config.NODE_URL
+            self._save()
+        self._notify(term, config.NODE_URL)
+        return True
+
+    def snapshot(self):
+        if self.is_leader:
+            role = 'leader'
+        elif self.leader_url is None:
+            role = 'candidate'
+        else:
+            role = 'follower'
+        return {
+            'term': self.term,
+            'leader': self.leader_url,
+            'role': role,
+            'voted_for': self.voted_for,
+            'node_url': config.NODE_URL
+        }
+
+cluster = ClusterState()
+
+def on_master_health_change(peer_url, online):
+    """Dipanggil health_tracker saat status master/leader (atau node cluster lain) berubah"""
+    global replication_filter_registered
+    if cluster.is_leader:
+        # Follower yang online lagi langsung dikejar dari acked_seq-nya
+        if online and peer_url in follower_replicators:
+            follower_replicators[peer_url].notify()
+        return
+    if peer_url != cluster.leader_url:
+        return
     
-    conn.commit()
-    conn.close()
+    if online:
+        logger.info("Master server is back online! Triggering sync...")
+        if peer_url == config.MASTER_SERVER:
+            # Master bisa saja kehilangan filter (database baru): daftarkan ulang
+            replication_filter_registered = False
+            # Trigger immediate sync
+            sync_pool.submit(sync_missing_messages_from_master)
+    else:
+        logger.warning("Master server is offline")
+        if config.FAILOVER_ENABLED:
+            schedule_election()
 
-def get_messages():
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, message, timestamp FROM messages ORDER BY timestamp DESC')
-    messages = cursor.fetchall()
-    conn.close()
-    return messages
+def receive_master_message(data):
+    """Simpan satu pesan yang di-push master (dedup lewat master_id/uid)"""
+    if insert_replicated_messages(subscribed_messages([data]), 'master'):
+        logger.info(f"Received message from master: {data.get('master_id')}")
+    return {'status': 'success'}
+
+@timed_query('replicated_batch')
+def insert_replicated_messages(messages, origin):
+    """Simpan pesan dari node lain dalam satu transaksi. Return pesan yang baru.
 
-def add_message(username, message):
-    conn = sqlite3.connect(config.DB_PATH)
+    Dedup lewat unique index: master_id (pesan dari master) atau uid
+    (pesan yang lewat leader hasil failover).
+    """
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO messages (username, message, origin) 
-        VALUES (?, ?, 'local')
-    ''', (username, message))
-    message_id = cursor.lastrowid
+    inserted = []
+    for msg in messages:
+        timestamp = msg.get('timestamp', datetime.now().isoformat())
+        room = msg.get('room') or config.DEFAULT_ROOM
+        cursor.execute('''
+            INSERT INTO messages (username, message, timestamp, master_id, origin, sync_status, uid, room)
+            VALUES (?, ?, ?, ?, ?, 'synced', ?, ?)
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        ''', (msg['username'], msg['message'], timestamp, msg.get('master_id'), origin,
+              msg.get('uid') or new_uid(), room))
+        row = cursor.fetchone()
+        if row is not None:
+            inserted.append({
+                'id': row[0],
+                'room': room,
+                'username': msg['username'],
+                'message': msg['message'],
+                'timestamp': timestamp
+            })
     conn.commit()
-    conn.close()
     
-    # Sync ke master dengan retry mechanism
-    threading.Thread(target=sync_to_master_with_retry, args=(message_id, username, message)).start()
-    return message_id
+    for message_data in inserted:
+        message_hub.publish(message_data)
+    record_inserted(origin, inserted)
+    return inserted
 
-def sync_to_master_with_retry(message_id, username, message, max_retries=5):
-    """Sync ke master dengan retry dan exponential backoff"""
-    conn = sqlite3.connect(config.DB_PATH)
-    cursor = conn.cursor()
+def receive_master_batch(data):
+    """Simpan batch dari master (atau leader hasil failover). Return body response + acked_seq."""
+    # Batch dari leader term lama (mis. master yang baru hidup lagi) ditolak
+    term = data.get('term', 0)
+    if not cluster.observe(term, data.get('leader', config.MASTER_SERVER)):
+        raise StaleLeader()
     
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(
-                f"{config.MASTER_SERVER}/sync_message",
-                json={
-                    'username': username,
-                    'message': message,
-                    'slave_id': message_id,
-                    'timestamp': datetime.now().isoformat()
-                },
-                timeout=config.SYNC_TIMEOUT
-            )
-            
-            if response.status_code == 200:
-                # Update status sync sebagai success
-                cursor.execute('''
-                    UPDATE messages SET sync_status = 'synced' WHERE id = ?
-                ''', (message_id,))
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO master_sync_log 
-                    (message_id, sync_status, attempts, last_attempt)
-                    VALUES (?, 'success', ?, ?)
-                ''', (message_id, attempt + 1, datetime.now()))
-                
-                conn.commit()
-                conn.close()
-                
-                logger.info(f"Successfully synced message {message_id} to master")
-                return True
-                
-        except Exception as e:
-            logger.error(f"Sync attempt {attempt + 1} failed: {str(e)}")
-            
-            # Record failed attempt
-            cursor.execute('''
-                INSERT OR REPLACE INTO master_sync_log 
-                (message_id, sync_status, attempts, last_attempt)
-                VALUES (?, 'failed', ?, ?)
-            ''', (message_id, attempt + 1, datetime.now()))
-            conn.commit()
-            
-            if attempt < max_retries - 1:
-                # Exponential backoff
-                sleep_time = (2 ** attempt) * 5  # 5, 10, 20, 40, 80 seconds
-                logger.info(f"Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
+    messages = data['messages']
+    inserted = insert_replicated_messages(subscribed_messages(messages), 'master')
+    if inserted:
+        logger.info(f"Received {len(inserted)} messages from master in one batch")
     
-    # Semua attempt gagal
-    cursor.execute('''
-        UPDATE messages SET sync_status = 'failed' WHERE id = ?
-    ''', (message_id,))
-    conn.commit()
-    conn.close()
+    # Acknowledge seq tertinggi yang sudah di-apply (batch sudah di-commit).
+    # Setelah bootstrap, semua pesan <= snapshot_seq sudah ada: master bisa lompat ke sana.
+    acked_seq = data.get('seq_end')
+    if acked_seq is None:
+        acked_seq = max((msg['master_id'] for msg in messages), default=None)
+    if term > 0:
+        record_log_position(term, acked_seq)
+    else:
+        snapshot_seq = get_snapshot_seq()
+        if acked_seq is not None and snapshot_seq > acked_seq:
+            acked_seq = snapshot_seq
+    return {
+        'status': 'success',
+        'received': len(messages),
+        'inserted': len(inserted),
+        'acked_seq': acked_seq
+    }
+
+def ingest_follower_batch(data):
+    """Leader hasil failover: simpan pesan dari follower (slave lain atau master lama)"""
+    if not cluster.is_leader:
+        raise StaleLeader()
     
-    logger.error(f"Failed to sync message {message_id} after {max_retries} attempts")
-    return False
+    messages = data['messages']
+    inserted = insert_replicated_messages(messages, 'peer')
+    if inserted:
+        logger.info(f"Ingested {len(inserted)} messages from followers")
+        notify_follower_replicators()
+    return {
+        'status': 'success',
+        'received': len(messages),
+        'inserted': len(inserted),
+        'acked_seq': data.get('seq_end')
+    }
 
-def periodic_sync_check():
-    """Periodic check untuk sync pesan yang gagal"""
-    while True:
-        try:
-            conn = sqlite3.connect(config.DB_PATH)
-            cursor = conn.cursor()
-            
-            # Check jika master online
-            if is_master_online():
-                # Ambil pesan yang belum tersinkronisasi
-                cursor.execute('''
-                    SELECT id, username, message 
-                    FROM messages 
-                    WHERE sync_status = 'failed' OR sync_status = 'pending'
-                    AND origin = 'local'
-                    ORDER BY timestamp ASC
-                    LIMIT 10
-                ''')
-                
-                failed_messages = cursor.fetchall()
-                
-                if failed_messages:
-                    logger.info(f"Found {len(failed_messages)} unsynced messages, attempting to sync...")
-                    
-                    for msg_id, username, message in failed_messages:
-                        # Reset status ke pending
-                        cursor.execute('''
-                            UPDATE messages SET sync_status = 'pending' WHERE id = ?
-                        ''', (msg_id,))
-                        conn.commit()
-                        
-                        # Attempt sync
-                        threading.Thread(target=sync_to_master_with_retry, 
-                                       args=(msg_id, username, message, 3)).start()
-                        
-                        time.sleep(1)  # Delay antar sync
-                
-                # Sync messages dari master yang mungkin terlewat
-                sync_missing_messages_from_master()
-            
-            conn.close()
+def get_last_id():
+    cursor = get_db().cursor()
+    cursor.execute('SELECT MAX(id) FROM messages')
+    return cursor.fetchone()[0] or 0
+
+def record_log_position(term, seq):
+    conn = get_db()
+    conn.execute('''
+        INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
+        VALUES ('leader_position', ?, ?)
+    ''', (f'{term}:{seq}', datetime.now()))
+    conn.commit()
+
+def log_position():
+    """Posisi log node ini untuk aturan vote: [term, seq] terakhir dari leader.
+
+    Di term 0 seq = master_id tertinggi. Candidate hanya dapat vote kalau
+    posisinya >= posisi voter, jadi pesan yang sudah sampai di mayoritas
+    follower selalu ada di leader baru.
+    """
+    if cluster.is_leader:
+        return [cluster.term, get_last_id()]
+    cursor = get_db().cursor()
+    cursor.execute("SELECT value FROM sync_metadata WHERE key = 'leader_position'")
+    result = cursor.fetchone()
+    if result:
+        return [int(part) for part in result[0].split(':')]
+    return [0, get_master_high_water()]
+
+def observe_leader(data):
+    """Node lain menjawab 409: ikuti term/leader yang dilaporkannya"""
+    if 'term' in data:
+        cluster.observe(data['term'], data.get('leader'))
+
+class FollowerReplicator:
+    """Replikasi dari node ini (saat menjadi leader) ke satu follower.
+
+    Sama seperti SlaveReplicator di master: posisi follower = acked_seq
+    (messages.id di leader) di replication_state, dikirim per batch ke
+    /sync_messages follower bersama term dan URL leader. Hanya aktif
+    selama node ini leader.
+    """
+
+    def __init__(self, peer_url):
+        self.peer_url = peer_url
+        self.acked_seq = None
+        self.last_ack_at = None
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        failures = 0
+        while True:
+            if failures:
+                self._wakeup.wait(min(2 ** failures, config.REPLICATION_MAX_BACKOFF))
+            elif self._wakeup.wait(config.SYNC_INTERVAL):
+                time.sleep(config.REPLICATION_BATCH_WINDOW)
+            self._wakeup.clear()
+            if not cluster.is_leader:
+                continue
             
-        except Exception as e:
-            logger.error(f"Error in periodic sync check: {str(e)}")
-        
-        time.sleep(config.SYNC_INTERVAL)
+            try:
+                if self.acked_seq is None and not self.load_state():
+                    self.start_from(self.fetch_high_water())
+                while cluster.is_leader and self._replicate_batch():
+                    pass
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error(f"Replication to {self.peer_url} failed at seq {self.acked_seq}: {str(e)}")
+                metrics.inc('chat_replication_failures_total', peer=self.peer_url)
+                get_db().rollback()
 
-def is_master_online():
-    """Check apakah master server online"""
-    try:
-        response = requests.get(f"{config.MASTER_SERVER}/health", timeout=5)
-        return response.status_code == 200
-    except:
-        return False
+    def fetch_high_water(self):
+        response = peer_client.get(f"{self.peer_url}/cluster/state")
+        response.raise_for_status()
+        return response.json()['master_high_water']
 
-def sync_missing_messages_from_master():
-    """Sync pesan dari master yang mungkin terlewat saat offline"""
-    try:
-        # Ambil timestamp terakhir sync
-        conn = sqlite3.connect(config.DB_PATH)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT value FROM sync_metadata WHERE key = 'last_master_sync'
-        ''')
+    def load_state(self):
+        """acked_seq dari replication_state. False kalau follower belum pernah di-replikasi."""
+        cursor = get_db().cursor()
+        cursor.execute('SELECT acked_seq FROM replication_state WHERE peer_url = ?', (self.peer_url,))
         result = cursor.fetchone()
-        
         if result:
-            last_sync = result[0]
-        else:
-            # Jika belum pernah sync, ambil dari created_at database
-            cursor.execute('''
-                SELECT MIN(timestamp) FROM messages WHERE origin = 'master'
-            ''')
-            result = cursor.fetchone()
-            last_sync = result[0] if result[0] else datetime.now().isoformat()
-        
-        # Request pesan baru dari master
-        response = requests.get(
-            f"{config.MASTER_SERVER}/api/messages",
-            params={'since': last_sync},
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            master_messages = response.json()
-            new_messages = 0
-            
-            for msg in master_messages:
-                # Check apakah pesan sudah ada
-                cursor.execute('''
-                    SELECT id FROM messages WHERE master_id = ? OR 
-                    (username = ? AND message = ? AND timestamp = ?)
-                ''', (msg['id'], msg['username'], msg['message'], msg['timestamp']))
-                
-                if not cursor.fetchone():
-                    # Pesan baru, insert
-                    cursor.execute('''
-                        INSERT INTO messages (username, message, timestamp, master_id, origin, sync_status)
-                        VALUES (?, ?, ?, ?, 'master', 'synced')
-                    ''', (msg['username'], msg['message'], msg['timestamp'], msg['id']))
-                    new_messages += 1
-            
-            if new_messages > 0:
-                logger.info(f"Synced {new_messages} new messages from master")
-                
-                # Update timestamp terakhir sync
-                cursor.execute('''
-                    INSERT OR REPLACE INTO sync_metadata (key, value, updated_at)
-                    VALUES ('last_master_sync', ?, ?)
-                ''', (datetime.now().isoformat(), datetime.now()))
-            
-            conn.commit()
+            self.acked_seq = result[0]
+        return result is not None
+
+    def start_from(self, high_water):
+        """Follower baru: mulai dari master_id tertinggi yang sudah dimilikinya.
+
+        Pesan master <= high water sudah ada di follower; sisanya (master_id lebih
+        besar atau tanpa master_id) dikirim, duplikat dilewati follower lewat uid.
+        """
+        cursor = get_db().cursor()
+        cursor.execute('SELECT MIN(id) FROM messages WHERE master_id > ?', (high_water,))
+        starts = [cursor.fetchone()[0]]
+        cursor.execute('SELECT MIN(id) FROM messages WHERE master_id IS NULL')
+        starts.append(cursor.fetchone()[0])
+        starts = [start for start in starts if start is not None]
+        self.acked_seq = min(starts) - 1 if starts else get_last_id()
+
+    @timed_query('replication_batch')
+    def next_batch(self):
+        """(body, headers, seq_end, count, has_more) atau None kalau follower sudah up to date"""
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT id, uid, master_id, username, message, timestamp, room FROM messages
+            WHERE id > ?
+            ORDER BY id ASC
+            LIMIT ?
+        ''', (self.acked_seq, config.REPLICATION_BATCH_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
         
-        conn.close()
+        seq_end = rows[-1][0]
+        messages = [{
+            'uid': uid,
+            'master_id': master_id,
+            'room': room,
+            'username': username,
+            'message': message,
+            'timestamp': timestamp
+        } for _, uid, master_id, username, message, timestamp, room in rows]
+        body, content_encoding = encode_wire_body({
+            'messages': messages,
+            'seq_end': seq_end,
+            'term': cluster.term,
+            'leader': config.NODE_URL
+        }, WIRE_COLUMNS, True)
+        headers = {'Content-Type': WIRE_COLUMNS}
+        if content_encoding:
+            headers['Content-Encoding'] = content_encoding
+        return body, headers, seq_end, len(rows), len(rows) == config.REPLICATION_BATCH_SIZE
+
+    def handle_response(self, response, seq_end, count):
+        """Return acked_seq, atau None kalau follower menolak term ini (409)"""
+        if response.status_code == 409:
+            observe_leader(response.json())
+            return None
+        response.raise_for_status()
+        logger.info(f"Replicated {count} messages to follower {self.peer_url} (seq {seq_end})")
+        return response.json().get('acked_seq') or seq_end
+
+    def _replicate_batch(self):
+        batch = self.next_batch()
+        if batch is None:
+            return False
+        body, headers, seq_end, count, has_more = batch
+        response = peer_client.post(f"{self.peer_url}/sync_messages", data=body, headers=headers)
+        acked_seq = self.handle_response(response, seq_end, count)
+        if acked_seq is None:
+            return False
+        self.ack(acked_seq)
+        return has_more
+
+    @timed_query('replication_ack')
+    def ack(self, acked_seq):
+        conn = get_db()
+        conn.execute('''
+            INSERT INTO replication_state (peer_url, acked_seq, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(peer_url) DO UPDATE SET
+                acked_seq = excluded.acked_seq,
+                updated_at = excluded.updated_at
+        ''', (self.peer_url, acked_seq, datetime.now()))
+        conn.commit()
         
-    except Exception as e:
-        logger.error(f"Error syncing from master: {str(e)}")
+        self.acked_seq = acked_seq
+        self.last_ack_at = datetime.now()
+
+# Semua node lain yang menjadi follower kalau node ini terpilih (termasuk master lama)
+follower_replicators = {peer_url: FollowerReplicator(peer_url)
+                        for peer_url in config.CLUSTER_NODES + [config.MASTER_SERVER]}
+
+def replication_lag():
+    """Saat leader: pesan yang belum di-ack setiap follower (dari memori)"""
+    if not cluster.is_leader:
+        return {}
+    last_seq = metrics.value('chat_last_seq')
+    return {url: max(0, last_seq - (replicator.acked_seq or 0))
+            for url, replicator in follower_replicators.items()}
+
+metrics.gauge_callback('chat_replication_lag_messages', 'Pesan yang belum di-ack per follower (saat leader)',
+                       replication_lag, label='peer')
+metrics.gauge_callback('chat_sync_pool_queue', 'Job di queue worker pool sync',
+                       lambda: sync_pool.stats()['queue_depth'])
+metrics.gauge_callback('chat_sync_in_flight', 'Pesan lokal yang sedang dikirim/di-retry ke master',
+                       lambda: len(_master_sync_in_progress))
+metrics.gauge_callback('chat_group_commit_queue', 'Insert yang menunggu group commit',
+                       lambda: message_writer.stats()['queued'])
+metrics.gauge_callback('chat_cluster_term', 'Term failover yang dilihat node ini',
+                       lambda: cluster.term)
+
+def notify_follower_replicators():
+    for replicator in follower_replicators.values():
+        replicator.notify()
+
+def on_leader_change(term, leader_url):
+    """Leader baru: replicator aktif/berhenti sesuai peran, pesan pending dikirim ulang"""
+    notify_follower_replicators()
 
-def master_health_monitor():
-    """Monitor kesehatan master server"""
-    master_status = {'online': False, 'last_check': None}
+def schedule_election():
+    """Leader offline: mulai election setelah jeda acak (supaya slave tidak bersamaan)"""
+    sync_pool.schedule(random.uniform(*config.ELECTION_TIMEOUT), run_election, cluster.term)
+
+def election_needed(expected_term):
+    """Election hanya kalau belum ada leader baru sejak dijadwalkan dan leader masih offline"""
+    return (config.FAILOVER_ENABLED and cluster.term == expected_term
+            and not cluster.is_leader and not is_master_online())
+
+def vote_request(term):
+    return {'term': term, 'candidate': config.NODE_URL, 'position': log_position()}
+
+def count_vote(term, data):
+    """Return 1 kalau vote diberikan; jawaban dengan term lebih tinggi diikuti"""
+    if data.get('granted'):
+        return 1
+    if data.get('term', 0) > term:
+        observe_leader(data)
+    return 0
+
+def run_election(expected_term):
+    if not election_needed(expected_term):
+        return
+    term = cluster.start_election()
+    logger.warning(f"Leader {config.MASTER_SERVER if expected_term == 0 else 'slave'} offline, "
+                   f"starting election for term {term}")
     
-    while True:
+    votes = 1  # vote untuk diri sendiri
+    payload = vote_request(term)
+    for node_url in config.CLUSTER_NODES:
         try:
-            online = is_master_online()
-            was_offline = not master_status['online']
-            
-            master_status['online'] = online
-            master_status['last_check'] = datetime.now()
-            
-            if online:
-                if was_offline:
-                    logger.info("Master server is back online! Triggering sync...")
-                    # Trigger immediate sync
-                    threading.Thread(target=sync_missing_messages_from_master).start()
-                else:
-                    logger.debug("Master server is healthy")
-            else:
-                logger.warning("Master server is offline")
-                
+            response = peer_client.post(f"{node_url}/cluster/vote", json=payload,
+                                        timeout=(config.HTTP_CONNECT_TIMEOUT, config.HEALTH_CHECK_TIMEOUT))
+            votes += count_vote(term, response.json())
         except Exception as e:
-            logger.error(f"Error monitoring master health: {str(e)}")
-        
-        time.sleep(30)  # Check setiap 30 detik
+            logger.info(f"No vote from {node_url}: {str(e)}")
+    
+    if votes >= cluster.quorum and cluster.become_leader(term):
+        logger.warning(f"Elected leader for term {term} with {votes} votes")
+        announce_leader(term)
+    elif cluster.term == term:
+        logger.info(f"Election for term {term} got {votes}/{cluster.quorum} votes, retrying")
+        schedule_election()
 
-# API endpoints
-@app.route('/')
-def index():
-    messages = get_messages()
-    return render_template('index.html', messages=messages, server_type='Slave')
+def announce_leader(term):
+    """Beri tahu semua node (termasuk master lama) tanpa menunggu batch replikasi pertama"""
+    for node_url in config.CLUSTER_NODES + [config.MASTER_SERVER]:
+        try:
+            peer_client.post(f"{node_url}/cluster/leader", json={'term': term, 'leader': config.NODE_URL},
+                             timeout=(config.HTTP_CONNECT_TIMEOUT, config.HEALTH_CHECK_TIMEOUT))
+        except Exception as e:
+            logger.info(f"Could not announce leader to {node_url}: {str(e)}")
 
-@app.route('/send_message', methods=['POST'])
-def send_message():
-    username = request.form.get('username', '').strip()
-    message = request.form.get('message', '').strip()
-    
-    if not username or not message:
-        return redirect(url_for('index'))
-    
-    add_message(username, message)
-    return redirect(url_for('index'))
+def handle_vote_request(data):
+    """Vote untuk candidate di term data['term'] (satu vote per term)"""
+    candidate = data['candidate']
+    # Lease: selama leader sekarang masih hidup, candidate lain tidak didukung
+    if cluster.leader_url not in (None, candidate) and is_master_online():
+        granted = False
+    else:
+        granted = cluster.grant_vote(data['term'], candidate, list(data['position']) >= log_position())
+    return dict(cluster.snapshot(), granted=granted)
 
-@app.route('/api/messages')
-def api_messages():
-    messages = get_messages()
-    return jsonify([{
+def cluster_state_data():
+    return dict(cluster.snapshot(),
+                master_high_water=get_master_high_water(),
+                position=log_position())
+
+def messages_to_dicts(messages):
+    return [{
         'id': msg[0],
         'username': msg[1],
         'message': msg[2],
-        'timestamp': msg[3]
-    } for msg in messages])
+        'timestamp': msg[3],
+        'uid': msg[4],
+        'room': msg[5]
+    } for msg in messages]
 
-@app.route('/sync_message', methods=['POST'])
-def sync_message():
-    """Receive message from master server"""
+def encode_messages_page(since_id, before_id, since, limit, content_type, allow_gzip, rooms=None):
+    """Satu halaman /api/messages yang sudah di-encode: (body, content_encoding, next_cursor)"""
+    messages, next_cursor = get_messages_page(since_id, before_id, since, limit, rooms)
+    body, content_encoding = encode_wire_body(messages_to_dicts(messages), content_type, allow_gzip)
+    return body, content_encoding, next_cursor
+
+def render_index(room, before_id=None):
+    """HTML index untuk satu window pesan di satu room: terbaru, atau yang lebih lama dari ?before="""
+    def render():
+        messages, older_cursor = get_messages_page(before_id=before_id, limit=config.INDEX_PAGE_SIZE,
+                                                   rooms=[room])
+        with app.app_context():
+            return render_template('index.html', messages=messages, server_type='Slave', room=room,
+                                   older_cursor=older_cursor, before_id=before_id)
+    
+    return render_cache.get_or_render((room, before_id), render)
+
+# Retention dan maintenance database
+def write_archive(rows):
+    """Append pesan ke arsip per bulan: ARCHIVE_DIR/messages-YYYY-MM.jsonl.gz.
+
+    Setiap slice ditulis sebagai satu member gzip baru (file gzip multi-member
+    tetap bisa dibaca gzip.open biasa) dan di-fsync sebelum row dihapus dari
+    database. Kalau proses mati di antaranya, slice itu ter-arsip dua kali;
+    baris arsip membawa uid jadi pembaca bisa dedup.
+    """
+    os.makedirs(config.ARCHIVE_DIR, exist_ok=True)
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(str(row['timestamp'])[:7], []).append(row)
+    
+    for month, partition in partitions.items():
+        lines = ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in partition)
+        path = os.path.join(config.ARCHIVE_DIR, f'messages-{month}.jsonl.gz')
+        with open(path, 'ab') as f:
+            f.write(gzip.compress(lines.encode('utf-8'), compresslevel=config.ARCHIVE_GZIP_LEVEL))
+            f.flush()
+            os.fsync(f.fileno())
+
+@timed_query('archive_slice')
+def archive_messages_slice(limit):
+    """Arsipkan lalu hapus maksimal limit pesan yang lebih tua dari MESSAGE_RETENTION_DAYS"""
+    conn = get_db()
+    # timestamp pesan = CURRENT_TIMESTAMP (UTC), jadi cutoff juga dihitung oleh SQLite
+    cursor = conn.execute(ARCHIVABLE_MESSAGES_SQL, (f'-{config.MESSAGE_RETENTION_DAYS} days', limit))
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    if not rows:
+        return 0
+    
+    write_archive(rows)
     try:
-        data = request.get_json()
-        username = data['username']
-        message = data['message']
-        master_id = data.get('master_id')
-        timestamp = data.get('timestamp', datetime.now().isoformat())
-        
-        conn = sqlite3.connect(config.DB_PATH)
-        cursor = conn.cursor()
-        
-        # Check apakah pesan sudah ada
-        cursor.execute('''
-            SELECT id FROM messages WHERE master_id = ? OR 
-            (username = ? AND message = ? AND timestamp = ?)
-        ''', (master_id, username, message, timestamp))
-        
-        if not cursor.fetchone():
-            cursor.execute('''
-                INSERT INTO messages (username, message, timestamp, master_id, origin, sync_status)
-                VALUES (?, ?, ?, ?, 'master', 'synced')
-            ''', (username, message, timestamp, master_id))
-            conn.commit()
-            logger.info(f"Received message from master: {master_id}")
-        
-        conn.close()
-        return jsonify({'status': 'success'})
+        conn.executemany('DELETE FROM messages WHERE id = ?', [(row['id'],) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    metrics.inc('chat_archived_messages_total', len(rows))
+    metrics.inc('chat_messages_stored', -len(rows))
+    render_cache.bump()
+    return len(rows)
+
+@timed_query('prune_slice')
+def prune_bookkeeping_slice(limit):
+    """Hapus master_sync_log yang sudah sukses dan basi (atau pesannya sudah diarsip),
+    plus replication_state follower yang sudah tidak ada di CLUSTER_NODES"""
+    cutoff = datetime.now() - timedelta(days=config.SYNC_LOG_RETENTION_DAYS)
+    conn = get_db()
+    cursor = conn.execute('''
+        DELETE FROM master_sync_log WHERE id IN (
+            SELECT sync_log.id FROM master_sync_log sync_log
+            LEFT JOIN messages ON messages.id = sync_log.message_id
+            WHERE messages.id IS NULL
+               OR (sync_log.sync_status = 'success' AND sync_log.last_attempt < ?)
+            LIMIT ?
+        )
+    ''', (cutoff, limit))
+    sync_log_pruned = cursor.rowcount
+    
+    active = set(config.CLUSTER_NODES) | set(follower_replicators)
+    placeholders = ', '.join('?' * len(active))
+    cursor = conn.execute(f'''
+        DELETE FROM replication_state WHERE peer_url IN (
+            SELECT peer_url FROM replication_state
+            WHERE peer_url NOT IN ({placeholders}) AND updated_at < ?
+            LIMIT ?
+        )
+    ''', (*active, cutoff, limit))
+    state_pruned = cursor.rowcount
+    conn.commit()
+    
+    if sync_log_pruned:
+        metrics.inc('chat_pruned_rows_total', sync_log_pruned, table='master_sync_log')
+    if state_pruned:
+        metrics.inc('chat_pruned_rows_total', state_pruned, table='replication_state')
+    return sync_log_pruned + state_pruned
+
+def incremental_vacuum_slice(pages):
+    """Kembalikan maksimal pages page kosong ke filesystem. Return jumlah page yang dilepas."""
+    conn = get_db()
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if not free_pages:
+        return 0
+    # executescript: incremental_vacuum hanya melepas satu page per step kalau lewat execute()
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+    released = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    metrics.inc('chat_vacuumed_pages_total', released)
+    return released
+
+@timed_query('analyze')
+def analyze_db():
+    # analysis_limit membatasi jumlah row yang dibaca per index, jadi ANALYZE tetap
+    # murah berapapun ukuran tabel
+    get_db().executescript(f'PRAGMA analysis_limit={config.MAINTENANCE_ANALYSIS_LIMIT}; ANALYZE;')
+
+class MaintenanceWorker:
+    """Background thread: arsip pesan lama, prune bookkeeping sync, incremental VACUUM dan ANALYZE.
+
+    Setiap pass dipotong per slice kecil (MAINTENANCE_BATCH_SIZE row atau
+    MAINTENANCE_VACUUM_PAGES page per transaksi) dengan jeda di antaranya,
+    jadi write lock hanya dipegang sebentar dan group commit writer tetap
+    mendapat giliran.
+    """
+
+    def __init__(self, interval, batch_size, vacuum_pages, slice_pause):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.slice_pause = slice_pause
+        self.incremental_vacuum = False
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.totals = {'archived': 0, 'pruned': 0, 'vacuumed_pages': 0}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        # auto_vacuum hanya bisa diset sebelum tabel pertama dibuat (lihat get_db);
+        # database lama tetap jalan, page kosong dipakai ulang tapi tidak dilepas
+        self.incremental_vacuum = get_db().execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        if not self.incremental_vacuum:
+            logger.info("auto_vacuum is not INCREMENTAL; run VACUUM once offline to enable it")
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Maintenance pass failed: {e}")
+            time.sleep(self.interval)
+
+    def _drain(self, step, size):
+        """Jalankan step(size) sampai tidak ada yang tersisa, dengan jeda antar slice"""
+        total = 0
+        while True:
+            done = step(size)
+            total += done
+            if done < size:
+                return total
+            time.sleep(self.slice_pause)
+
+    def run_once(self):
+        started = time.monotonic()
+        archived = 0
+        if config.MESSAGE_RETENTION_DAYS is not None:
+            archived = self._drain(archive_messages_slice, self.batch_size)
+        pruned = self._drain(prune_bookkeeping_slice, self.batch_size)
+        vacuumed = self._drain(incremental_vacuum_slice, self.vacuum_pages) if self.incremental_vacuum else 0
+        if archived or pruned or self.last_run is None:
+            analyze_db()
         
-    except Exception as e:
-        logger.error(f"Error receiving message from master: {str(e)}")
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+        self.totals['archived'] += archived
+        self.totals['pruned'] += pruned
+        self.totals['vacuumed_pages'] += vacuumed
+        self.last_run = datetime.now()
+        self.last_duration = time.monotonic() - started
+        self.last_error = None
+        if archived or pruned or vacuumed:
+            logger.info(f"Maintenance: archived {archived} messages, pruned {pruned} rows, "
+                        f"released {vacuumed} pages in {self.last_duration:.2f}s")
 
-@app.route('/api/sync_status')
-def get_sync_status():
-    """Get sync status info"""
-    conn = sqlite3.connect(config.DB_PATH)
+    def stats(self):
+        return dict(self.totals,
+                    retention_days=config.MESSAGE_RETENTION_DAYS,
+                    incremental_vacuum=self.incremental_vacuum,
+                    last_run=self.last_run.isoformat() if self.last_run else None,
+                    last_duration=round(self.last_duration, 3) if self.last_duration is not None else None,
+                    last_error=self.last_error)
+
+maintenance = MaintenanceWorker(config.MAINTENANCE_INTERVAL, config.MAINTENANCE_BATCH_SIZE,
+                                config.MAINTENANCE_VACUUM_PAGES, config.MAINTENANCE_SLICE_PAUSE)
+
+def sync_status_data():
+    """Isi /api/sync_status (tanpa statistik worker/HTTP pool, itu tergantung mode serving)"""
+    conn = get_db()
     cursor = conn.cursor()
     
     # Hitung pesan berdasarkan status
@@ -373,35 +2621,262 @@ def get_sync_status():
     result = cursor.fetchone()
     last_sync = result[0] if result else None
     
-    conn.close()
-    
-    return jsonify({
+    return {
         'sync_statistics': sync_stats,
         'last_master_sync': last_sync,
         'master_online': is_master_online(),
+        'master_health': health_tracker.snapshot()[config.MASTER_SERVER],
+        'last_catch_up': last_catch_up,
+        'cluster': cluster.snapshot(),
+        'leader_replication': {peer_url: {
+            'acked_seq': replicator.acked_seq,
+            'last_ack': replicator.last_ack_at.isoformat() if replicator.last_ack_at else None
+        } for peer_url, replicator in follower_replicators.items()} if cluster.is_leader else {},
+        'render_cache': render_cache.stats(),
+        'group_commit': message_writer.stats(),
+        'maintenance': maintenance.stats(),
         'timestamp': datetime.now().isoformat()
-    })
+    }
 
-@app.route('/health')
-def health():
-    return jsonify({
+def health_data():
+    return {
         'status': 'healthy',
         'server_type': 'slave',
         'master_server': config.MASTER_SERVER,
+        'leader': cluster.leader_url,
+        'term': cluster.term,
         'master_online': is_master_online(),
         'timestamp': datetime.now().isoformat(),
-        'message_count': len(get_messages())
+        'message_count': int(metrics.value('chat_messages_stored'))
+    }
+
+def database_size():
+    conn = get_db()
+    return conn.execute('PRAGMA page_count').fetchone()[0] * conn.execute('PRAGMA page_size').fetchone()[0]
+
+def health_detail_data():
+    """Isi /health/detail: /health + counter persist, offline queue dan posisi log.
+
+    Semua nilai dibaca dari memory atau satu row/PRAGMA, jadi tetap konstan
+    berapapun jumlah history pesan.
+    """
+    return dict(health_data(),
+                uptime_seconds=round(time.time() - STARTED_AT, 1),
+                stored_message_count=load_message_count(get_db()),
+                last_seq=int(metrics.value('chat_last_seq')),
+                sync_pending=int(metrics.value('chat_sync_pending_messages')),
+                log_position=log_position(),
+                database_bytes=database_size(),
+                master_health=health_tracker.snapshot(),
+                cluster=cluster.snapshot(),
+                group_commit=message_writer.stats())
+
+# API endpoints
+@app.route('/')
+def index():
+    try:
+        room = normalize_room(request.args.get('room'))
+    except ValueError:
+        return redirect(url_for('index'))
+    return render_index(room, request.args.get('before', type=int))
+
+@app.route('/send_message', methods=['POST'])
+def send_message():
+    username = request.form.get('username', '').strip()
+    message = request.form.get('message', '').strip()
+    try:
+        room = local_room(request.form.get('room'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    if username and message:
+        add_message(username, message, room)
+    return redirect(url_for('index', room=room))
+
+@app.route('/api/messages')
+def api_messages():
+    """List pesan dengan cursor: ?since_id= (alias ?after=), ?before=, ?since=, ?limit=, ?rooms=a,b"""
+    try:
+        rooms = parse_rooms(request.args.get('rooms'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    since_id = request.args.get('since_id', type=int)
+    if since_id is None:
+        since_id = request.args.get('after', type=int)
+    page = (since_id, request.args.get('before', type=int), request.args.get('since'),
+            request.args.get('limit', type=int))
+    filters = (rooms,)
+    
+    etag = messages_etag(page + filters)
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return not_modified(etag)
+    
+    # Node lain minta format kolumnar/msgpack lewat Accept, browser tetap JSON
+    content_type = negotiate_wire_format(request.headers.get('Accept'))
+    body, content_encoding, next_cursor = encode_messages_page(
+        *page,
+        content_type,
+        accepts_gzip(request.headers.get('Accept-Encoding')),
+        *filters
+    )
+    
+    response = Response(body, content_type=content_type)
+    response.headers['ETag'] = variant_etag(etag, content_type, content_encoding)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+@app.route('/api/stream')
+def api_stream():
+    """Server-Sent Events: push pesan baru begitu di-commit (?rooms=a,b = hanya room itu).
+    Di mode 'flask' setiap stream memegang satu thread; banyak client = mode 'asgi'."""
+    try:
+        rooms = parse_rooms(request.args.get('rooms'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    last_seq = request.headers.get('Last-Event-ID', type=int)
+    if last_seq is None:
+        last_seq = message_hub.last_seq
+    
+    def generate(last_seq):
+        yield 'retry: 3000\n\n'
+        while True:
+            events, last_seq, missed = message_hub.wait_for_events(last_seq, config.STREAM_HEARTBEAT)
+            if missed:
+                # Client ketinggalan, minta dia re-fetch lewat /api/messages?since_id=
+                yield f'id: {last_seq}\nevent: reset\ndata: {{}}\n\n'
+            for seq, message_data in events:
+                if rooms is None or message_data['room'] in rooms:
+                    yield f'id: {seq}\ndata: {json.dumps(message_data)}\n\n'
+            if not events and not missed:
+                yield ': keepalive\n\n'
+    
+    return Response(generate(last_seq), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
 
+@app.route('/sync_message', methods=['POST'])
+def sync_message():
+    """Receive message from master server"""
+    try:
+        return jsonify(receive_master_message(request.get_json()))
+        
+    except Exception as e:
+        logger.error(f"Error receiving message from master: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/sync_messages', methods=['POST'])
+def sync_messages():
+    """Receive batch of messages from master, di-commit dalam satu transaksi"""
+    try:
+        data = decode_wire(request.get_data(), request.content_type,
+                           request.headers.get('Content-Encoding'))
+        return jsonify(receive_master_batch(data))
+        
+    except UnsupportedWireFormat as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except StaleLeader:
+        return jsonify(dict(cluster.snapshot(), status='error', message='Stale leader')), 409
+    except Exception as e:
+        logger.error(f"Error receiving batch from master: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/peer/sync_messages', methods=['POST'])
+def peer_sync_messages():
+    """Receive messages from followers (hanya saat node ini leader hasil failover)"""
+    try:
+        data = decode_wire(request.get_data(), request.content_type,
+                           request.headers.get('Content-Encoding'))
+        return jsonify(ingest_follower_batch(data))
+        
+    except UnsupportedWireFormat as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 415
+    except StaleLeader:
+        return jsonify(dict(cluster.snapshot(), status='error', message='Not the leader')), 409
+    except Exception as e:
+        logger.error(f"Error ingesting follower messages: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/cluster/vote', methods=['POST'])
+def cluster_vote():
+    return jsonify(handle_vote_request(request.get_json()))
+
+@app.route('/cluster/leader', methods=['POST'])
+def cluster_leader():
+    """Pengumuman leader baru hasil election"""
+    data = request.get_json()
+    if not cluster.observe(data['term'], data['leader']):
+        return jsonify(dict(cluster.snapshot(), status='error', message='Stale leader')), 409
+    return jsonify(dict(cluster.snapshot(), status='success'))
+
+@app.route('/cluster/state')
+def cluster_state():
+    return jsonify(cluster_state_data())
+
+@app.route('/api/sync_status')
+def get_sync_status():
+    """Get sync status info"""
+    data = sync_status_data()
+    data['worker_pool'] = sync_pool.stats()
+    data['http_pools'] = peer_client.pool_stats()
+    
+    etag = json_etag(data, exclude=('timestamp',))
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        return not_modified(etag)
+    response = jsonify(data)
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/search')
+def api_search():
+    """Full-text search: ?q= (wajib), ?username=, ?limit=, ?offset="""
+    try:
+        data = search_data(
+            request.args.get('q', ''),
+            request.args.get('username'),
+            request.args.get('limit', type=int),
+            request.args.get('offset', 0, type=int)
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify(data)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health')
+def health():
+    return jsonify(health_data())
+
+@app.route('/health/detail')
+def health_detail():
+    return jsonify(health_detail_data())
+
 if __name__ == '__main__':
     init_db()
+    cluster.load()
     
     # Start background processes
+    message_writer.start()
+    maintenance.start()
+    sync_pool.start()
+    
+    cluster.add_listener(on_leader_change)
+    for replicator in follower_replicators.values():
+        replicator.start()
+    
     sync_thread = threading.Thread(target=periodic_sync_check, daemon=True)
     sync_thread.start()
     
-    health_thread = threading.Thread(target=master_health_monitor, daemon=True)
-    health_thread.start()
+    health_tracker.add_listener(on_master_health_change)
+    health_tracker.start()
     
     logger.info(f"Starting Enhanced Slave Server on {config.HOST}:{config.PORT}")
     logger.info(f"Master Server: {config.MASTER_SERVER}")
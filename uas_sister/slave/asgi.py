@@ -0,0 +1,807 @@
+# asgi.py
+# Production serving mode: HTTP surface dan sync ke/dari master berjalan di satu
+# event loop asyncio (uvicorn + httpx), bukan satu thread per request/sync.
+# Logika data tetap di app.py; query SQLite dijalankan di thread pool kecil
+# karena modul sqlite3 blocking.
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5001
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, quote, urlsplit
+
+import httpx
+import uvicorn
+
+import config
+import app as core
+
+logger = logging.getLogger(__name__)
+# httpx me-log setiap request di level INFO; sync loop terlalu sering untuk itu
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+# Thread pool untuk SQLite. Setiap thread memegang satu koneksi (core.get_db)
+db_executor = ThreadPoolExecutor(max_workers=config.ASGI_DB_THREADS, thread_name_prefix='db')
+
+def _call_db(fn, args):
+    try:
+        return fn(*args)
+    finally:
+        # Sama seperti teardown_request di app.py: jangan tinggalkan transaksi terbuka
+        conn = core.get_db()
+        if conn.in_transaction:
+            conn.rollback()
+
+async def run_db(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(_call_db, fn, args))
+
+class AsyncPeerHTTPClient:
+    """Versi async dari PeerHTTPClient: satu httpx.AsyncClient dengan connection
+    pool keep-alive untuk semua peer."""
+
+    def __init__(self):
+        self._client = None
+        self._requests = {}
+        self._connections = {}
+
+    async def start(self):
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.SYNC_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=config.ASGI_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=config.HTTP_POOL_MAXSIZE)
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    def _count(self, url):
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+        self._requests[base_url] = self._requests.get(base_url, 0) + 1
+
+    async def request(self, method, url, **kwargs):
+        self._count(url)
+        parts = urlsplit(url)
+        peer = f"{parts.scheme}://{parts.netloc}"
+        started = time.perf_counter()
+        try:
+            response = await self._client.request(method, url, extensions={'trace': self._trace(url)},
+                                                  **kwargs)
+        except Exception:
+            core.metrics.inc('chat_peer_request_errors_total', peer=peer, endpoint=parts.path)
+            raise
+        core.metrics.observe('chat_peer_request_seconds', time.perf_counter() - started,
+                             peer=peer, endpoint=parts.path)
+        return response
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    def stream(self, method, url, **kwargs):
+        """Async context manager untuk response besar (dibaca per chunk)"""
+        self._count(url)
+        return self._client.stream(method, url, extensions={'trace': self._trace(url)}, **kwargs)
+
+    def _trace(self, url):
+        """Trace httpcore: hitung koneksi TCP baru per peer (request lain memakai ulang pool)"""
+        parts = urlsplit(url)
+        base_url = f"{parts.scheme}://{parts.netloc}"
+
+        async def trace(event_name, info):
+            if event_name == 'connection.connect_tcp.complete':
+                self._connections[base_url] = self._connections.get(base_url, 0) + 1
+        return trace
+
+    def pool_stats(self):
+        """Statistik reuse koneksi per peer, skema sama dengan PeerHTTPClient.pool_stats"""
+        return {base_url: core.connection_reuse_stats(count, self._connections.get(base_url, 0))
+                for base_url, count in self._requests.items()}
+
+peer_http = AsyncPeerHTTPClient()
+
+class StreamNotifier:
+    """Jembatan message_hub (thread) ke event loop.
+
+    Semua subscriber /api/stream menunggu satu future bersama; publish dari
+    thread manapun me-resolve future itu lewat call_soon_threadsafe lalu
+    future baru dibuat untuk generasi berikutnya.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._future = loop.create_future()
+
+    def wake(self):
+        self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+        self._future = self._loop.create_future()
+
+    async def wait_for_events(self, last_seq, timeout):
+        if last_seq == core.message_hub.last_seq:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return core.message_hub.wait_for_events(last_seq, 0)
+
+stream_notifier = None
+
+# Sync pesan lokal ke master: satu task per pesan, retry dengan asyncio.sleep
+master_sync_tasks = set()
+
+def submit_master_sync(message_id, username, message, max_retries=5):
+    """Versi async dari core.submit_master_sync. False kalau sudah antri atau terlalu banyak task."""
+    if not core.claim_master_sync(message_id):
+        return False
+    if len(master_sync_tasks) >= config.SYNC_QUEUE_SIZE:
+        core.release_master_sync(message_id)
+        return False
+
+    task = asyncio.get_running_loop().create_task(
+        sync_to_master_with_retry(message_id, username, message, max_retries))
+    master_sync_tasks.add(task)
+    task.add_done_callback(master_sync_tasks.discard)
+    return True
+
+async def sync_to_master_with_retry(message_id, username, message, max_retries=5):
+    try:
+        for attempt in range(max_retries):
+            # Bisa saja sudah tersinkronisasi oleh catch-up sejak dijadwalkan
+            outgoing = await run_db(core.get_outgoing_message, message_id)
+            if outgoing is None:
+                return True
+            if core.cluster.is_leader:
+                # Node ini leader: replicator yang mengirim pesan ke follower
+                await run_db(core.record_master_sync_success, message_id, None, attempt)
+                core.notify_follower_replicators()
+                return True
+            if not core.is_master_online():
+                # Tetap 'pending', periodic_sync_check mengirimnya saat leader online
+                return False
+
+            try:
+                url, payload = core.leader_sync_request(outgoing[0], username, message, outgoing[1], outgoing[2])
+                response = await peer_http.post(url, json=payload, headers={'Idempotency-Key': outgoing[0]})
+                if response.status_code == 409:
+                    await run_db(core.observe_leader, response.json())
+                response.raise_for_status()
+                await run_db(core.record_master_sync_success, message_id,
+                             response.json().get('master_id'), attempt)
+                logger.info(f"Successfully synced message {message_id} to master")
+                return True
+
+            except Exception as e:
+                logger.error(f"Sync attempt {attempt + 1} failed: {str(e) or type(e).__name__}")
+                await run_db(core.record_master_sync_failure, message_id, attempt)
+
+            if attempt < max_retries - 1:
+                # Exponential backoff
+                retry_delay = (2 ** attempt) * 5  # 5, 10, 20, 40, 80 seconds
+                logger.info(f"Retrying message {message_id} in {retry_delay} seconds...")
+                await asyncio.sleep(retry_delay)
+
+        await run_db(core.mark_master_sync_failed, message_id)
+        logger.error(f"Failed to sync message {message_id} after {max_retries} attempts")
+        return False
+    finally:
+        core.release_master_sync(message_id)
+
+async def bootstrap_from_snapshot():
+    """Download snapshot master per chunk lalu muat. Return seq snapshot."""
+    path = f"{config.DB_PATH}.snapshot"
+    loop = asyncio.get_running_loop()
+    try:
+        async with peer_http.stream('GET', f"{config.MASTER_SERVER}/api/snapshot",
+                                    params=core.slice_params()) as response:
+            response.raise_for_status()
+            seq = int(response.headers['X-Snapshot-Seq'])
+            expected_size = response.headers.get('Content-Length')
+            with open(path, 'wb') as f:
+                async for chunk in response.aiter_bytes(config.SNAPSHOT_CHUNK_SIZE):
+                    await loop.run_in_executor(None, f.write, chunk)
+
+        await run_db(core.apply_snapshot, path, seq, expected_size)
+    finally:
+        # Juga download yang gagal/terputus: jangan tinggalkan file setengah jadi
+        if os.path.exists(path):
+            os.remove(path)
+    return seq
+
+# Catch-up dari master; lock supaya periodic check dan trigger health tidak jalan bersamaan
+catch_up_lock = None
+master_messages_etag = None
+
+async def register_replication_filter():
+    """Versi async dari core.register_replication_filter"""
+    if core.replication_filter_registered:
+        return
+    url, payload = core.replication_filter_request()
+    core.record_replication_filter_response(await peer_http.post(url, json=payload))
+
+async def sync_missing_messages_from_master():
+    """Sync pesan dari master yang mungkin terlewat saat offline"""
+    global master_messages_etag
+    async with catch_up_lock:
+        try:
+            await register_replication_filter()
+            started = time.monotonic()
+            since_id = await run_db(core.get_master_high_water)
+            new_messages = skipped_messages = 0
+            headers = {'Accept': core.wire_accept_header()}
+            if master_messages_etag:
+                headers['If-None-Match'] = master_messages_etag
+
+            # Tarik per halaman sampai master tidak punya pesan baru lagi (304 = tidak ada)
+            while True:
+                response = await peer_http.get(
+                    f"{config.MASTER_SERVER}/api/messages",
+                    params=core.catch_up_params(since_id),
+                    headers=headers
+                )
+                if response.status_code != 200:
+                    break
+
+                next_cursor = response.headers.get('X-Next-Cursor')
+                if next_cursor and core.should_bootstrap_from_snapshot(since_id, response.headers.get('X-Last-Seq')):
+                    since_id = await bootstrap_from_snapshot()
+                    headers.pop('If-None-Match', None)
+                    continue
+
+                messages = core.decode_wire(response.content, response.headers.get('content-type'))
+                inserted, skipped = await run_db(core.apply_master_messages, messages)
+                new_messages += inserted
+                skipped_messages += skipped
+
+                if not next_cursor:
+                    master_messages_etag = response.headers.get('ETag')
+                    break
+                since_id = int(next_cursor)
+                headers.pop('If-None-Match', None)
+
+            core.record_catch_up(new_messages, skipped_messages, time.monotonic() - started)
+            if new_messages > 0:
+                await run_db(core.record_last_master_sync)
+
+        except Exception as e:
+            logger.error(f"Error syncing from master: {str(e) or type(e).__name__}")
+
+async def periodic_sync_check():
+    """Periodic check untuk sync pesan yang gagal"""
+    while True:
+        try:
+            if core.is_master_online():
+                for msg_id, username, message in await run_db(core.claim_unsynced_messages):
+                    # Pesan yang masih antri/di-retry dilewati
+                    submit_master_sync(msg_id, username, message, 3)
+
+                if core.is_following_master():
+                    await sync_missing_messages_from_master()
+
+        except Exception as e:
+            logger.error(f"Error in periodic sync check: {str(e)}")
+
+        await asyncio.sleep(config.SYNC_INTERVAL)
+
+def on_master_health_change(peer_url, online):
+    """Dipanggil dari probe_peer (di event loop) saat status master/leader berubah"""
+    if core.cluster.is_leader:
+        if online and peer_url in core.follower_replicators:
+            core.follower_replicators[peer_url].notify()
+        return
+    if peer_url != core.cluster.leader_url:
+        return
+
+    if online:
+        logger.info("Master server is back online! Triggering sync...")
+        if peer_url == config.MASTER_SERVER:
+            core.replication_filter_registered = False
+            spawn(sync_missing_messages_from_master())
+    else:
+        logger.warning("Master server is offline")
+        if config.FAILOVER_ENABLED:
+            schedule_election()
+
+# Failover: versi async dari election dan FollowerReplicator di app.py
+def schedule_election():
+    term = core.cluster.term
+    asyncio.get_running_loop().call_later(random.uniform(*config.ELECTION_TIMEOUT),
+                                          lambda: spawn(run_election(term)))
+
+async def request_vote(node_url, payload):
+    try:
+        response = await peer_http.post(
+            f"{node_url}/cluster/vote", json=payload,
+            timeout=httpx.Timeout(config.HEALTH_CHECK_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+        )
+        return response.json()
+    except Exception as e:
+        logger.info(f"No vote from {node_url}: {str(e) or type(e).__name__}")
+        return {}
+
+async def run_election(expected_term):
+    if not core.election_needed(expected_term):
+        return
+    term = await run_db(core.cluster.start_election)
+    logger.warning(f"Leader offline, starting election for term {term}")
+
+    payload = await run_db(core.vote_request, term)
+    replies = await asyncio.gather(*(request_vote(node_url, payload) for node_url in config.CLUSTER_NODES))
+    votes = 1  # vote untuk diri sendiri
+    for data in replies:
+        votes += await run_db(core.count_vote, term, data)
+
+    if votes >= core.cluster.quorum and await run_db(core.cluster.become_leader, term):
+        logger.warning(f"Elected leader for term {term} with {votes} votes")
+        await asyncio.gather(*(announce_leader(node_url, term)
+                               for node_url in config.CLUSTER_NODES + [config.MASTER_SERVER]))
+    elif core.cluster.term == term:
+        logger.info(f"Election for term {term} got {votes}/{core.cluster.quorum} votes, retrying")
+        schedule_election()
+
+async def announce_leader(node_url, term):
+    try:
+        await peer_http.post(
+            f"{node_url}/cluster/leader", json={'term': term, 'leader': config.NODE_URL},
+            timeout=httpx.Timeout(config.HEALTH_CHECK_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+        )
+    except Exception as e:
+        logger.info(f"Could not announce leader to {node_url}: {str(e) or type(e).__name__}")
+
+class AsyncFollowerReplicator(core.FollowerReplicator):
+    """FollowerReplicator yang berjalan sebagai task asyncio (bukan thread)"""
+
+    def __init__(self, peer_url, loop):
+        super().__init__(peer_url)
+        self._loop = loop
+        self._async_wakeup = asyncio.Event()
+
+    def notify(self):
+        # Bisa dipanggil dari thread db_executor (listener cluster) maupun event loop
+        self._loop.call_soon_threadsafe(self._async_wakeup.set)
+
+    async def _wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._async_wakeup.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self):
+        failures = 0
+        while True:
+            if failures:
+                await self._wait(min(2 ** failures, config.REPLICATION_MAX_BACKOFF))
+            elif await self._wait(config.SYNC_INTERVAL):
+                await asyncio.sleep(config.REPLICATION_BATCH_WINDOW)
+            self._async_wakeup.clear()
+            if not core.cluster.is_leader:
+                continue
+
+            try:
+                if self.acked_seq is None and not await run_db(self.load_state):
+                    response = await peer_http.get(f"{self.peer_url}/cluster/state")
+                    response.raise_for_status()
+                    await run_db(self.start_from, response.json()['master_high_water'])
+                while core.cluster.is_leader and await self._replicate_batch_async():
+                    pass
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.error(f"Replication to {self.peer_url} failed at seq {self.acked_seq}: "
+                             f"{str(e) or type(e).__name__}")
+                core.metrics.inc('chat_replication_failures_total', peer=self.peer_url)
+
+    async def _replicate_batch_async(self):
+        batch = await run_db(self.next_batch)
+        if batch is None:
+            return False
+        body, headers, seq_end, count, has_more = batch
+        response = await peer_http.post(f"{self.peer_url}/sync_messages", content=body, headers=headers)
+        acked_seq = await run_db(self.handle_response, response, seq_end, count)
+        if acked_seq is None:
+            return False
+        await run_db(self.ack, acked_seq)
+        return has_more
+
+
+async def probe_peer(peer_url):
+    started = time.monotonic()
+    error = None
+    try:
+        response = await peer_http.get(
+            f"{peer_url}/health",
+            timeout=httpx.Timeout(config.HEALTH_CHECK_TIMEOUT, connect=config.HTTP_CONNECT_TIMEOUT)
+        )
+        online = response.status_code == 200
+        if not online:
+            error = f"HTTP {response.status_code}"
+    except Exception as e:
+        online = False
+        error = str(e) or type(e).__name__
+    core.health_tracker.record(peer_url, online, started, error)
+
+async def health_check_loop():
+    """Pengganti thread HealthTracker: semua peer di-probe bersamaan"""
+    while True:
+        await asyncio.gather(*(probe_peer(peer_url) for peer_url in core.health_tracker.peer_urls))
+        await asyncio.sleep(core.health_tracker.interval)
+
+# HTTP plumbing minimal di atas ASGI
+class Request:
+    def __init__(self, scope, receive):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query = {key: values[0] for key, values in
+                      parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1')
+                        for key, value in scope['headers']}
+        self.remote_addr = scope['client'][0] if scope.get('client') else None
+        self._receive = receive
+
+    def int_arg(self, name):
+        try:
+            return int(self.query[name])
+        except (KeyError, ValueError):
+            return None
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self._receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def json(self):
+        return json.loads(await self.body())
+
+    async def form(self):
+        body = (await self.body()).decode('utf-8')
+        return {key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()}
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='text/html; charset=utf-8', headers=None):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.headers = dict(headers or {}, **{'Content-Type': content_type})
+
+    def _raw_headers(self):
+        return [(key.lower().encode('latin-1'), str(value).encode('latin-1'))
+                for key, value in self.headers.items()]
+
+    async def __call__(self, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': self._raw_headers() + [(b'content-length', str(len(self.body)).encode())]})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+class StreamingResponse(Response):
+    """Kirim chunk dari async generator sampai client disconnect"""
+
+    def __init__(self, chunks, content_type, headers=None):
+        super().__init__(b'', 200, content_type, headers)
+        self.chunks = chunks
+
+    async def __call__(self, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self._raw_headers()})
+
+        async def pump():
+            async for chunk in self.chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_disconnect())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        if tasks[0] in done and tasks[0].exception() is None:
+            await send({'type': 'http.response.body', 'body': b''})
+
+def json_response(data, status=200, headers=None):
+    return Response(json.dumps(data), status, 'application/json', headers)
+
+def redirect(location):
+    return Response(b'', 302, headers={'Location': location})
+
+def not_modified(etag):
+    return Response(b'', 304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+# Routes (sama dengan app.py)
+async def index(request):
+    try:
+        room = core.normalize_room(request.query.get('room'))
+    except ValueError:
+        return redirect('/')
+    before_id = request.int_arg('before')
+    # Cache hit dilayani langsung di event loop tanpa lewat thread SQLite
+    html = core.render_cache.get((room, before_id))
+    if html is None:
+        html = await run_db(core.render_index, room, before_id)
+    return Response(html)
+
+async def send_message(request):
+    form = await request.form()
+    username = form.get('username', '').strip()
+    message = form.get('message', '').strip()
+    try:
+        room = core.local_room(form.get('room'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+
+    if username and message:
+        message_data = await asyncio.wrap_future(core.message_writer.submit(username, message, room))
+        message_id = message_data['id']
+        # Kalau terlalu banyak task, pesan tetap 'pending' dan diambil periodic_sync_check
+        if not submit_master_sync(message_id, username, message):
+            logger.warning(f"Sync queue full, message {message_id} deferred to periodic sync")
+    return redirect(f'/?room={quote(room)}')
+
+async def api_messages(request):
+    """List pesan dengan cursor: ?since_id= (alias ?after=), ?before=, ?since=, ?limit=, ?rooms=a,b"""
+    try:
+        rooms = core.parse_rooms(request.query.get('rooms'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    since_id = request.int_arg('since_id')
+    if since_id is None:
+        since_id = request.int_arg('after')
+    page = (since_id, request.int_arg('before'), request.query.get('since'), request.int_arg('limit'))
+    filters = (rooms,)
+
+    etag = core.messages_etag(page + filters)
+    if core.etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+
+    # Query + encode (+ gzip) dijalankan di thread supaya event loop tidak tertahan
+    content_type = core.negotiate_wire_format(request.headers.get('accept'))
+    body, content_encoding, next_cursor = await run_db(
+        core.encode_messages_page,
+        *page,
+        content_type,
+        core.accepts_gzip(request.headers.get('accept-encoding')),
+        *filters
+    )
+
+    headers = {
+        'ETag': core.variant_etag(etag, content_type, content_encoding),
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept, Accept-Encoding'
+    }
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+    if next_cursor is not None:
+        headers['X-Next-Cursor'] = next_cursor
+    return Response(body, 200, content_type, headers)
+
+async def api_stream(request):
+    """Server-Sent Events: push pesan baru begitu di-commit (?rooms=a,b = hanya room itu)"""
+    try:
+        rooms = core.parse_rooms(request.query.get('rooms'))
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    try:
+        last_seq = int(request.headers['last-event-id'])
+    except (KeyError, ValueError):
+        last_seq = core.message_hub.last_seq
+
+    async def generate(last_seq):
+        yield 'retry: 3000\n\n'
+        while True:
+            events, last_seq, missed = await stream_notifier.wait_for_events(last_seq, config.STREAM_HEARTBEAT)
+            if missed:
+                # Client ketinggalan, minta dia re-fetch lewat /api/messages?since_id=
+                yield f'id: {last_seq}\nevent: reset\ndata: {{}}\n\n'
+            for seq, message_data in events:
+                if rooms is None or message_data['room'] in rooms:
+                    yield f'id: {seq}\ndata: {json.dumps(message_data)}\n\n'
+            if not events and not missed:
+                yield ': keepalive\n\n'
+
+    return StreamingResponse(generate(last_seq), 'text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+async def sync_message(request):
+    """Receive message from master server"""
+    try:
+        return json_response(await run_db(core.receive_master_message, await request.json()))
+
+    except Exception as e:
+        logger.error(f"Error receiving message from master: {str(e)}")
+        return json_response({'status': 'error', 'message': str(e)}, 500)
+
+async def sync_messages(request):
+    """Receive batch of messages from master, di-commit dalam satu transaksi"""
+    try:
+        data = core.decode_wire(await request.body(), request.headers.get('content-type'),
+                                request.headers.get('content-encoding'))
+        return json_response(await run_db(core.receive_master_batch, data))
+
+    except core.UnsupportedWireFormat as e:
+        return json_response({'status': 'error', 'message': str(e)}, 415)
+    except core.StaleLeader:
+        return json_response(dict(core.cluster.snapshot(), status='error', message='Stale leader'), 409)
+    except Exception as e:
+        logger.error(f"Error receiving batch from master: {str(e)}")
+        return json_response({'status': 'error', 'message': str(e)}, 500)
+
+async def peer_sync_messages(request):
+    """Receive messages from followers (hanya saat node ini leader hasil failover)"""
+    try:
+        data = core.decode_wire(await request.body(), request.headers.get('content-type'),
+                                request.headers.get('content-encoding'))
+        return json_response(await run_db(core.ingest_follower_batch, data))
+
+    except core.UnsupportedWireFormat as e:
+        return json_response({'status': 'error', 'message': str(e)}, 415)
+    except core.StaleLeader:
+        return json_response(dict(core.cluster.snapshot(), status='error', message='Not the leader'), 409)
+    except Exception as e:
+        logger.error(f"Error ingesting follower messages: {str(e)}")
+        return json_response({'status': 'error', 'message': str(e)}, 500)
+
+async def cluster_vote(request):
+    return json_response(await run_db(core.handle_vote_request, await request.json()))
+
+async def cluster_leader(request):
+    """Pengumuman leader baru hasil election"""
+    data = await request.json()
+    if not await run_db(core.cluster.observe, data['term'], data['leader']):
+        return json_response(dict(core.cluster.snapshot(), status='error', message='Stale leader'), 409)
+    return json_response(dict(core.cluster.snapshot(), status='success'))
+
+async def cluster_state(request):
+    return json_response(await run_db(core.cluster_state_data))
+
+async def get_sync_status(request):
+    """Get sync status info"""
+    data = await run_db(core.sync_status_data)
+    data['sync_tasks'] = {'in_flight': len(master_sync_tasks), 'max': config.SYNC_QUEUE_SIZE}
+    data['http_pools'] = peer_http.pool_stats()
+
+    etag = core.json_etag(data, exclude=('timestamp',))
+    if core.etag_matches(request.headers.get('if-none-match'), etag):
+        return not_modified(etag)
+    return json_response(data, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+async def api_search(request):
+    """Full-text search: ?q= (wajib), ?username=, ?limit=, ?offset="""
+    try:
+        data = await run_db(
+            core.search_data,
+            request.query.get('q', ''),
+            request.query.get('username'),
+            request.int_arg('limit'),
+            request.int_arg('offset') or 0
+        )
+    except ValueError as e:
+        return json_response({'status': 'error', 'message': str(e)}, 400)
+    return json_response(data)
+
+async def health(request):
+    # Hanya counter in-memory, tidak perlu thread DB
+    return json_response(core.health_data())
+
+async def health_detail(request):
+    return json_response(await run_db(core.health_detail_data))
+
+async def metrics(request):
+    return Response(core.metrics.render(), content_type='text/plain; version=0.0.4')
+
+ROUTES = {
+    ('GET', '/'): index,
+    ('POST', '/send_message'): send_message,
+    ('GET', '/api/messages'): api_messages,
+    ('GET', '/api/search'): api_search,
+    ('GET', '/api/stream'): api_stream,
+    ('POST', '/sync_message'): sync_message,
+    ('POST', '/sync_messages'): sync_messages,
+    ('POST', '/peer/sync_messages'): peer_sync_messages,
+    ('POST', '/cluster/vote'): cluster_vote,
+    ('POST', '/cluster/leader'): cluster_leader,
+    ('GET', '/cluster/state'): cluster_state,
+    ('GET', '/api/sync_status'): get_sync_status,
+    ('GET', '/health'): health,
+    ('GET', '/health/detail'): health_detail,
+    ('GET', '/metrics'): metrics,
+}
+
+background_tasks = set()
+
+def spawn(coro):
+    """Jalankan coroutine di background dan simpan referensinya sampai selesai"""
+    task = asyncio.get_running_loop().create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def startup():
+    global stream_notifier, catch_up_lock
+    await run_db(core.init_db)
+    core.message_writer.start()
+    core.maintenance.start()
+    await run_db(core.cluster.load)
+    await peer_http.start()
+
+    loop = asyncio.get_running_loop()
+    stream_notifier = StreamNotifier(loop)
+    core.message_hub.add_waker(stream_notifier.wake)
+    catch_up_lock = asyncio.Lock()
+
+    core.health_tracker.add_listener(on_master_health_change)
+    spawn(health_check_loop())
+    spawn(periodic_sync_check())
+
+    # Replicator menunggu sampai node ini terpilih sebagai leader
+    for peer_url in list(core.follower_replicators):
+        replicator = AsyncFollowerReplicator(peer_url, loop)
+        core.follower_replicators[peer_url] = replicator
+        spawn(replicator.run())
+    core.cluster.add_listener(core.on_leader_change)
+
+    logger.info(f"Starting Enhanced Slave Server (ASGI) on {config.HOST}:{config.PORT}")
+    logger.info(f"Master Server: {config.MASTER_SERVER}")
+
+async def shutdown():
+    tasks = list(background_tasks) + list(master_sync_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await peer_http.close()
+    db_executor.shutdown(wait=False)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await startup()
+            except Exception as e:
+                logger.exception("Startup failed")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    request = Request(scope, receive)
+    handler = ROUTES.get((request.method, request.path))
+    core.metrics.inc('chat_http_requests_total', endpoint=request.path if handler else 'unmatched')
+    if handler is None:
+        allowed = any(path == request.path for _, path in ROUTES)
+        response = json_response({'status': 'error', 'message': 'Not found'}, 405 if allowed else 404)
+    else:
+        try:
+            response = await handler(request)
+        except Exception as e:
+            logger.exception(f"Error handling {request.method} {request.path}")
+            response = json_response({'status': 'error', 'message': str(e)}, 500)
+    await response(receive, send)
+
+if __name__ == '__main__':
+    uvicorn.run('asgi:app', host=config.HOST, port=config.PORT, access_log=False)
@@ -10,4 +10,70 @@ DB_PATH = 'slave_discussion.db'
 # Sync settings 
 SYNC_INTERVAL = 3  # Sync every 3 seconds 
 SYNC_TIMEOUT = 10 
-HEALTH_CHECK_INTERVAL = 60
\ No newline at end of file
+HEALTH_CHECK_INTERVAL = 5  # Detik antar probe /health ke master
+# API pagination
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+SEARCH_PAGE_SIZE = 20  # Hasil per halaman /api/search
+SEARCH_RANK_WINDOW = 5000  # Match terbaru yang diurutkan relevansi per query
+# Real-time push (Server-Sent Events)
+STREAM_BUFFER_SIZE = 1000  # Jumlah event terakhir yang disimpan untuk reconnect
+STREAM_HEARTBEAT = 15  # Detik antar keepalive ke client yang idle
+# HTTP connection pool antar node
+HTTP_POOL_MAXSIZE = 10  # Koneksi keep-alive per peer
+HTTP_POOL_BLOCK = False  # True = tunggu koneksi bebas daripada buka koneksi ekstra
+HTTP_CONNECT_TIMEOUT = 3
+HEALTH_CHECK_TIMEOUT = 5
+HEALTH_CACHE_TTL = 3 * HEALTH_CHECK_INTERVAL  # Status health dianggap basi setelah ini
+# SQLite tuning
+DB_BUSY_TIMEOUT = 5.0  # Detik menunggu lock sebelum 'database is locked'
+DB_STATEMENT_CACHE_SIZE = 128  # Prepared statement yang di-cache per koneksi
+# Worker pool untuk sync job
+SYNC_WORKERS = 4  # Jumlah thread worker tetap
+SYNC_QUEUE_SIZE = 1000  # Job yang boleh antri sebelum submit ditolak
+RETRY_WHEEL_TICK = 1.0  # Resolusi timer wheel untuk retry (detik)
+RETRY_WHEEL_SLOTS = 128
+# Group commit untuk /send_message
+GROUP_COMMIT_WINDOW = 0.002  # Detik menunggu post lain sebelum commit satu batch
+GROUP_COMMIT_MAX_BATCH = 256  # Insert maksimal per transaksi
+# Serving mode
+SERVER_MODE = 'asgi'  # 'asgi' = uvicorn + asyncio (asgi.py), 'flask' = Werkzeug dev server (app.py, satu thread per /api/stream)
+ASGI_DB_THREADS = 8  # Thread untuk query SQLite dari event loop
+ASGI_HTTP_MAX_CONNECTIONS = 100  # Batas koneksi keluar httpx ke semua peer
+# Halaman index
+INDEX_PAGE_SIZE = 50  # Pesan terbaru yang di-render, sisanya lewat "Load older"
+INDEX_CACHE_SIZE = 64  # Jumlah window (?before=) yang di-cache sampai ada pesan baru
+# Room
+DEFAULT_ROOM = 'general'  # Room untuk pesan tanpa room (dan semua pesan lama)
+# Replikasi selektif: slice yang disimpan node ini, didaftarkan ke master
+# (POST /replication/filter) supaya fan-out dan catch-up difilter di master.
+# Node dengan FAILOVER_ENABLED sebaiknya menyimpan semua. Slice yang diperluas
+# belakangan tidak mendapat history sebelum posisi replikasi node ini.
+ROOMS = None  # Room yang disimpan, mis. ['general', 'sister']; None = semua
+REPLICATION_AUTHORS = None  # Hanya pesan dari username ini, mis. ['budi']; None = semua
+REPLICATION_WINDOW_DAYS = None  # Hanya pesan N hari terakhir; None = semua
+# Format wire antar node
+WIRE_GZIP_MIN_SIZE = 1024  # Byte minimal sebelum payload di-gzip
+WIRE_GZIP_LEVEL = 5
+# Snapshot bootstrap dari master
+SNAPSHOT_BOOTSTRAP_LAG = 5000  # Tertinggal sejauh ini, salin snapshot alih-alih paging
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024  # Byte per chunk saat download snapshot
+# Failover: term-based leader election antar slave saat master mati
+FAILOVER_ENABLED = False
+NODE_URL = 'http://172.10.10.244:5001'  # URL node ini seperti dipakai node lain
+CLUSTER_NODES = []  # Slave lain yang ikut election, mis. ['http://172.10.10.245:5001']
+ELECTION_TIMEOUT = (3.0, 8.0)  # Detik acak sebelum election setelah leader offline
+# Replikasi ke follower saat node ini menjadi leader
+REPLICATION_BATCH_SIZE = 100
+REPLICATION_BATCH_WINDOW = 0.2
+REPLICATION_MAX_BACKOFF = 60
+# Retention dan maintenance database
+MESSAGE_RETENTION_DAYS = None  # Pesan lebih tua dari ini dipindah ke arsip; None = simpan selamanya
+ARCHIVE_DIR = 'archive'  # File arsip gzip JSON lines per bulan (messages-YYYY-MM.jsonl.gz)
+ARCHIVE_GZIP_LEVEL = 6
+SYNC_LOG_RETENTION_DAYS = 7  # Bookkeeping sync yang sudah selesai/basi dihapus setelah ini
+MAINTENANCE_INTERVAL = 600  # Detik antar pass maintenance
+MAINTENANCE_BATCH_SIZE = 500  # Row per transaksi arsip/prune
+MAINTENANCE_VACUUM_PAGES = 256  # Page per PRAGMA incremental_vacuum
+MAINTENANCE_SLICE_PAUSE = 0.05  # Detik jeda antar slice supaya write lain tidak tertahan
+MAINTENANCE_ANALYSIS_LIMIT = 1000  # PRAGMA analysis_limit untuk ANALYZE
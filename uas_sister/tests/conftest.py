@@ -0,0 +1,34 @@
+# Fixture untuk test master dan slave. Kedua node punya modul 'app' dan 'config'
+# sendiri, jadi modul di-import ulang per test dari folder node-nya.
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_node(node, tmp_path, monkeypatch):
+    """Import app.py node (master/slave) dengan database di tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(os.path.join(ROOT, node))
+    for name in ('app', 'config'):
+        sys.modules.pop(name, None)
+    module = importlib.import_module('app')
+    module.config.DB_PATH = str(tmp_path / f'{node}.db')
+    module.config.ARCHIVE_DIR = str(tmp_path / 'archive')
+    yield module
+    for name in ('app', 'config'):
+        sys.modules.pop(name, None)
+
+@pytest.fixture
+def master(tmp_path, monkeypatch):
+    yield from load_node('master', tmp_path, monkeypatch)
+
+@pytest.fixture
+def slave(tmp_path, monkeypatch):
+    yield from load_node('slave', tmp_path, monkeypatch)
+
+@pytest.fixture(params=['master', 'slave'])
+def node_app(request, tmp_path, monkeypatch):
+    yield from load_node(request.param, tmp_path, monkeypatch)
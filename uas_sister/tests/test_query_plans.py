@@ -0,0 +1,14 @@
+# EXPLAIN QUERY PLAN untuk HOT_QUERIES: index yang hilang (migration diubah,
+# index di-drop) harus membuat test gagal, bukan hanya warning saat startup.
+
+def test_hot_queries_use_their_index(node_app):
+    conn = node_app.get_db()
+    node_app.migrate_db(conn)
+    assert node_app.check_query_plans(conn) == []
+
+def test_dropped_index_is_reported(node_app):
+    conn = node_app.get_db()
+    node_app.migrate_db(conn)
+    conn.execute('DROP INDEX idx_messages_timestamp')
+    regressions = [name for name, _ in node_app.check_query_plans(conn)]
+    assert 'messages_since_timestamp' in regressions
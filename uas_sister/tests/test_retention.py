@@ -0,0 +1,37 @@
+def insert_old_messages(conn, count):
+    conn.executemany('''
+        INSERT INTO messages (username, message, timestamp, uid, hlc, node_id)
+        VALUES (?, ?, datetime('now', '-30 days'), ?, ?, ?)
+    ''', [('alice', f'pesan {i}', f'uid-{i}', i, 'master') for i in range(1, count + 1)])
+    conn.commit()
+
+def test_archive_keeps_messages_not_acked_by_replicas(master, monkeypatch):
+    monkeypatch.setattr(master.config, 'MESSAGE_RETENTION_DAYS', 7)
+    conn = master.get_db()
+    master.migrate_db(conn)
+    insert_old_messages(conn, 10)
+    
+    up_to_date = master.SlaveReplicator('http://slave-a')
+    lagging = master.SlaveReplicator('http://slave-b')
+    monkeypatch.setattr(master, 'slave_replicators', {'http://slave-a': up_to_date, 'http://slave-b': lagging})
+    up_to_date.ack(10)
+    lagging.ack(3)
+    
+    assert master.archive_messages_slice(100) == 3
+    messages, seq_end, _ = lagging.next_batch()
+    assert [message['message'] for message in messages] == [f'pesan {i}' for i in range(4, 11)]
+    assert seq_end == 10
+
+def test_archive_waits_for_replica_without_ack(master, monkeypatch):
+    monkeypatch.setattr(master.config, 'MESSAGE_RETENTION_DAYS', 7)
+    conn = master.get_db()
+    master.migrate_db(conn)
+    insert_old_messages(conn, 5)
+    
+    peer = master.PeerReplicator('http://peer-a')
+    monkeypatch.setattr(master, 'slave_replicators', {})
+    monkeypatch.setattr(master, 'peer_replicators', {'http://peer-a': peer})
+    assert master.archive_messages_slice(100) == 0
+    
+    peer.ack(5)
+    assert master.archive_messages_slice(100) == 4
@@ -0,0 +1,85 @@
+import sqlite3
+
+def insert_messages(conn, rows):
+    conn.executemany('''
+        INSERT INTO messages (username, message, room, uid, hlc, node_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(username, f'pesan {i}', room, f'uid-{i}', i, 'master')
+          for i, (username, room) in enumerate(rows, 1)])
+    conn.commit()
+
+def snapshot_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT id, username, room FROM messages ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+def test_snapshot_contains_only_requested_slice(master):
+    conn = master.get_db()
+    master.migrate_db(conn)
+    insert_messages(conn, [('alice', 'ops'), ('bob', 'general'), ('alice', 'general'), ('bob', 'ops')])
+    
+    path, seq, size = master.create_snapshot(rooms=['ops'])
+    try:
+        assert seq == 4
+        assert snapshot_rows(path) == [(1, 'alice', 'ops'), (4, 'bob', 'ops')]
+    finally:
+        master.remove_snapshot(path)
+    
+    path, seq, _ = master.create_snapshot(authors=['bob'])
+    try:
+        assert seq == 4
+        assert snapshot_rows(path) == [(2, 'bob', 'general'), (4, 'bob', 'ops')]
+    finally:
+        master.remove_snapshot(path)
+
+def test_full_snapshot_without_slice(master):
+    conn = master.get_db()
+    master.migrate_db(conn)
+    insert_messages(conn, [('alice', 'ops'), ('bob', 'general')])
+    
+    path, seq, _ = master.create_snapshot()
+    try:
+        assert seq == 2
+        assert len(snapshot_rows(path)) == 2
+    finally:
+        master.remove_snapshot(path)
+
+def test_last_seq_is_measured_within_the_slice(master):
+    conn = master.get_db()
+    master.migrate_db(conn)
+    insert_messages(conn, [('alice', 'ops'), ('bob', 'general'), ('alice', 'general')])
+    
+    assert master.get_last_seq() == 3
+    assert master.get_last_seq(['ops']) == 1
+    assert master.get_last_seq(None, ['bob']) == 2
+    assert master.get_last_seq(['random']) == 0
+
+def test_slave_snapshot_settles_pending_local_message(slave, tmp_path):
+    conn = slave.get_db()
+    slave.migrate_db(conn)
+    # Pesan lokal sudah sampai di master, tapi ack-nya hilang
+    local_id = conn.execute('''
+        INSERT INTO messages (username, message, origin, sync_status, uid)
+        VALUES ('alice', 'halo', 'local', 'pending', 'uid-local')
+    ''').lastrowid
+    conn.commit()
+    
+    path = str(tmp_path / 'snapshot.db')
+    snapshot = sqlite3.connect(path)
+    snapshot.execute('CREATE TABLE messages (id INTEGER PRIMARY KEY, username TEXT, message TEXT, '
+                     'timestamp DATETIME, uid TEXT, room TEXT)')
+    snapshot.executemany('INSERT INTO messages VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, ?)', [
+        (1, 'bob', 'pagi', 'uid-1', 'general'),
+        (2, 'alice', 'halo', 'uid-local', 'general'),
+        (3, 'bob', 'siang', 'uid-3', 'general'),
+    ])
+    snapshot.commit()
+    snapshot.close()
+    
+    assert slave.apply_snapshot(path, 3) == 2
+    rows = conn.execute('SELECT id, master_id, sync_status FROM messages ORDER BY master_id').fetchall()
+    assert (local_id, 2, 'synced') in rows
+    assert sorted(row[1] for row in rows) == [1, 2, 3]
+    assert slave.get_snapshot_seq() == 3
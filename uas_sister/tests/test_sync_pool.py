@@ -0,0 +1,57 @@
+import sqlite3
+import time
+
+import pytest
+
+def insert_pending_message(slave):
+    conn = slave.get_db()
+    slave.migrate_db(conn)
+    cursor = conn.execute('''
+        INSERT INTO messages (username, message, origin, sync_status, uid)
+        VALUES ('alice', 'halo', 'local', 'pending', 'uid-1')
+    ''')
+    conn.commit()
+    return cursor.lastrowid
+
+def test_dropped_retry_releases_claim(slave, monkeypatch):
+    message_id = insert_pending_message(slave)
+    # Tanpa worker: job di queue tidak pernah diambil, jadi queue tetap penuh
+    pool = slave.WorkerPool(0, 1, 0.01, 8)
+    monkeypatch.setattr(slave, 'sync_pool', pool)
+    # Backoff 5 detik dipersingkat supaya retry langsung jatuh tempo
+    monkeypatch.setattr(pool, 'schedule',
+                        lambda delay, *args, **kwargs: slave.WorkerPool.schedule(pool, 0.01, *args, **kwargs))
+    pool.start()
+    assert pool.submit(time.sleep, 0)
+    
+    def unreachable(*args, **kwargs):
+        raise ConnectionError('master unreachable')
+    monkeypatch.setattr(slave, 'is_master_online', lambda: True)
+    monkeypatch.setattr(slave, 'leader_sync_request', lambda *args: ('http://master/sync', {}))
+    monkeypatch.setattr(slave.peer_client, 'post', unreachable)
+    
+    assert slave.claim_master_sync(message_id)
+    assert slave.sync_to_master_with_retry(message_id, 'alice', 'halo', 3) is False
+    assert message_id in slave._master_sync_in_progress
+    
+    deadline = time.monotonic() + 2
+    while message_id in slave._master_sync_in_progress and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()['rejected'] == 1
+    assert message_id not in slave._master_sync_in_progress
+    
+    # periodic_sync_check mengambil pesan itu lagi
+    assert [row[0] for row in slave.claim_unsynced_messages()] == [message_id]
+    assert slave.claim_master_sync(message_id)
+
+def test_exception_releases_claim(slave, monkeypatch):
+    message_id = insert_pending_message(slave)
+    
+    def locked(message_id):
+        raise sqlite3.OperationalError('database is locked')
+    monkeypatch.setattr(slave, 'get_outgoing_message', locked)
+    
+    assert slave.claim_master_sync(message_id)
+    with pytest.raises(sqlite3.OperationalError):
+        slave.sync_to_master_with_retry(message_id, 'alice', 'halo')
+    assert message_id not in slave._master_sync_in_progress